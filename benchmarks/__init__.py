@@ -0,0 +1,6 @@
+"""
+benchmarks/__init__.py
+
+This python file contains the benchmark suite, which times and
+checks the computer vision pipeline on synthetic tray photos.
+"""
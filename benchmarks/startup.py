@@ -0,0 +1,114 @@
+"""
+benchmarks/startup.py
+
+This python file measures the cold start of the drag and drop
+application.
+
+It imports the application module in a fresh interpreter under
+python -X importtime and reports what the imports cost, heaviest
+package first. With --window it also starts the application with
+--startup-report and reports how long the first window and the
+processing took to be ready, which needs a display.
+
+Usage:
+
+    python -m benchmarks.startup --window
+"""
+
+'''Imports'''
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import namedtuple
+
+__all__ = ["APP_MODULE", "FIRST_WINDOW_SECONDS", "ImportTime", "import_times", "startup_times", "main"]
+
+# Module of the drag and drop application
+APP_MODULE = "tests.gui"
+
+# Longest accepted time to the first window
+FIRST_WINDOW_SECONDS = 1.0
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ImportTime = namedtuple("ImportTime", "name self_seconds cumulative_seconds depth")
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+_STARTUP_LINE = re.compile(r"(First window|Ready to process) after ([\d.]+) s")
+
+
+def import_times(module=APP_MODULE, python=sys.executable):
+    """
+    Import a module in a fresh interpreter and time every import.
+
+    :param module: Name of the module to import.
+    :param python: The Python interpreter to run.
+    :return list: An ImportTime per module imported, in the order they finished.
+    """
+    process = subprocess.run([python, "-X", "importtime", "-c", "import %s" % module], cwd=ROOT,
+                             capture_output=True, text=True)
+    if process.returncode:
+        raise RuntimeError("importing %s failed:\n%s" % (module, process.stderr.strip().splitlines()[-1]))
+    times = []
+    for match in _IMPORT_LINE.finditer(process.stderr):
+        self_us, cumulative_us, indent, name = match.groups()
+        times.append(ImportTime(name, int(self_us) / 1e6, int(cumulative_us) / 1e6, (len(indent) - 1) // 2))
+    return times
+
+
+def startup_times(script=os.path.join("tests", "gui.py"), python=sys.executable, timeout=60):
+    """
+    Start the application and time its first window.
+
+    :param script: Path to the application script, relative to the repository.
+    :param python: The Python interpreter to run.
+    :param timeout: Seconds to wait for the application to close.
+    :return dict: Seconds from start to the "First window" and to "Ready to process".
+    """
+    process = subprocess.run([python, script, "--startup-report"], cwd=ROOT, capture_output=True, text=True,
+                             timeout=timeout)
+    times = {name: float(seconds) for name, seconds in _STARTUP_LINE.findall(process.stderr)}
+    if "First window" not in times:
+        raise RuntimeError("the application did not report its first window:\n%s" % process.stderr.strip())
+    return times
+
+
+def main(argv=None):
+    """
+    Command line entry point for the startup benchmark.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code, 1 if the first window took longer than allowed.
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup",
+                                     description="Measure the cold start of the drag and drop application.")
+    parser.add_argument("--module", default=APP_MODULE, help="Module to time the imports of (default: %(default)s).")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list (default: %(default)s).")
+    parser.add_argument("--window", action="store_true",
+                        help="Also start the application and time its first window (needs a display).")
+    parser.add_argument("--max-first-window", type=float, default=FIRST_WINDOW_SECONDS,
+                        help="Longest accepted time to the first window in seconds (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    times = import_times(args.module)
+    total = next(time for time in reversed(times) if time.name == args.module)
+    print("import %s: %.3f s" % (args.module, total.cumulative_seconds))
+    packages = sorted((time for time in times if "." not in time.name and time.name != args.module),
+                      key=lambda time: -time.cumulative_seconds)
+    print("  %-28s %10s" % ("package", "cumulative"))
+    for time in packages[:args.top]:
+        print("  %-28s %9.3fs" % (time.name, time.cumulative_seconds))
+
+    if not args.window:
+        return 0
+    startup = startup_times()
+    for name, seconds in sorted(startup.items(), key=lambda item: item[1]):
+        print("%s after %.2f s" % (name, seconds))
+    return 0 if startup["First window"] <= args.max_first_window else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
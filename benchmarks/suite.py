@@ -0,0 +1,233 @@
+"""
+benchmarks/suite.py
+
+This python file contains the benchmark suite for the tray edge
+and contour pipeline.
+
+It draws synthetic tray photos at 2, 20 and 50 megapixels, checks
+the features extracted from them against the ground truth, times
+every stage with a StageProfiler and measures the end to end
+throughput of the batch runner with a growing number of worker
+processes. No real CR2 data or display is needed.
+
+Usage:
+
+    python -m benchmarks.suite --resolutions 2mp 20mp -o benchmark.json
+"""
+
+'''Imports'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from cv.features import extract_features
+from cv.profiling import StageProfiler
+from cv.stages import DECODE_MODES, default_pipeline
+from etl.batch import run_batch, start_pool
+from etl.scheduler import candidate_plans, thread_plan
+from .synthetic import RESOLUTIONS, generate
+
+__all__ = ["TOLERANCES", "check_accuracy", "time_stages", "measure_throughput", "run_suite", "main"]
+
+# Largest accepted errors, in full resolution pixels or as a fraction for the contour
+TOLERANCES = {"edge_row": 3, "corner": 3, "contour_area": 0.02, "contour_perimeter": 0.03}
+
+
+def check_accuracy(truth, frame):
+    """
+    Compare the results of the pipeline with the ground truth of a photo.
+
+    Every true tray corner has to be found, and no corner may be
+    found away from the true ones.
+
+    :param truth: The GroundTruth of the photo.
+    :param frame: The Frame returned by Pipeline.run().
+    :return dict: The errors and whether each one is within TOLERANCES.
+    """
+    true_corners = np.array(truth.corners)
+    corners = np.asarray(frame["corners"], np.float64).reshape(-1, 2)
+    distances = np.linalg.norm(corners[:, None] - true_corners[None], axis=2)
+    if len(corners):
+        missed = int(np.count_nonzero(distances.min(axis=0) > TOLERANCES["corner"]))
+        spurious = int(np.count_nonzero(distances.min(axis=1) > TOLERANCES["corner"]))
+    else:
+        missed, spurious = len(true_corners), 0
+
+    result = {
+        "edge_row_error": abs(frame["edge_row"] - truth.edge_row),
+        "missed_corners": missed,
+        "spurious_corners": spurious,
+        "contour_area_error": abs(frame["contour_area"] - truth.contour_area) / truth.contour_area,
+        "contour_perimeter_error": (abs(frame["contour_perimeter"] - truth.contour_perimeter)
+                                    / truth.contour_perimeter),
+        "polygon_vertices": len(frame["polygon"]),
+        # reported only, the Hough lines are a second opinion on the edge row
+        "line_edge_row_error": (None if frame["line_edge_row"] is None
+                                else abs(frame["line_edge_row"] - truth.edge_row)),
+    }
+    result["passed"] = (result["edge_row_error"] <= TOLERANCES["edge_row"] and not missed and not spurious
+                        and result["contour_area_error"] <= TOLERANCES["contour_area"]
+                        and result["contour_perimeter_error"] <= TOLERANCES["contour_perimeter"]
+                        and result["polygon_vertices"] == len(truth.polygon))
+    return result
+
+
+def time_stages(truths, pipeline, repeat=1):
+    """
+    Run the pipeline over photos with a profiler and check every result.
+
+    :param truths: GroundTruth of each photo.
+    :param pipeline: The Pipeline to run.
+    :param repeat: Number of runs per photo.
+    :return tuple: The StageProfiler and one accuracy result per photo,
+        with an "error" entry instead if the pipeline failed.
+    """
+    profiler = StageProfiler()
+    accuracy = []
+    for truth in truths:
+        for run in range(repeat):
+            try:
+                frame = pipeline.run(truth.file_name, profiler=profiler)
+            except Exception as error:
+                result = {"error": "%s: %s" % (type(error).__name__, error), "passed": False}
+            else:
+                result = check_accuracy(truth, frame)
+                del frame
+            if run == 0:
+                accuracy.append(dict(result, file=os.path.basename(truth.file_name)))
+    return profiler, accuracy
+
+
+def measure_throughput(files, threads, pipeline):
+    """
+    Time the batch runner over a set of photos.
+
+    The worker processes are started and warmed before the clock
+    starts, with a pool even for a single worker, so every worker
+    count pays the same overhead and only the images are timed.
+
+    :param files: Paths to the photos.
+    :param threads: The ThreadPlan of the workers.
+    :param pipeline: The Pipeline to run.
+    :return float: Images per second.
+    """
+    executor = start_pool(threads, warm=True)
+    try:
+        start = time.perf_counter()
+        # failures are reported by the accuracy check, only the time matters here
+        for _ in run_batch(files, pipeline=pipeline, threads=threads, executor=executor):
+            pass
+        return len(files) / (time.perf_counter() - start)
+    finally:
+        executor.shutdown()
+
+
+def run_suite(directory, resolutions=("2mp", "20mp", "50mp"), count=4, repeat=1, workers=None,
+              decode_mode="full", seed=0, log=None):
+    """
+    Run the whole benchmark.
+
+    :param directory: Directory holding the synthetic photos, drawn if missing.
+    :param resolutions: Names from RESOLUTIONS.
+    :param count: Photos per resolution.
+    :param repeat: Profiled runs per photo.
+    :param workers: Worker counts for the throughput runs, those of candidate_plans() by default.
+    :param decode_mode: One of DECODE_MODES.
+    :param seed: Base seed of the photos.
+    :param log: File to report progress to, or None.
+    :return dict: Per resolution, the accuracy results, the stage summary
+        and images per second with each worker count.
+    """
+    plans = [thread_plan(count) for count in workers] if workers else candidate_plans()
+    pipeline = default_pipeline(decode_mode)
+    # load the OpenCV kernels before anything is timed
+    extract_features(generate(directory, resolutions[:1], 1, seed)[resolutions[0]][0].file_name, pipeline)
+
+    results = {"decode_mode": decode_mode, "cores": os.cpu_count(), "resolutions": {}}
+    for resolution in resolutions:
+        if log is not None:
+            print("%s: drawing %d photos" % (resolution, count), file=log)
+        truths = generate(directory, (resolution,), count, seed)[resolution]
+        if log is not None:
+            print("%s: timing stages" % resolution, file=log)
+        profiler, accuracy = time_stages(truths, pipeline, repeat)
+        throughput = {}
+        base = plans[0].workers
+        for plan in plans:
+            if log is not None:
+                print("%s: throughput with %d workers" % (resolution, plan.workers), file=log)
+            throughput[plan.workers] = measure_throughput([truth.file_name for truth in truths], plan, pipeline)
+        results["resolutions"][resolution] = {
+            "accuracy": accuracy,
+            "stages": profiler.summary(),
+            "images_per_second": throughput,
+            "scaling": {worker_count: images_per_second / (worker_count * throughput[base] / base)
+                        for worker_count, images_per_second in throughput.items()},
+        }
+    return results
+
+
+def _report(results, output=sys.stdout):
+    """
+    Print the results of run_suite() as tables.
+
+    :param results: The dict returned by run_suite().
+    :param output: File to print to.
+    :return:
+    """
+    for resolution, result in results["resolutions"].items():
+        passed = sum(item["passed"] for item in result["accuracy"])
+        print("\n%s (%d/%d photos within tolerance)" % (resolution, passed, len(result["accuracy"])), file=output)
+        for item in result["accuracy"]:
+            if not item["passed"]:
+                print("  FAILED %s: %s" % (item["file"], item.get("error") or item), file=output)
+        print("  %-16s %10s %10s %10s" % ("stage", "p50 ms", "p95 ms", "max ms"), file=output)
+        for stage, summary in result["stages"].items():
+            print("  %-16s %10.1f %10.1f %10.1f" % (stage, 1000 * summary["wall_p50"], 1000 * summary["wall_p95"],
+                                                   1000 * summary["wall_max"]), file=output)
+        print("  %-16s %10s %10s" % ("workers", "images/s", "scaling"), file=output)
+        for worker_count, images_per_second in result["images_per_second"].items():
+            print("  %-16d %10.2f %9.0f%%" % (worker_count, images_per_second,
+                                             100 * result["scaling"][worker_count]), file=output)
+
+
+def main(argv=None):
+    """
+    Command line entry point for the benchmark suite.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code, 1 if any photo was not within tolerance.
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite",
+                                     description="Time the pipeline on synthetic tray photos and check "
+                                                 "its accuracy.")
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS), default=["2mp", "20mp", "50mp"],
+                        help="Photo sizes to benchmark (default: all).")
+    parser.add_argument("--count", type=int, default=4, help="Photos per resolution (default: %(default)s).")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Profiled runs per photo (default: %(default)s).")
+    parser.add_argument("-j", "--workers", type=int, nargs="+", default=None,
+                        help="Worker counts for the throughput runs (default: powers of two up to all cores).")
+    parser.add_argument("--decode", choices=DECODE_MODES, default="full",
+                        help="Decode mode of the pipeline (default: full).")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed of the photos (default: %(default)s).")
+    parser.add_argument("--directory", default=os.path.join(tempfile.gettempdir(), "switchgrass_benchmark"),
+                        help="Directory the photos are drawn into and reused from (default: %(default)s).")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to write the results to.")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.directory, args.resolutions, args.count, args.repeat, args.workers, args.decode,
+                        args.seed, log=sys.stderr)
+    _report(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=1)
+    return 0 if all(item["passed"] for result in results["resolutions"].values()
+                    for item in result["accuracy"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
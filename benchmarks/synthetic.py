@@ -0,0 +1,144 @@
+"""
+benchmarks/synthetic.py
+
+This python file draws synthetic switchgrass tray photos with
+a known tray edge row, known tray corners and a known tray
+outline, so the pipeline can be timed and checked without any
+real CR2 data.
+
+Each photo is a bright trapezoidal tray on noisy soil, with
+grass blades inside the tray below the edge band. The scene is
+laid out in full resolution pixels like the rig photos: the tray
+edge always falls in the band the corner stage searches, and
+only the size of the frame changes with the resolution.
+"""
+
+'''Imports'''
+import json
+import os
+from collections import namedtuple
+import numpy as np
+import cv2
+from PIL import Image
+
+__all__ = ["RESOLUTIONS", "GroundTruth", "frame_size", "draw_tray", "generate", "load_ground_truth"]
+
+# Megapixels of the generated photos by name
+RESOLUTIONS = {"2mp": 2, "20mp": 20, "50mp": 50}
+
+# Name of the ground truth file written next to the photos
+GROUND_TRUTH_FILE = "ground_truth.json"
+
+GroundTruth = namedtuple("GroundTruth", "file_name edge_row corners polygon contour_area contour_perimeter")
+
+
+def frame_size(megapixels, aspect=1.5):
+    """
+    Work out the size of a landscape frame.
+
+    :param megapixels: Number of pixels in millions.
+    :param aspect: Width over height, 3:2 like the rig camera.
+    :return tuple: (width, height) in pixels.
+    """
+    width = int(round(np.sqrt(megapixels * 1e6 * aspect)))
+    return width, int(round(width / aspect))
+
+
+def draw_tray(width, height, seed=0, edge_rows=(700, 950), cols=(300, 2200)):
+    """
+    Draw one synthetic tray photo.
+
+    :param width: Frame width in pixels.
+    :param height: Frame height in pixels, at least 1100.
+    :param seed: Seed for the layout and the noise.
+    :param edge_rows: Range the tray edge row is drawn from.
+    :param cols: Range the top tray corners are placed in.
+    :return tuple: The RGB image as uint8 and a GroundTruth without a file name.
+    """
+    if height < 1100:
+        raise ValueError("Frames need at least 1100 rows to hold the tray edge band, got %d" % height)
+    rng = np.random.default_rng(seed)
+    # small frames keep the tray high enough to fill a fair part of the frame,
+    # since the contrast stage thresholds around the mean gray level
+    edge_row = int(rng.integers(edge_rows[0], max(edge_rows[0] + 1, min(edge_rows[1], height - 400))))
+    right_limit = min(cols[1], width - 100)
+    left = int(rng.integers(cols[0], cols[0] + 300))
+    right = int(rng.integers(right_limit - 300, right_limit))
+    bottom = height - 60
+    spread = int(rng.integers(20, 80))
+    # the tray widens towards the bottom of large frames, where the top
+    # corners can only take up a small part of the width
+    bottom_right = min(width - 20, max(right + spread, int(0.6 * width)))
+    polygon = np.array([[left, edge_row], [right, edge_row],
+                        [bottom_right, bottom], [max(20, left - spread), bottom]], np.int32)
+
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = (70, 55, 40)
+    cv2.fillPoly(image, [polygon], (215, 210, 195))
+
+    # grass blades inside the tray, kept clear of the edge band and the tray outline
+    blade_top = edge_row + 300
+    if bottom - blade_top > 200:
+        for _ in range(int(rng.integers(20, 40))):
+            x = int(rng.integers(left + 40, right - 40))
+            y = int(rng.integers(blade_top, bottom - 150))
+            length = int(rng.integers(60, min(600, bottom - 40 - y)))
+            lean = int(rng.integers(-30, 30))
+            cv2.line(image, (x, y), (x + lean, y + length), (60, 140, 50), int(rng.integers(3, 9)))
+
+    noise = rng.normal(0, 4, (height, width, 1)).astype(np.int16)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+
+    truth = GroundTruth(None, edge_row, polygon[:2].astype(float).tolist(), polygon.tolist(),
+                        float(cv2.contourArea(polygon)), float(cv2.arcLength(polygon, True)))
+    return image, truth
+
+
+def generate(directory, resolutions=("2mp", "20mp", "50mp"), count=2, seed=0, quality=95):
+    """
+    Write synthetic tray photos and their ground truth to a directory.
+
+    Photos are named after their resolution and seed, and the same
+    seed always draws the same photo, so existing files are reused.
+    The ground truth of photos drawn by earlier calls is kept.
+
+    :param directory: Directory to write to, created if missing.
+    :param resolutions: Names from RESOLUTIONS.
+    :param count: Photos per resolution.
+    :param seed: Base seed for the layouts.
+    :param quality: JPEG quality of the photos.
+    :return dict: Resolution name to the list of GroundTruth of its photos.
+    """
+    os.makedirs(directory, exist_ok=True)
+    truths = {}
+    for resolution in resolutions:
+        width, height = frame_size(RESOLUTIONS[resolution])
+        truths[resolution] = []
+        for index in range(count):
+            file_name = os.path.join(directory, "%s_%04d.jpg" % (resolution, seed + index))
+            image, truth = draw_tray(width, height, seed + index)
+            if not os.path.exists(file_name):
+                Image.fromarray(image).save(file_name, quality=quality)
+            truths[resolution].append(truth._replace(file_name=file_name))
+
+    saved = load_ground_truth(directory) if os.path.exists(os.path.join(directory, GROUND_TRUTH_FILE)) else {}
+    for resolution, resolution_truths in truths.items():
+        merged = {os.path.basename(truth.file_name): truth for truth in saved.get(resolution, [])}
+        merged.update((os.path.basename(truth.file_name), truth) for truth in resolution_truths)
+        saved[resolution] = [merged[name] for name in sorted(merged)]
+    with open(os.path.join(directory, GROUND_TRUTH_FILE), "w") as output:
+        json.dump({resolution: [truth._asdict() for truth in resolution_truths]
+                   for resolution, resolution_truths in saved.items()}, output, indent=1)
+    return truths
+
+
+def load_ground_truth(directory):
+    """
+    Read the ground truth written by generate().
+
+    :param directory: The directory holding the photos.
+    :return dict: Resolution name to the list of GroundTruth of its photos.
+    """
+    with open(os.path.join(directory, GROUND_TRUTH_FILE)) as ground_truth:
+        return {resolution: [GroundTruth(**truth) for truth in truths]
+                for resolution, truths in json.load(ground_truth).items()}
@@ -0,0 +1,162 @@
+"""
+benchmarks/tethered.py
+
+This python file measures the latency of the watch folder mode
+the way a tethered capture session would see it.
+
+A writer thread plays the camera: every interval seconds it takes
+a shot, i.e. writes a synthetic tray photo into a temporary
+directory in chunks over write_seconds, the way a camera streams
+a file to disk, or under a temporary name that is renamed at the
+end. The watch folder mode runs on the same directory, and the
+time from every shutter to its row is reported. Only a writable
+temporary directory is needed.
+
+Usage:
+
+    python -m benchmarks.tethered --shots 10 --interval 1 --max-latency 3
+"""
+
+'''Imports'''
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from PIL import Image
+from cv.stages import default_pipeline
+from etl.watch import DEFAULT_POLL_SECONDS, DEFAULT_STABLE_SECONDS, FolderWatcher, ingest
+from .synthetic import RESOLUTIONS, draw_tray, frame_size
+
+__all__ = ["encode_shots", "shoot", "measure_latency", "main"]
+
+
+def encode_shots(count, megapixels=2, seed=0, quality=95):
+    """
+    Draw and encode the photos the simulated camera takes.
+
+    :param count: Number of photos.
+    :param megapixels: Size of the photos.
+    :param seed: Seed of the first photo.
+    :param quality: JPEG quality.
+    :return list: The JPEG bytes of every photo.
+    """
+    shots = []
+    for index in range(count):
+        image, _ = draw_tray(*frame_size(megapixels), seed=seed + index)
+        encoded = io.BytesIO()
+        Image.fromarray(image).save(encoded, "JPEG", quality=quality)
+        shots.append(encoded.getvalue())
+    return shots
+
+
+def shoot(directory, shots, interval, write_seconds, rename, shutters, chunks=8):
+    """
+    Write the photos into a directory like a tethered camera, one every interval.
+
+    :param directory: The watched directory.
+    :param shots: The JPEG bytes of every photo.
+    :param interval: Seconds between shutters.
+    :param write_seconds: Seconds writing one photo takes.
+    :param rename: Whether photos are written under a temporary name and renamed.
+    :param shutters: Dict filled with the shutter time.time() of every photo by path.
+    :param chunks: Number of writes per photo.
+    :return:
+    """
+    start = time.monotonic()
+    for index, data in enumerate(shots):
+        time.sleep(max(0, start + index * interval - time.monotonic()))
+        path = os.path.join(directory, "IMG_%04d.JPG" % index)
+        shutters[path] = time.time()
+        with open(path + ".part" if rename else path, "wb") as output:
+            for chunk in np.array_split(np.frombuffer(data, np.uint8), chunks):
+                output.write(chunk.tobytes())
+                output.flush()
+                time.sleep(write_seconds / chunks)
+        if rename:
+            os.rename(path + ".part", path)
+
+
+def measure_latency(shots, interval=1.0, write_seconds=0.2, rename=False, workers=None,
+                    stable_seconds=DEFAULT_STABLE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, pipeline=None):
+    """
+    Run a simulated tethered session through the watch folder mode.
+
+    :param shots: The JPEG bytes of every photo.
+    :param interval: Seconds between shutters.
+    :param write_seconds: Seconds writing one photo takes.
+    :param rename: Whether photos are written under a temporary name and renamed.
+    :param workers: Number of worker processes, all cores by default.
+    :param stable_seconds: See FolderWatcher.
+    :param poll_seconds: See FolderWatcher.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :return list: Seconds from shutter to row of every photo, in shutter order.
+    """
+    shutters = {}
+    latencies = {}
+    with tempfile.TemporaryDirectory() as directory, \
+            FolderWatcher(directory, stable_seconds=stable_seconds, poll_seconds=poll_seconds) as watcher:
+        stop = threading.Event()
+        camera = threading.Thread(target=shoot, args=(directory, shots, interval, write_seconds, rename, shutters),
+                                  daemon=True)
+        rows = ingest(watcher, pipeline or default_pipeline(), workers, stop)
+        # let the worker processes start before the first shutter
+        next(rows)
+        camera.start()
+        for row in rows:
+            if row is None:
+                continue
+            if row["status"] != "ok":
+                raise RuntimeError("%s: %s" % (row["file"], row["error"]))
+            latencies[row["file"]] = time.time() - shutters[row["file"]]
+            if len(latencies) == len(shots):
+                stop.set()
+        camera.join()
+    return [latencies[path] for path in sorted(shutters, key=shutters.get)]
+
+
+def main(argv=None):
+    """
+    Command line entry point for the tethered capture benchmark.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code, 1 if a photo took longer than --max-latency.
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.tethered",
+                                     description="Measure the shutter to row latency of the watch folder mode.")
+    parser.add_argument("--shots", type=int, default=10, help="Number of photos (default: %(default)s).")
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="2mp",
+                        help="Size of the photos (default: %(default)s).")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Seconds between shutters (default: %(default)s).")
+    parser.add_argument("--write-seconds", type=float, default=0.2,
+                        help="Seconds the camera takes to write a photo (default: %(default)s).")
+    parser.add_argument("--rename", action="store_true",
+                        help="Write every photo under a temporary name and rename it when done.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores).")
+    parser.add_argument("--stable", type=float, default=DEFAULT_STABLE_SECONDS,
+                        help="Seconds a file has to stop growing before it is processed (default: %(default)s).")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS,
+                        help="Seconds between scans of the directory (default: %(default)s).")
+    parser.add_argument("--max-latency", type=float, default=None,
+                        help="Fail if any photo takes longer than this from shutter to row.")
+    args = parser.parse_args(argv)
+
+    shots = encode_shots(args.shots, RESOLUTIONS[args.resolution])
+    latencies = np.array(measure_latency(shots, args.interval, args.write_seconds, args.rename, args.workers,
+                                         args.stable, args.poll))
+    for index, latency in enumerate(latencies):
+        print("shot %3d  %.2fs" % (index, latency))
+    print("p50 %.2fs  p95 %.2fs  max %.2fs" % (np.percentile(latencies, 50), np.percentile(latencies, 95),
+                                              latencies.max()))
+    if args.max_latency is not None and latencies.max() > args.max_latency:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# -*- mode: python -*-
+"""PyInstaller spec file for the drag and drop application.
+
+Build it from the repository root with:
+
+    pyinstaller build_materials/switchgrass.spec
+
+It builds a one-folder bundle rather than a single file, since a
+single file executable unpacks everything to a temporary directory
+on every start. Packages the application never imports are left out,
+so they are neither shipped nor scanned.
+"""
+
+import os
+
+ROOT = os.path.dirname(SPECPATH)
+
+a = Analysis(
+    [os.path.join(ROOT, "tests", "gui.py")],
+    pathex=[ROOT],
+    hookspath=[os.path.join(SPECPATH, "hooks")],
+    # matplotlib and scikit-learn were only used by earlier versions of the application
+    excludes=["matplotlib", "sklearn", "scipy", "pandas", "pyarrow", "IPython", "pytest"],
+)
+pyz = PYZ(a.pure)
+exe = EXE(pyz, a.scripts, [], exclude_binaries=True, name="switchgrass", console=False)
+coll = COLLECT(exe, a.binaries, a.datas, name="switchgrass")
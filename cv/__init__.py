@@ -3,4 +3,12 @@ cv/__init__.py
 
 The initialization file for the computer
 vision sub-module.
-"""
\ No newline at end of file
+"""
+
+from .pipeline import *
+from .stages import *
+from .cache import *
+from .memo import *
+from .profiling import *
+from .tiling import *
+from .rig import *
\ No newline at end of file
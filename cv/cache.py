@@ -0,0 +1,160 @@
+"""
+cv/cache.py
+
+This python file contains the on-disk cache for decoded and
+grayscale images.
+
+Entries are uncompressed .npy files named after the content
+hash of the source file and the decode options, so an image
+is never decoded twice while its bytes stay the same. Hits
+are memory mapped read-only instead of being read into memory.
+"""
+
+'''Imports'''
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+__all__ = ["DEFAULT_CACHE_DIR", "DEFAULT_CACHE_BYTES", "file_digest", "ArrayCache"]
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "switchgrass_cv")
+DEFAULT_CACHE_BYTES = 10 * 1024 ** 3
+
+# Bytes read at a time while hashing a file
+_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(file_name):
+    """
+    Hash the contents of a file.
+
+    :param file_name: Path to the file.
+    :return str: The hex digest.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArrayCache:
+    """
+    A size bounded, least recently used cache of arrays on disk.
+
+    Several processes can share one directory: entries are written
+    to a temporary file and renamed into place, and files that
+    disappear while evicting are skipped. The modification time of
+    an entry is bumped on every hit and used as its last use.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        Initialize the cache.
+
+        :param directory: Directory holding the entries, created if needed.
+        :param max_bytes: Total size the entries are evicted down to.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def __repr__(self):
+        return "ArrayCache(%r, max_bytes=%d)" % (self.directory, self.max_bytes)
+
+    def key(self, file_name, **options):
+        """
+        Build the key for a source file and the options it is decoded with.
+
+        :param file_name: Path to the source file.
+        :param options: Anything that changes the decoded array.
+        :return str:
+        """
+        digest = hashlib.blake2b(file_digest(file_name).encode(), digest_size=16)
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key, name):
+        return os.path.join(self.directory, "%s-%s.npy" % (key, name))
+
+    def get(self, key, name):
+        """
+        Look up an entry.
+
+        :param key: The key from key().
+        :param name: Which array of the source, e.g. "rgb" or "gray".
+        :return numpy.ndarray: A read-only memory map, or None on a miss.
+        """
+        path = self._path(key, name)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted meanwhile or truncated
+            return None
+        return array
+
+    def put(self, key, name, array):
+        """
+        Store an entry and evict old entries if the cache is too large.
+
+        :param key: The key from key().
+        :param name: Which array of the source, e.g. "rgb" or "gray".
+        :param array: The array to store.
+        :return:
+        """
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                np.save(file, np.asarray(array))
+            os.replace(temporary_path, self._path(key, name))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits.
+
+        :return int: The number of bytes still in the cache.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for modified, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another process, or still mapped on Windows
+                continue
+            total -= size
+        return total
+
+    def clear(self):
+        """
+        Remove every entry.
+
+        :return:
+        """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".npy", ".tmp")):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
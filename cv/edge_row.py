@@ -0,0 +1,119 @@
+"""
+cv/edge_row.py
+
+This python file contains the estimator for the tray edge row.
+
+The row is the mean height of the flattest combination of
+corners, where flatness is the absolute slope of a least
+squares line through the combination. The slopes of every
+combination are computed in closed form with NumPy, a block of
+combinations at a time, instead of fitting one regression model
+per combination.
+"""
+
+'''Imports'''
+import numpy as np
+
+__all__ = ["estimate_edge_row"]
+
+
+# Combinations scored at once, small enough for the arrays of a block to stay in the CPU cache
+_BLOCK_SIZE = 1 << 15
+
+# Slopes closer than this count as equally flat, so the earlier combination wins
+_TIE = 1e-9
+
+
+def _flattest_triple(x, y):
+    """
+    Find the triple of points with the flattest least squares line.
+
+    Every triple (i, j, k) is measured from its first point, with
+    u, v and s, t the offsets of points j and k from point i. Twice
+    its slope is then
+
+        (u * (2 * v - t) + s * (2 * t - v)) / (u * (u - s) + s * s)
+
+    so the slope of three points on one row is exactly 0, as with a
+    regression fitted to them. Three points in one column have no
+    slope and count as flat too, like the minimum norm solution of
+    the regression. Triples are scored in itertools.combinations
+    order, a block of first points at a time, and the first
+    flattest one is returned.
+
+    :param x: float64 x values.
+    :param y: float64 y values.
+    :return tuple: Indices of the first flattest triple.
+    """
+    count = len(x)
+    # every pair j < k in combinations order, so the pairs after a first point i are the ones from starts[i + 1] on
+    second, third = np.triu_indices(count, 1)
+    starts = np.searchsorted(second, np.arange(count + 1))
+    x_second, y_second, x_third, y_third = x[second], y[second], x[third], y[third]
+
+    best_triple = None
+    best_coef = np.inf
+    first = 0
+    while first < count - 2:
+        offset = starts[first + 1]
+        last = min(count - 2, first + max(1, _BLOCK_SIZE // (len(second) - offset)))
+        xi = x[first:last, None]
+        yi = y[first:last, None]
+        u = x_second[offset:] - xi
+        v = y_second[offset:] - yi
+        s = x_third[offset:] - xi
+        t = y_third[offset:] - yi
+        numerator = v + v
+        numerator -= t
+        numerator *= u
+        t += t
+        t -= v
+        t *= s
+        numerator += t
+        np.abs(numerator, out=numerator)
+        u -= s
+        u *= x_second[offset:] - xi
+        s *= s
+        u += s
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coefs = np.divide(numerator, u, out=numerator)
+        # pairs starting at or before the first point are not combinations
+        for row in range(1, last - first):
+            coefs[row, :starts[first + row + 1] - offset] = np.inf
+
+        index = np.argmin(coefs)
+        if np.isnan(coefs.flat[index]):
+            # 0 / 0 only comes from three points in one column
+            coefs[np.isnan(coefs)] = 0
+            index = np.argmin(coefs)
+        lowest = coefs.flat[index]
+        if lowest < best_coef - 2 * _TIE:
+            index = np.argmax(coefs <= lowest + 2 * _TIE)
+            row, column = np.unravel_index(index, coefs.shape)
+            best_coef = lowest
+            best_triple = (first + row, second[offset + column], third[offset + column])
+        first = last
+    return tuple(int(index) for index in best_triple)
+
+
+def estimate_edge_row(corners):
+    """
+    Estimate the tray edge row from the corners found near it.
+
+    Every combination of three corners (two if there are only two)
+    is scored by the absolute slope of its least squares line, and
+    the first flattest one in itertools.combinations order wins.
+
+    :param corners: float array of shape (N, 2) holding x, y.
+    :return int: The rounded mean row of the flattest combination.
+    """
+    corners = np.asarray(corners)
+    if len(corners) < 2:
+        raise ValueError("Found %d corners near the tray edge, need at least 2" % len(corners))
+
+    if len(corners) >= 3:
+        best_corner_combo = list(_flattest_triple(corners[:, 0].astype(np.float64),
+                                                  corners[:, 1].astype(np.float64)))
+    else:
+        best_corner_combo = [0, 1]
+    return int(round(np.mean(corners[best_corner_combo, 1])))
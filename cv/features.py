@@ -0,0 +1,71 @@
+"""
+cv/features.py
+
+This python file reduces the results of the tray edge and
+contour pipeline to one row of features per image, so they
+can be written out by the ETL pipeline.
+"""
+
+'''Imports'''
+import numpy as np
+from .stages import RAW_EXTENSIONS, IMAGE_EXTENSIONS, default_pipeline
+
+__all__ = ["RAW_EXTENSIONS", "IMAGE_EXTENSIONS", "FEATURE_COLUMNS", "FEATURE_ARRAYS", "FEATURE_INPUTS",
+           "frame_features", "extract_features"]
+
+FEATURE_COLUMNS = ("edge_row", "crop_top", "crop_bottom", "crop_left", "crop_right",
+                   "corner_count", "line_count", "contour_count", "contour_area",
+                   "contour_perimeter", "polygon_vertices", "line_edge_row")
+
+# Features holding a variable number of (x, y) points, kept in the rows next to
+# FEATURE_COLUMNS for the feature store but not written to CSV
+FEATURE_ARRAYS = ("polygon",)
+
+# Frame keys read by frame_features()
+FEATURE_INPUTS = ("edge_row", "crop", "corners", "lines", "contour_count", "contour_area",
+                  "contour_perimeter", "polygon", "line_edge_row")
+
+_pipeline = None
+
+
+def frame_features(frame):
+    """
+    Pull the features out of a processed frame.
+
+    :param frame: The Frame returned by Pipeline.run().
+    :return dict: One value per name in FEATURE_COLUMNS and FEATURE_ARRAYS.
+    """
+    lines = frame["lines"]
+    crop = frame["crop"]
+    return {
+        "edge_row": frame["edge_row"],
+        "crop_top": crop.top,
+        "crop_bottom": crop.bottom,
+        "crop_left": crop.left,
+        "crop_right": crop.right,
+        "corner_count": len(frame["corners"]),
+        "line_count": int(np.count_nonzero(lines[:, 1] == lines[:, 3])),
+        "contour_count": frame["contour_count"],
+        "contour_area": frame["contour_area"],
+        "contour_perimeter": frame["contour_perimeter"],
+        "polygon_vertices": len(frame["polygon"]),
+        "polygon": frame["polygon"].reshape(-1, 2),
+        "line_edge_row": "" if frame["line_edge_row"] is None else frame["line_edge_row"],
+    }
+
+
+def extract_features(file_name, pipeline=None, profiler=None):
+    """
+    Run the tray edge and contour algorithm on a single image.
+
+    :param file_name: Path to a .CR2 or JPEG file.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param profiler: A StageProfiler to record the stages with, or None.
+    :return dict: One value per name in FEATURE_COLUMNS and FEATURE_ARRAYS.
+    """
+    global _pipeline
+    if pipeline is None:
+        if _pipeline is None:
+            _pipeline = default_pipeline()
+        pipeline = _pipeline
+    return frame_features(pipeline.run(file_name, keep=FEATURE_INPUTS, profiler=profiler))
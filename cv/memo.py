@@ -0,0 +1,159 @@
+"""
+cv/memo.py
+
+This python file contains the in-memory memo of stage outputs
+and the parameter sweep built on top of it.
+
+A sweep over, say, two Canny threshold pairs and three Harris
+k values decodes, converts and enhances every sample image
+once; only the stages downstream of a changed parameter run
+again for each combination.
+"""
+
+'''Imports'''
+import itertools
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+__all__ = ["DEFAULT_MEMO_BYTES", "StageMemo", "SweepResult", "parameter_grid", "sweep"]
+
+DEFAULT_MEMO_BYTES = 2 * 1024 ** 3
+
+SweepResult = namedtuple("SweepResult", "file_name params frame error")
+
+
+def _nbytes(value):
+    """
+    Estimate the memory held by a stage output.
+
+    :param value: An array, a list or tuple of arrays, or anything small.
+    :return int:
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return 64
+
+
+def _freeze(value):
+    """
+    Make the arrays in a stage output read-only, since they are shared.
+
+    :param value: A stage output.
+    :return:
+    """
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _freeze(item)
+
+
+class StageMemo:
+    """
+    A size bounded, least recently used store of stage outputs.
+
+    Keys are the provenance keys built by Stage.key(). Stored
+    arrays are made read-only, since every later run that hits
+    the same key gets the very same objects.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMO_BYTES):
+        """
+        Initialize the memo.
+
+        :param max_bytes: Memory the stored outputs are evicted down to.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up the outputs of a stage.
+
+        :param key: The provenance key.
+        :return tuple: The outputs, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, outputs):
+        """
+        Store the outputs of a stage.
+
+        :param key: The provenance key.
+        :param outputs: The tuple returned by Stage.evaluate().
+        :return:
+        """
+        _freeze(outputs)
+        size = _nbytes(outputs)
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (outputs, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """
+        Drop every stored output.
+
+        :return:
+        """
+        self._entries.clear()
+        self.nbytes = 0
+
+
+def parameter_grid(grid):
+    """
+    Expand a grid of parameter values into every combination.
+
+    :param grid: Dict mapping "stage.parameter" to a list of values.
+    :return list: One dict of "stage.parameter" overrides per combination.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(pipeline, files, grid, memo=None):
+    """
+    Run every combination of a parameter grid over a set of images.
+
+    Images are processed one at a time with every combination,
+    so the memo only needs to hold the intermediate results of
+    one image to share everything upstream of the swept stages.
+
+    Example:
+
+        sweep(default_pipeline(), samples, {"edges.thresholds": [(75, 150), (75, 200)],
+                                            "corners.k": [0.001, 0.01]})
+
+    :param pipeline: The Pipeline to configure for each combination.
+    :param files: Paths to the sample images.
+    :param grid: Dict mapping "stage.parameter" to a list of values.
+    :param memo: The StageMemo to share results through, a new one if None.
+    :return generator: A SweepResult per image and combination, with
+        the frame set on success and the exception otherwise.
+    """
+    memo = StageMemo() if memo is None else memo
+    configurations = [(params, pipeline.configured(params)) for params in parameter_grid(grid)]
+    for file_name in files:
+        for params, configured in configurations:
+            try:
+                frame = configured.run(file_name, memo=memo)
+            except Exception as error:
+                yield SweepResult(file_name, params, None, error)
+            else:
+                yield SweepResult(file_name, params, frame, None)
@@ -0,0 +1,317 @@
+"""
+cv/pipeline.py
+
+This python file contains the base classes used to build
+the computer vision algorithm out of named stages.
+
+Every stage reads named values from a Frame and writes its
+own named values back to it, so stages can be timed, cached
+or run somewhere else without knowing about each other.
+"""
+
+'''Imports'''
+import copy
+import os
+
+__all__ = ["Frame", "Stage", "Pipeline"]
+
+
+def _source_key(name, value):
+    """
+    Build the provenance key of a source value.
+
+    Files are identified by their path, size and modification
+    time, other values by themselves if hashable or else by
+    their identity.
+
+    :param name: The frame key.
+    :param value: The value.
+    :return tuple:
+    """
+    if name == "file_name" and isinstance(value, str):
+        try:
+            stat = os.stat(value)
+        except OSError:
+            return name, value
+        return name, value, stat.st_size, stat.st_mtime_ns
+    try:
+        hash(value)
+    except TypeError:
+        return name, "id", id(value)
+    return name, value
+
+
+class Frame(dict):
+    """
+    The named intermediate results for a single image.
+
+    Alongside every value the frame keeps its provenance: a
+    hashable key built from the sources and from the name and
+    parameters of every stage that led to the value. Two values
+    with the same provenance are the same result.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.provenance = {name: _source_key(name, value) for name, value in self.items()}
+
+    def __repr__(self):
+        return "Frame(%s)" % ", ".join(sorted(self))
+
+    def add_source(self, name, value):
+        """
+        Add a value that did not come from a stage.
+
+        :param name: The frame key.
+        :param value: The value.
+        :return:
+        """
+        self[name] = value
+        self.provenance[name] = _source_key(name, value)
+
+
+class Stage:
+    """
+    The base class for all of the pipeline stages.
+
+    Subclasses set the class attributes below and implement
+    process(), which receives one argument per name in inputs
+    and returns one value per name in outputs (a single value
+    if there is only one output). process() must not modify its
+    inputs, since they can be shared between runs.
+    """
+    name = None
+    inputs = ()
+    outputs = ()
+    defaults = {}
+
+    def __init__(self, name=None, inputs=None, outputs=None, **params):
+        """
+        Initialize the stage.
+
+        :param name: Overrides the default name of the stage.
+        :param inputs: Overrides the frame keys read by the stage.
+        :param outputs: Overrides the frame keys written by the stage.
+        :param params: Overrides for the entries in defaults.
+        """
+        self._check_params(params)
+        self.name = name or self.name or type(self).__name__
+        self.inputs = tuple(self.inputs if inputs is None else inputs)
+        self.outputs = tuple(self.outputs if outputs is None else outputs)
+        self.params = dict(self.defaults, **params)
+
+    def __repr__(self):
+        return "%s(name=%r, %s)" % (type(self).__name__, self.name,
+                                    ", ".join("%s=%r" % item for item in sorted(self.params.items())))
+
+    def _check_params(self, params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise TypeError("%s got unexpected parameters: %s"
+                            % (type(self).__name__, ", ".join(sorted(unknown))))
+
+    def configured(self, **params):
+        """
+        Copy the stage with some parameters changed.
+
+        :param params: Overrides for the entries in params.
+        :return Stage:
+        """
+        self._check_params(params)
+        stage = copy.copy(self)
+        stage.params = dict(self.params, **params)
+        return stage
+
+    def key(self, frame):
+        """
+        Build the provenance key of the outputs for a frame.
+
+        :param frame: The Frame holding every input of the stage.
+        :return tuple:
+        """
+        return (self.name, type(self).__name__, repr(sorted(self.params.items())),
+                tuple(frame.provenance[key] for key in self.inputs))
+
+    def evaluate(self, frame):
+        """
+        Compute the outputs of the stage without storing them.
+
+        :param frame: The Frame holding every input of the stage.
+        :return tuple: One value per name in outputs.
+        """
+        values = self.process(*[frame[key] for key in self.inputs])
+        if len(self.outputs) == 1:
+            values = (values,)
+        return tuple(values)
+
+    def store(self, frame, values, key=None):
+        """
+        Write the outputs of the stage to a frame.
+
+        :param frame: The Frame to write to.
+        :param values: One value per name in outputs.
+        :param key: The provenance key from key(), computed if None.
+        :return Frame: The same frame.
+        """
+        if key is None:
+            key = self.key(frame)
+        for name, value in zip(self.outputs, values):
+            frame[name] = value
+            frame.provenance[name] = (key, name)
+        return frame
+
+    def run(self, frame):
+        """
+        Run the stage on a frame.
+
+        :param frame: The Frame holding every input of the stage.
+        :return Frame: The same frame with the outputs added.
+        """
+        key = self.key(frame)
+        return self.store(frame, self.evaluate(frame), key)
+
+    def process(self, *inputs):
+        """
+        The main code block for the stage.
+
+        :return:
+        """
+        raise NotImplementedError
+
+
+class Pipeline:
+    """
+    An ordered chain of stages.
+    """
+
+    def __init__(self, stages, sources=("file_name",)):
+        """
+        Initialize the pipeline.
+
+        Checks that stage names are unique and that every input
+        is either a source or the output of an earlier stage.
+
+        :param stages: The stages in the order they run.
+        :param sources: Frame keys that are supplied to run().
+        """
+        self.stages = list(stages)
+        self.sources = tuple(sources)
+
+        available = set(self.sources)
+        names = set()
+        # index of the last stage reading each key
+        self._last_use = {}
+        for index, stage in enumerate(self.stages):
+            self._last_use.update(dict.fromkeys(stage.inputs, index))
+            if stage.name in names:
+                raise ValueError("Duplicate stage name %r" % stage.name)
+            names.add(stage.name)
+            missing = [key for key in stage.inputs if key not in available]
+            if missing:
+                raise ValueError("Stage %r needs %s, which no earlier stage provides"
+                                 % (stage.name, ", ".join(missing)))
+            available.update(stage.outputs)
+
+    def __getitem__(self, name):
+        """
+        Look up a stage by name.
+
+        :param name: The stage name.
+        :return Stage:
+        """
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def configured(self, overrides):
+        """
+        Copy the pipeline with some stage parameters changed.
+
+        :param overrides: Dict mapping "stage.parameter" to the new value.
+        :return Pipeline:
+        """
+        stage_params = {}
+        for name, value in overrides.items():
+            stage_name, _, param = name.rpartition(".")
+            self[stage_name]  # raises KeyError for an unknown stage
+            stage_params.setdefault(stage_name, {})[param] = value
+        return Pipeline([stage.configured(**stage_params[stage.name]) if stage.name in stage_params else stage
+                         for stage in self.stages], self.sources)
+
+    def split(self, name):
+        """
+        Split the pipeline into two after a stage.
+
+        The second pipeline continues from the frames produced by
+        the first one through resume().
+
+        :param name: Name of the last stage of the first pipeline.
+        :return tuple: The two pipelines.
+        """
+        index = self.stages.index(self[name]) + 1
+        head = Pipeline(self.stages[:index], self.sources)
+        available = list(self.sources)
+        for stage in head.stages:
+            available.extend(key for key in stage.outputs if key not in available)
+        return head, Pipeline(self.stages[index:], available)
+
+    def run(self, file_name=None, memo=None, keep=None, profiler=None, **values):
+        """
+        Run every stage on one image.
+
+        With a memo, a stage whose inputs and parameters were seen
+        before reuses the stored outputs instead of running again,
+        so only the stages after a changed parameter are recomputed.
+
+        With keep, every other value is dropped from the frame as
+        soon as no later stage reads it, so full frame intermediates
+        such as the decoded image do not stay alive until the end.
+
+        :param file_name: Path to the image, stored as the file_name source.
+        :param memo: A StageMemo shared between runs, or None.
+        :param keep: Frame keys the caller needs, or None to keep everything.
+        :param profiler: A StageProfiler to record every stage with, or None.
+        :param values: Any other sources the pipeline was built with.
+        :return Frame: The intermediate results keyed by name.
+        """
+        frame = Frame(values)
+        if file_name is not None:
+            frame.add_source("file_name", file_name)
+        return self.resume(frame, memo, keep, profiler)
+
+    def resume(self, frame, memo=None, keep=None, profiler=None):
+        """
+        Run every stage on a frame that already holds the sources.
+
+        :param frame: The Frame to continue, e.g. from the first half of split().
+        :param memo: See run().
+        :param keep: See run().
+        :param profiler: See run().
+        :return Frame: The same frame.
+        """
+        for index, stage in enumerate(self.stages):
+            if profiler is not None:
+                profiler.start(stage, frame)
+            cached = False
+            if memo is None:
+                stage.run(frame)
+            else:
+                key = stage.key(frame)
+                outputs = memo.get(key)
+                cached = outputs is not None
+                if not cached:
+                    outputs = stage.evaluate(frame)
+                    memo.put(key, outputs)
+                stage.store(frame, outputs, key)
+                del outputs
+            if profiler is not None:
+                profiler.stop(stage, frame, cached)
+            if keep is not None:
+                for name in [name for name in frame
+                             if name not in keep and self._last_use.get(name, -1) <= index]:
+                    del frame[name]
+        return frame
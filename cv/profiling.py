@@ -0,0 +1,200 @@
+"""
+cv/profiling.py
+
+This python file contains the instrumentation for the pipeline
+stages.
+
+A StageProfiler passed to Pipeline.run() records, for every
+stage of every image, the wall time, the CPU time of the running
+thread, the input and output shapes and, optionally, the peak
+memory allocated through tracemalloc. The records can be summed
+up per stage (p50, p95 and max) and written as JSON or CSV so
+runs of different versions can be compared.
+"""
+
+'''Imports'''
+import csv
+import json
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+__all__ = ["StageProfiler"]
+
+# Record fields summarised per stage
+SUMMARY_FIELDS = ("wall", "cpu", "peak_bytes")
+
+
+def _shape(value):
+    """
+    Describe the shape of a frame value.
+
+    :param value: An array, a sequence of arrays or a scalar.
+    :return: The array shape as a list, the length of a sequence, or None.
+    """
+    if isinstance(value, np.ndarray):
+        return list(value.shape)
+    if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return len(value)
+    return None
+
+
+class StageProfiler:
+    """
+    Collects one record per stage per image.
+
+    The profiler can be shared by threads. Peak memory is only
+    tracked with memory=True, since tracemalloc slows every
+    allocation down. Its peak is process wide, and starting a stage
+    resets it, so a stage that ran while another thread was running
+    a stage gets no peak_bytes (None) rather than a wrong one.
+    """
+
+    def __init__(self, memory=False):
+        """
+        Initialize the profiler.
+
+        :param memory: Whether to trace allocations with tracemalloc.
+        """
+        self.memory = memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # stages running right now, and how many stages started while another one was running
+        self._running = 0
+        self._overlaps = 0
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, stage, frame):
+        """
+        Start measuring a stage.
+
+        :param stage: The Stage about to run.
+        :param frame: The Frame it runs on.
+        :return:
+        """
+        local = self._local
+        local.inputs = {key: _shape(frame.get(key)) for key in stage.inputs}
+        if self.memory:
+            with self._lock:
+                self._running += 1
+                if self._running > 1:
+                    self._overlaps += 1
+                else:
+                    tracemalloc.reset_peak()
+                local.overlaps = None if self._running > 1 else self._overlaps
+                local.memory = tracemalloc.get_traced_memory()[0]
+        local.cpu = time.thread_time()
+        local.wall = time.perf_counter()
+
+    def stop(self, stage, frame, cached=False):
+        """
+        Finish measuring a stage and store its record.
+
+        :param stage: The Stage that ran.
+        :param frame: The Frame it ran on.
+        :param cached: Whether the outputs came from a StageMemo.
+        :return dict: The record.
+        """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        local = self._local
+        peak_bytes = None
+        if self.memory:
+            with self._lock:
+                if local.overlaps == self._overlaps:
+                    peak_bytes = tracemalloc.get_traced_memory()[1] - local.memory
+                self._running -= 1
+        record = {
+            "file": frame.get("file_name"),
+            "stage": stage.name,
+            "wall": wall - local.wall,
+            "cpu": cpu - local.cpu,
+            "peak_bytes": peak_bytes,
+            "cached": cached,
+            "inputs": local.inputs,
+            "outputs": {key: _shape(frame.get(key)) for key in stage.outputs},
+        }
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def extend(self, records):
+        """
+        Add records collected by another profiler, e.g. in a worker process.
+
+        :param records: The records.
+        :return:
+        """
+        with self._lock:
+            self.records.extend(records)
+
+    def per_image(self):
+        """
+        Group the records by image.
+
+        :return dict: File name to the list of its stage records.
+        """
+        images = {}
+        for record in self.records:
+            images.setdefault(record["file"], []).append(record)
+        return images
+
+    def summary(self):
+        """
+        Sum up the records per stage.
+
+        The "total" entry adds up every stage of each image.
+
+        :return dict: Stage name to count and p50, p95 and max of each field.
+        """
+        values = {}
+        for record in self.records:
+            stage_values = values.setdefault(record["stage"], {field: [] for field in SUMMARY_FIELDS})
+            for field in SUMMARY_FIELDS:
+                if record[field] is not None:
+                    stage_values[field].append(record[field])
+        totals = {field: [] for field in SUMMARY_FIELDS}
+        for records in self.per_image().values():
+            for field in SUMMARY_FIELDS:
+                if all(record[field] is not None for record in records):
+                    totals[field].append(sum(record[field] for record in records))
+        if self.records:
+            values["total"] = totals
+
+        summary = {}
+        for stage, stage_values in values.items():
+            summary[stage] = {"count": len(stage_values["wall"])}
+            for field in SUMMARY_FIELDS:
+                data = stage_values[field]
+                if not data:
+                    continue
+                p50, p95 = np.percentile(data, (50, 95))
+                summary[stage].update({field + "_p50": float(p50), field + "_p95": float(p95),
+                                       field + "_max": float(max(data))})
+        return summary
+
+    def write(self, path):
+        """
+        Write the profile to a file.
+
+        A .csv path gets the per stage summary as a table, any other
+        path gets JSON holding both the summary and every record.
+
+        :param path: The file to write.
+        :return:
+        """
+        summary = self.summary()
+        if path.lower().endswith(".csv"):
+            columns = ["stage", "count"] + ["%s_%s" % (field, statistic) for field in SUMMARY_FIELDS
+                                            for statistic in ("p50", "p95", "max")]
+            with open(path, "w", newline="") as output:
+                writer = csv.DictWriter(output, fieldnames=columns)
+                writer.writeheader()
+                for stage, statistics in summary.items():
+                    writer.writerow(dict(statistics, stage=stage))
+        else:
+            with open(path, "w") as output:
+                json.dump({"summary": summary, "records": self.records}, output, indent=1)
@@ -0,0 +1,200 @@
+"""
+cv/rig.py
+
+This python file contains the rig geometry cache, which reuses the
+tray edge found in earlier photos of the same camera rig.
+
+The photos of a capture session come from a fixed rig, so the tray
+edge barely moves from one shot to the next. After a full corner
+search, the cache records where the edge shows up in a narrow band
+profile of the enhanced image: the mean vertical gradient of every
+row in the band. For the next photo of the same session only that
+profile is measured. If it still peaks close to where it did, about
+as strongly, the edge row follows the peak and the edge, line and
+corner stages are skipped altogether; otherwise the full search
+runs and the cache is updated from it.
+
+Sessions are told apart by the camera body serial number in the
+EXIF data, or by the directory of the photo when there is none.
+"""
+
+'''Imports'''
+import os
+import uuid
+from collections import namedtuple
+import numpy as np
+
+__all__ = ["RigReference", "session_key", "edge_profile", "RigGeometry"]
+
+# EXIF tags of the camera body serial number, in the Exif IFD and in IFD0
+_EXIF_IFD = 0x8769
+_BODY_SERIAL_NUMBER = 0xA431
+_SERIAL_NUMBER_IFD0 = 0xC62F
+
+# Values the skipped stages would have given on an image without a tray edge
+_SKIPPED = {
+    "corners": np.empty((0, 2), np.float32),
+    "lines": np.empty((0, 4), np.int32),
+    "horizontal_lines": np.empty((0, 4), np.int32),
+    "line_rows": np.empty((0, 3)),
+}
+
+# Sessions of every RigGeometry in this process, by token, so that copies
+# unpickled in a worker process share one cache
+_sessions = {}
+
+RigReference = namedtuple("RigReference", "edge_row peak_row strength")
+
+
+def session_key(file_name):
+    """
+    Work out which capture session a photo belongs to.
+
+    :param file_name: Path to the photo.
+    :return tuple: ("camera", serial number), or ("directory", path) when the photo has none.
+    """
+    from PIL import Image
+    try:
+        with Image.open(file_name) as image:
+            exif = image.getexif()
+            serial = exif.get_ifd(_EXIF_IFD).get(_BODY_SERIAL_NUMBER) or exif.get(_SERIAL_NUMBER_IFD0)
+    except Exception:
+        serial = None
+    if serial:
+        return "camera", str(serial).strip()
+    return "directory", os.path.dirname(os.path.abspath(file_name))
+
+
+def edge_profile(image, scale, row, band, cols):
+    """
+    Find the strongest horizontal edge in a narrow band of rows.
+
+    :param image: The enhanced grayscale image.
+    :param scale: Decoded pixels per full resolution pixel.
+    :param row: Middle of the band in full resolution pixels.
+    :param band: Full resolution rows searched above and below row.
+    :param cols: (left, right) in full resolution pixels.
+    :return tuple: The row of the strongest edge in full resolution pixels and its
+        mean gradient, or None if the band is outside the image.
+    """
+    top = max(0, int(np.floor((row - band) * scale)))
+    bottom = min(image.shape[0], int(np.ceil((row + band) * scale)) + 1)
+    left = max(0, int(np.floor(cols[0] * scale)))
+    right = min(image.shape[1], int(np.ceil(cols[1] * scale)))
+    if bottom - top < 3 or right <= left:
+        return None
+    window = image[top:bottom, left:right].astype(np.int16)
+    profile = np.abs(np.diff(window, axis=0)).mean(axis=1)
+    peak = int(np.argmax(profile))
+    # the gradient of a row pair sits between the two rows
+    return (top + peak + 1) / scale, float(profile[peak])
+
+
+class RigGeometry:
+    """
+    Runs a pipeline, skipping the tray edge search for photos of a known rig.
+
+    It is used in place of the pipeline: run() takes the same
+    arguments and gives a frame with the same keys. On a hit,
+    corners, lines, horizontal_lines and line_rows are empty and
+    every other output of the skipped stages is None.
+    """
+
+    def __init__(self, pipeline, check_after="contrast", search_until="edge_row", band=40, max_shift=8,
+                 min_strength=0.5, cols=(250, 2250)):
+        """
+        Initialize the cache.
+
+        :param pipeline: The Pipeline to run.
+        :param check_after: Name of the stage giving the enhanced image the profile is measured on.
+        :param search_until: Name of the stage giving the edge row; the stages
+            after check_after up to this one are skipped on a hit.
+        :param band: Full resolution rows above and below the cached edge the profile covers.
+        :param max_shift: Full resolution rows the edge may move between photos.
+        :param min_strength: Fraction of the cached edge gradient the edge must keep.
+        :param cols: (left, right) of the profile in full resolution pixels.
+        """
+        self.pipeline = pipeline
+        self.head, rest = pipeline.split(check_after)
+        self.search, self.tail = rest.split(search_until)
+        self.band = band
+        self.max_shift = max_shift
+        self.min_strength = min_strength
+        self.cols = cols
+        self.hits = 0
+        self.searches = 0
+        self._token = uuid.uuid4().hex
+
+    def __iter__(self):
+        return iter(self.pipeline)
+
+    def __getitem__(self, name):
+        return self.pipeline[name]
+
+    @property
+    def params(self):
+        """
+        The settings that change which photos skip the edge search, like the params of a stage.
+
+        :return dict:
+        """
+        return {"check_after": self.head.stages[-1].name, "search_until": self.search.stages[-1].name,
+                "band": self.band, "max_shift": self.max_shift, "min_strength": self.min_strength,
+                "cols": self.cols}
+
+    @property
+    def sessions(self):
+        """
+        The RigReference of every session seen in this process.
+
+        :return dict: Session key to RigReference.
+        """
+        return _sessions.setdefault(self._token, {})
+
+    def check(self, frame, reference):
+        """
+        Measure the edge profile of a photo against a cached rig.
+
+        :param frame: A Frame holding the enhanced image and the scale.
+        :param reference: The RigReference of the photo's session.
+        :return int: The edge row of the photo, or None if the rig seems to have moved.
+        """
+        measured = edge_profile(frame["enhanced"], frame["scale"], reference.peak_row, self.band, self.cols)
+        if measured is None:
+            return None
+        peak_row, strength = measured
+        if abs(peak_row - reference.peak_row) > self.max_shift or strength < self.min_strength * reference.strength:
+            return None
+        return int(round(reference.edge_row + peak_row - reference.peak_row))
+
+    def run(self, file_name=None, memo=None, keep=None, profiler=None, **values):
+        """
+        Run the pipeline on one image, reusing the rig geometry when it checks out.
+
+        :param file_name: Path to the image.
+        :param memo: See Pipeline.run().
+        :param keep: See Pipeline.run().
+        :param profiler: See Pipeline.run().
+        :param values: See Pipeline.run().
+        :return Frame: The intermediate results keyed by name.
+        """
+        frame = self.head.run(file_name, memo, profiler=profiler, **values)
+        session = session_key(file_name)
+        reference = self.sessions.get(session)
+        edge_row = None if reference is None else self.check(frame, reference)
+        if edge_row is None:
+            self.search.resume(frame, memo, profiler=profiler)
+            self.searches += 1
+            edge_row = frame["edge_row"]
+            measured = edge_profile(frame["enhanced"], frame["scale"], edge_row, self.band, self.cols)
+            if measured is not None:
+                self.sessions[session] = RigReference(edge_row, *measured)
+        else:
+            self.hits += 1
+            for stage in self.search.stages:
+                for name in stage.outputs:
+                    frame.add_source(name, _SKIPPED.get(name))
+            frame.add_source("edge_row", edge_row)
+            self.sessions[session] = reference._replace(edge_row=edge_row,
+                                                        peak_row=reference.peak_row + edge_row - reference.edge_row)
+        return self.tail.resume(frame, memo, keep, profiler)
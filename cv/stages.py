@@ -0,0 +1,594 @@
+"""
+cv/stages.py
+
+This python file contains the stages of the tray edge and
+contour algorithm, along with the default pipeline that
+chains them together the same way as the drag and drop GUI.
+"""
+
+'''Imports'''
+import io
+from collections import namedtuple
+import numpy as np
+import cv2
+from PIL import Image
+from .pipeline import Stage, Pipeline
+from .edge_row import estimate_edge_row
+from .tiling import tiled_bilateral, tiled_canny, tiled_harris
+
+__all__ = ["PIPELINE_VERSION", "RAW_EXTENSIONS", "IMAGE_EXTENSIONS", "DECODE_MODES", "CONTOUR_RETRIEVAL", "CropBox",
+           "load_image", "contrast_lut", "region_window", "largest_contours",
+           "RawDecode", "Grayscale", "ContrastEnhance", "EdgeDetection",
+           "LineDetection", "LineAnalysis", "CornerDetection", "EdgeRowEstimation", "Crop",
+           "ContourApproximation", "default_stages", "default_pipeline"]
+
+'''Constants'''
+# Bump whenever a change to the stages changes the results they give
+PIPELINE_VERSION = "1"
+RAW_EXTENSIONS = (".cr2",)
+IMAGE_EXTENSIONS = RAW_EXTENSIONS + (".jpg", ".jpeg")
+# full: full resolution demosaic, half: half size demosaic, thumb: embedded JPEG preview
+DECODE_MODES = ("full", "half", "thumb")
+# cv2.findContours retrieval mode for each ContourApproximation retrieval
+CONTOUR_RETRIEVAL = {"tree": cv2.RETR_TREE, "list": cv2.RETR_LIST, "external": cv2.RETR_EXTERNAL}
+
+
+class CropBox(namedtuple("CropBox", "top bottom left right")):
+    """
+    The crop window below the tray edge, in pixels.
+    """
+    __slots__ = ()
+
+    def apply(self, image):
+        """
+        Crop an image to the box.
+
+        :param image: The full frame.
+        :return numpy.ndarray: A view of the cropped region.
+        """
+        return image[self.top:self.bottom, self.left:self.right]
+
+    def scaled(self, scale):
+        """
+        Map the box from full resolution to a decoded image.
+
+        :param scale: Decoded pixels per full resolution pixel.
+        :return CropBox:
+        """
+        return CropBox(*[int(round(value * scale)) for value in self])
+
+
+def _draft(file_image, mode, max_size):
+    """
+    Let PIL decode a JPEG at a reduced size.
+
+    :param file_image: The opened PIL image.
+    :param mode: One of DECODE_MODES, anything but full decodes at half size.
+    :param max_size: Longest side wanted, or None.
+    :return:
+    """
+    width, height = file_image.size
+    if mode != "full":
+        width, height = width // 2, height // 2
+    if max_size is not None and max(width, height) > max_size:
+        shrink = max_size / max(width, height)
+        width, height = max(1, int(width * shrink)), max(1, int(height * shrink))
+    if (width, height) != file_image.size:
+        file_image.draft("RGB", (width, height))
+
+
+def _shrink(rgb, max_size):
+    """
+    Shrink an image so its longest side is at most max_size.
+
+    :param rgb: The image.
+    :param max_size: Longest side wanted, or None to keep the image as is.
+    :return numpy.ndarray:
+    """
+    if max_size is None or max(rgb.shape[:2]) <= max_size:
+        return rgb
+    factor = max_size / max(rgb.shape[:2])
+    return cv2.resize(rgb, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def _load_raw(file_name, mode, max_size=None):
+    """
+    Decode a Canon raw file with rawpy.
+
+    :param file_name: Path to the .CR2 file.
+    :param mode: One of DECODE_MODES.
+    :param max_size: See load_image().
+    :return tuple: The RGB image and its scale.
+    """
+    import rawpy
+    with rawpy.imread(file_name) as raw_image:
+        full_size = max(raw_image.sizes.width, raw_image.sizes.height)
+        if mode == "thumb":
+            try:
+                thumb = raw_image.extract_thumb()
+            except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+                # no usable preview, the half size demosaic is the next fastest
+                mode = "half"
+            else:
+                if thumb.format == rawpy.ThumbFormat.JPEG:
+                    with Image.open(io.BytesIO(thumb.data)) as preview:
+                        _draft(preview, "full", max_size)
+                        rgb = np.array(preview.convert("RGB"))
+                else:
+                    rgb = thumb.data
+                rgb = _shrink(rgb, max_size)
+                return rgb, max(rgb.shape[:2]) / full_size
+        rgb = _shrink(raw_image.postprocess(half_size=(mode == "half")), max_size)
+    return rgb, max(rgb.shape[:2]) / full_size
+
+
+def load_image(file_name, mode="full", max_size=None):
+    """
+    Decode an image file into an RGB array.
+
+    Canon raw files are demosaiced with rawpy, everything else
+    is opened with PIL. JPEG files have no separate preview, so
+    the half and thumb modes both let PIL decode them at half size.
+    With a max_size, JPEG data is decoded straight at a reduced
+    size where possible and then shrunk to fit, which makes the
+    thumb mode fast enough for previews.
+
+    :param file_name: Path to a .CR2 or JPEG file.
+    :param mode: One of DECODE_MODES.
+    :param max_size: Longest side of the decoded image, or None for no limit.
+    :return tuple: The RGB image as uint8 and its scale, the number
+        of decoded pixels per full resolution pixel.
+    """
+    if mode not in DECODE_MODES:
+        raise ValueError("Unknown decode mode %r, expected one of %s" % (mode, ", ".join(DECODE_MODES)))
+    if file_name.lower().endswith(RAW_EXTENSIONS):
+        return _load_raw(file_name, mode, max_size)
+    with Image.open(file_name) as file_image:
+        full_size = max(file_image.size)
+        _draft(file_image, mode, max_size)
+        if file_image.mode != "RGB":
+            file_image = file_image.convert("RGB")
+        # read-only, but saves a second full frame copy
+        rgb = _shrink(np.asarray(file_image), max_size)
+    return rgb, max(rgb.shape[:2]) / full_size
+
+
+class RawDecode(Stage):
+    """
+    Decode the image file.
+
+    Every stage after this one works on the decoded image, but
+    reports positions and sizes in full resolution pixels by
+    way of the scale. With an ArrayCache the decoded image is
+    memory mapped from disk whenever the file was decoded before
+    with the same options.
+
+    file_name (str) -> rgb (uint8 array, rows x cols x 3),
+    scale (float, decoded pixels per full resolution pixel),
+    decode_key (str, the cache key, or None without a cache)
+    """
+    name = "decode"
+    inputs = ("file_name",)
+    outputs = ("rgb", "scale", "decode_key")
+    defaults = {"mode": "full", "max_size": None}
+
+    def __init__(self, cache=None, **kwargs):
+        """
+        Initialize the stage.
+
+        :param cache: An ArrayCache, or None to always decode.
+        :param kwargs: See Stage.
+        """
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def process(self, file_name):
+        if self.cache is None:
+            rgb, scale = load_image(file_name, self.params["mode"], self.params["max_size"])
+            return rgb, scale, None
+
+        key = self.cache.key(file_name, **self.params)
+        rgb = self.cache.get(key, "rgb")
+        scale = self.cache.get(key, "scale")
+        if rgb is None or scale is None:
+            rgb, scale = load_image(file_name, self.params["mode"], self.params["max_size"])
+            self.cache.put(key, "rgb", rgb)
+            self.cache.put(key, "scale", scale)
+        return rgb, float(scale), key
+
+
+class Grayscale(Stage):
+    """
+    Convert the decoded image to grayscale.
+
+    rgb (uint8 array, rows x cols x 3), decode_key (str or None)
+    -> gray (uint8 array, rows x cols)
+    """
+    name = "grayscale"
+    inputs = ("rgb", "decode_key")
+    outputs = ("gray",)
+
+    def __init__(self, cache=None, **kwargs):
+        """
+        Initialize the stage.
+
+        :param cache: An ArrayCache, or None to always convert.
+        :param kwargs: See Stage.
+        """
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def process(self, rgb, decode_key):
+        if rgb.ndim == 2:
+            return rgb
+        if self.cache is None or decode_key is None:
+            return cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+        gray = self.cache.get(decode_key, "gray")
+        if gray is None:
+            gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+            self.cache.put(decode_key, "gray", gray)
+        return gray
+
+
+def contrast_lut(mean, factor):
+    """
+    Build the lookup table for a contrast stretch around a mean.
+
+    Uses the same single precision arithmetic and truncation as
+    PIL's ImageEnhance.Contrast, so the results are identical.
+
+    :param mean: The rounded mean gray level.
+    :param factor: The enhancement factor.
+    :return numpy.ndarray: uint8 table of 256 entries.
+    """
+    offsets = (np.arange(256) - mean).astype(np.float32)
+    levels = np.float32(mean) + np.float32(factor) * offsets
+    return np.clip(levels, 0, 255).astype(np.uint8)
+
+
+class ContrastEnhance(Stage):
+    """
+    Stretch the contrast of the grayscale image around its mean.
+
+    Gives the same result as ImageEnhance.Contrast(image).enhance(factor)
+    with one pass to sum the image and one table lookup per pixel.
+
+    gray (uint8 array) -> enhanced (uint8 array)
+    """
+    name = "contrast"
+    inputs = ("gray",)
+    outputs = ("enhanced",)
+    defaults = {"factor": 255}
+
+    def process(self, gray):
+        mean = int(cv2.sumElems(gray)[0] / gray.size + 0.5)
+        return cv2.LUT(gray, contrast_lut(mean, self.params["factor"]))
+
+
+def region_window(shape, region, scale, margin=0):
+    """
+    Find the part of a decoded image covering a full resolution region.
+
+    :param shape: Shape of the decoded image.
+    :param region: ((top, bottom), (left, right)) in full resolution
+        pixels, or None for the whole image.
+    :param scale: Decoded pixels per full resolution pixel.
+    :param margin: Full resolution pixels added around the region.
+    :return tuple: (top, bottom, left, right) in decoded pixels, clipped to the image.
+    """
+    if region is None:
+        return 0, shape[0], 0, shape[1]
+    (top, bottom), (left, right) = region
+    return (max(0, int(np.floor((top - margin) * scale))),
+            min(shape[0], int(np.ceil((bottom + margin) * scale))),
+            max(0, int(np.floor((left - margin) * scale))),
+            min(shape[1], int(np.ceil((right + margin) * scale))))
+
+
+class EdgeDetection(Stage):
+    """
+    Find edges with Canny, optionally after a bilateral filter.
+
+    With a region, only that band of the image (plus a margin for
+    the filter and gradient kernels) is searched and the rest of
+    the edge image is left empty. With a budget, the filter and
+    Canny run on bands of rows that need at most that many bytes of
+    working memory each.
+
+    enhanced (uint8 array), scale (float) -> edges (uint8 array, 0 or 255)
+    """
+    name = "edges"
+    inputs = ("enhanced", "scale")
+    outputs = ("edges",)
+    defaults = {"thresholds": (75, 150), "bilateral": None, "region": None, "margin": 8,
+                "budget": None}
+
+    def process(self, image, scale):
+        top, bottom, left, right = region_window(image.shape, self.params["region"], scale, self.params["margin"])
+        window = image[top:bottom, left:right]
+        if self.params["bilateral"] is not None:
+            window = tiled_bilateral(window, *self.params["bilateral"], budget=self.params["budget"])
+        edges = tiled_canny(window, *self.params["thresholds"], budget=self.params["budget"])
+        if edges.shape == image.shape[:2]:
+            return edges
+
+        full_edges = np.zeros(image.shape[:2], np.uint8)
+        full_edges[top:bottom, left:right] = edges
+        return full_edges
+
+
+class LineDetection(Stage):
+    """
+    Find straight line segments with the probabilistic Hough transform.
+
+    The vote threshold, the line gap and the optional region to
+    search are given at full resolution.
+
+    edges (uint8 array), scale (float) -> lines (int32 array, N x 4 of x1, y1, x2, y2
+    in decoded pixels)
+    """
+    name = "lines"
+    inputs = ("edges", "scale")
+    outputs = ("lines",)
+    defaults = {"rho": 1, "theta": np.pi / 180, "threshold": 100, "max_line_gap": 1000,
+                "region": None}
+
+    def process(self, edges, scale):
+        top, bottom, left, right = region_window(edges.shape, self.params["region"], scale)
+        lines = cv2.HoughLinesP(edges[top:bottom, left:right], self.params["rho"], self.params["theta"],
+                                max(1, int(round(self.params["threshold"] * scale))),
+                                maxLineGap=self.params["max_line_gap"] * scale)
+        if lines is None:
+            return np.empty((0, 4), np.int32)
+        lines = lines.reshape(-1, 4)
+        if left or top:
+            lines += np.array([left, top, left, top], dtype=lines.dtype)
+        return lines
+
+
+class LineAnalysis(Stage):
+    """
+    Pick out the near horizontal Hough lines and group them into rows.
+
+    Lines within tolerance degrees of horizontal are kept with one
+    NumPy mask. Their middle rows are clustered, merging rows less
+    than gap full resolution pixels apart, and every cluster is
+    weighed by the total length of its lines. The heaviest cluster
+    in the band the corners are searched in is an estimate of the
+    tray edge that does not depend on the corners. With draw on, the
+    kept lines are drawn on an empty image in one call.
+
+    lines (int32 array, N x 4), edges (uint8 array), scale (float) ->
+    horizontal_lines (int32 array, M x 4 in decoded pixels), line_rows (float64 array,
+    K x 3 of row, total length and line count in full resolution pixels, heaviest first),
+    line_edge_row (int, or None without a line in the band),
+    line_debug (uint8 array, or None without draw)
+    """
+    name = "line_rows"
+    inputs = ("lines", "edges", "scale")
+    outputs = ("horizontal_lines", "line_rows", "line_edge_row", "line_debug")
+    defaults = {"tolerance": 2.0, "gap": 10, "rows": (650, 1000), "draw": False}
+
+    def process(self, lines, edges, scale):
+        lines = lines.reshape(-1, 4)
+        dx = np.abs(lines[:, 2] - lines[:, 0]).astype(np.float64)
+        dy = np.abs(lines[:, 3] - lines[:, 1]).astype(np.float64)
+        horizontal = lines[dy <= dx * np.tan(np.radians(self.params["tolerance"]))]
+
+        line_rows = np.empty((0, 3))
+        if len(horizontal):
+            rows = (horizontal[:, 1] + horizontal[:, 3]) / (2 * scale)
+            lengths = np.hypot(horizontal[:, 2] - horizontal[:, 0], horizontal[:, 3] - horizontal[:, 1]) / scale
+            order = np.argsort(rows)
+            rows, lengths = rows[order], lengths[order]
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(rows) > self.params["gap"]) + 1))
+            totals = np.add.reduceat(lengths, starts)
+            line_rows = np.column_stack((np.add.reduceat(rows * lengths, starts) / np.maximum(totals, 1e-9),
+                                         totals, np.diff(np.append(starts, len(rows)))))
+            line_rows = line_rows[np.argsort(-line_rows[:, 1], kind="stable")]
+
+        top, bottom = self.params["rows"]
+        in_band = line_rows[(line_rows[:, 0] > top) & (line_rows[:, 0] < bottom)]
+        line_edge_row = int(round(in_band[0, 0])) if len(in_band) else None
+
+        debug = None
+        if self.params["draw"]:
+            debug = np.zeros(edges.shape[:2], np.uint8)
+            cv2.polylines(debug, list(horizontal.reshape(-1, 2, 2)), False, 255, 1)
+        return horizontal, line_rows, line_edge_row, debug
+
+
+class CornerDetection(Stage):
+    """
+    Find Harris corners and keep the ones in the band around the tray edge.
+
+    The neighbourhood sizes and the band are given at full resolution,
+    and the response threshold, relative to the strongest corner, grows
+    with the square of the shrink on smaller decodes, where the sloped
+    tray sides respond more strongly next to the corners.
+    With restrict on, the Harris response is only computed over the
+    band plus a margin wide enough for its kernels, instead of over
+    the whole frame. The response threshold is then relative to the
+    strongest corner in the band rather than in the whole frame.
+    With a budget, the response is computed on bands of rows that
+    need at most that many bytes of working memory each.
+
+    edges (uint8 array), scale (float) -> corners (float32 array, N x 2 of x, y
+    in full resolution pixels)
+    """
+    name = "corners"
+    inputs = ("edges", "scale")
+    outputs = ("corners",)
+    defaults = {"block_size": 30, "ksize": 31, "k": 0.001, "threshold": 0.01,
+                "rows": (650, 1000), "cols": (250, 2250), "restrict": True, "margin": 64,
+                "budget": None}
+
+    def process(self, edges, scale):
+        rows, cols = self.params["rows"], self.params["cols"]
+        region = (rows, cols) if self.params["restrict"] else None
+        top, bottom, left, right = region_window(edges.shape, region, scale, self.params["margin"])
+        edges = edges[top:bottom, left:right]
+        if edges.size == 0:
+            return np.empty((0, 2), np.float32)
+
+        block_size = max(2, int(round(self.params["block_size"] * scale)))
+        # the Sobel aperture has to stay odd and between 3 and 31
+        ksize = min(31, max(3, int(self.params["ksize"] * scale) | 1))
+        dst = tiled_harris(edges, block_size, ksize, self.params["k"], self.params["budget"])
+        dst = cv2.dilate(dst, None)
+        # on a smaller image the straight tray sides respond more strongly next to the corners,
+        # about with the square of the shrink, so the threshold follows
+        threshold = min(0.5, self.params["threshold"] / scale ** 2)
+        ret, dst = cv2.threshold(dst, threshold * dst.max(), 255, 0)
+        dst = np.uint8(dst)
+
+        # find centroids and refine them to sub-pixel accuracy, skipping
+        # label 0, which is the background rather than a corner
+        ret, labels, stats, centroids = cv2.connectedComponentsWithStats(dst)
+        if ret < 2:
+            return np.empty((0, 2), np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.001)
+        corners = cv2.cornerSubPix(edges, np.float32(centroids[1:]), (5, 5), (-1, -1), criteria)
+        corners += np.array([left, top], np.float32)
+        if scale != 1:
+            # a decoded pixel covers 1 / scale full resolution pixels, centre to centre
+            corners += 0.5
+            corners /= scale
+            corners -= 0.5
+
+        inside = ((corners[:, 1] > rows[0]) & (corners[:, 1] < rows[1])
+                  & (corners[:, 0] > cols[0]) & (corners[:, 0] < cols[1]))
+        return corners[inside]
+
+
+class EdgeRowEstimation(Stage):
+    """
+    Estimate the tray edge row from the flattest combination of corners.
+
+    corners (float32 array, N x 2) -> edge_row (int)
+    """
+    name = "edge_row"
+    inputs = ("corners",)
+    outputs = ("edge_row",)
+
+    def process(self, corners):
+        return estimate_edge_row(corners)
+
+
+class Crop(Stage):
+    """
+    Work out the crop window below the tray edge.
+
+    edge_row (int) -> crop (CropBox in full resolution pixels)
+    """
+    name = "crop"
+    inputs = ("edge_row",)
+    outputs = ("crop",)
+    defaults = {"bottom": 2500, "cols": (200, 2200)}
+
+    def process(self, edge_row):
+        return CropBox(edge_row, self.params["bottom"], *self.params["cols"])
+
+
+def largest_contours(contours, top_k=None):
+    """
+    Pick the contours with the largest areas.
+
+    Gives the same contours in the same order as sorting every
+    contour by area, largest first, and keeping the first top_k,
+    but only sorts the ones that can make the cut.
+
+    :param contours: Sequence of contours.
+    :param top_k: Number of contours to keep, all of them if None.
+    :return list: The largest contours, largest first.
+    """
+    areas = np.fromiter((cv2.contourArea(contour) for contour in contours), np.float64, len(contours))
+    if top_k is None or top_k >= len(areas):
+        candidates = np.arange(len(areas))
+    else:
+        threshold = np.partition(areas, len(areas) - top_k)[len(areas) - top_k]
+        candidates = np.flatnonzero(areas >= threshold)
+    # stable, so equal areas keep their order like sorted() does
+    order = candidates[np.argsort(-areas[candidates], kind="stable")][:top_k]
+    return [contours[index] for index in order]
+
+
+class ContourApproximation(Stage):
+    """
+    Find the contours and approximate the largest one with a polygon.
+
+    Only the top_k largest contours are kept, picked without sorting
+    all of them. The list retrieval finds the same contours as the
+    tree one without building the hierarchy, which is much faster on
+    noisy edge images; the external retrieval skips every contour
+    inside another one, which is faster still and finds the same
+    largest contour, but counts fewer contours. With draw on, the
+    kept contours are drawn on a copy of the edge image in one call.
+
+    contour_edges (uint8 array), scale (float) -> contours (list of the top_k largest
+    int32 arrays in decoded pixels, largest first), contour_count (int, contours found),
+    contour_area (float), contour_perimeter (float), polygon (int32 array, N x 1 x 2),
+    all three in full resolution pixels, contour_debug (uint8 array, or None without draw)
+    """
+    name = "contours"
+    inputs = ("contour_edges", "scale")
+    outputs = ("contours", "contour_count", "contour_area", "contour_perimeter", "polygon", "contour_debug")
+    defaults = {"epsilon": 0.02, "retrieval": "list", "top_k": 10, "draw": False}
+
+    def process(self, edges, scale):
+        contours, hierarchy = cv2.findContours(edges, CONTOUR_RETRIEVAL[self.params["retrieval"]],
+                                               cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            raise ValueError("No contours found")
+        count = len(contours)
+        contours = largest_contours(contours, self.params["top_k"])
+
+        perim = cv2.arcLength(contours[0], True)
+        polygon = cv2.approxPolyDP(contours[0], self.params["epsilon"] * perim, True)
+        area = cv2.contourArea(contours[0])
+        if scale != 1:
+            polygon = np.round(polygon / scale).astype(polygon.dtype)
+            area /= scale * scale
+            perim /= scale
+
+        debug = None
+        if self.params["draw"]:
+            debug = edges.copy()
+            cv2.drawContours(debug, contours, -1, 255, 3)
+        return contours, count, float(area), float(perim), polygon, debug
+
+
+def default_stages(decode_mode="full", cache=None):
+    """
+    Build the stages of the tray edge and contour algorithm.
+
+    :param decode_mode: One of DECODE_MODES.
+    :param cache: ArrayCache for the decoded and grayscale images, or None.
+    :return list: Fresh Stage objects in the order they run.
+    """
+    return [
+        RawDecode(mode=decode_mode, cache=cache),
+        Grayscale(cache=cache),
+        ContrastEnhance(),
+        EdgeDetection(),
+        LineDetection(),
+        LineAnalysis(),
+        CornerDetection(),
+        EdgeRowEstimation(),
+        Crop(),
+        EdgeDetection(name="contour_edges", outputs=("contour_edges",),
+                      thresholds=(75, 200), bilateral=(5, 175, 175)),
+        ContourApproximation(),
+    ]
+
+
+def default_pipeline(decode_mode="full", cache=None):
+    """
+    Build the pipeline for the tray edge and contour algorithm.
+
+    :param decode_mode: One of DECODE_MODES.
+    :param cache: ArrayCache for the decoded and grayscale images, or None.
+    :return Pipeline:
+    """
+    return Pipeline(default_stages(decode_mode, cache))
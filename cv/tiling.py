@@ -0,0 +1,138 @@
+"""
+cv/tiling.py
+
+This python file contains the tiled execution of the local
+operators (bilateral filter, Canny and Harris), which keeps the
+memory they need under a budget however large the frame is.
+
+Without tiling, every operator allocates its working buffers for
+the whole frame at once; cornerHarris alone holds several float32
+images the size of its input. Tiled, the image is cut into bands
+of whole rows, each read with a halo of extra rows above and below
+so the kernels see the same neighbourhood as on the whole image,
+and only the core rows of each band are written into one output
+allocated up front. The bilateral filter gives exactly the same
+result as untiled and Harris the same up to float rounding; Canny
+can only lose a weak edge whose connection to a strong edge runs
+outside the halo.
+"""
+
+'''Imports'''
+import cv2
+import numpy as np
+
+__all__ = ["WORKING_BYTES", "MIN_TILE_ROWS", "tile_rows", "apply_tiled", "tiled_bilateral", "tiled_canny",
+           "tiled_harris", "with_memory_budget"]
+
+# Rough bytes of working memory per input pixel of each operator, including its output
+WORKING_BYTES = {"bilateral": 8, "canny": 16, "harris": 28}
+
+# Fewest core rows in a tile, so tiny budgets do not spend all their time on halos
+MIN_TILE_ROWS = 16
+
+# Rows of halo around Canny tiles, for hysteresis to follow edges across tile borders
+CANNY_HALO = 32
+
+
+def tile_rows(width, halo, budget, working_bytes):
+    """
+    Work out how many core rows a tile can have within a memory budget.
+
+    :param width: Columns of the image.
+    :param halo: Extra rows read above and below each tile.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :param working_bytes: Bytes of working memory per pixel of the operator.
+    :return int: Core rows per tile, or None to process the whole image at once.
+    """
+    if budget is None:
+        return None
+    return max(MIN_TILE_ROWS, int(budget // (max(1, width) * working_bytes)) - 2 * halo)
+
+
+def apply_tiled(function, image, halo, budget=None, working_bytes=1, out=None):
+    """
+    Apply a local operator to an image one band of rows at a time.
+
+    :param function: Takes an image and returns an image of the same number of rows and columns.
+    :param image: The input image.
+    :param halo: Rows the operator needs on each side of an output row.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :param working_bytes: Bytes of working memory per pixel of the operator.
+    :param out: Array to write the result into, allocated from the first tile if None.
+    :return numpy.ndarray: The result, out if given.
+    """
+    height, width = image.shape[:2]
+    rows = tile_rows(width, halo, budget, working_bytes)
+    if rows is None or rows >= height:
+        result = function(image)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        padded_top, padded_bottom = max(0, top - halo), min(height, bottom + halo)
+        result = function(image[padded_top:padded_bottom])
+        if out is None:
+            out = np.empty((height, width) + result.shape[2:], result.dtype)
+        out[top:bottom] = result[top - padded_top:bottom - padded_top]
+    return out
+
+
+def tiled_bilateral(image, diameter, sigma_color, sigma_space, budget=None):
+    """
+    cv2.bilateralFilter() within a memory budget.
+
+    :param image: uint8 image.
+    :param diameter: Diameter of the pixel neighbourhood, or 0 or less to derive it from sigma_space.
+    :param sigma_color: Filter sigma in the color space.
+    :param sigma_space: Filter sigma in the coordinate space.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :return numpy.ndarray:
+    """
+    # cv2 uses a radius of 1.5 sigma_space when no diameter is given
+    radius = diameter // 2 if diameter > 0 else int(round(sigma_space * 1.5))
+    return apply_tiled(lambda tile: cv2.bilateralFilter(tile, diameter, sigma_color, sigma_space), image,
+                       radius + 1, budget, WORKING_BYTES["bilateral"])
+
+
+def tiled_canny(image, threshold1, threshold2, budget=None, halo=CANNY_HALO):
+    """
+    cv2.Canny() within a memory budget.
+
+    :param image: uint8 image.
+    :param threshold1: Lower hysteresis threshold.
+    :param threshold2: Upper hysteresis threshold.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :param halo: Rows of halo; the larger, the closer to the untiled result.
+    :return numpy.ndarray: uint8 edge image, 0 or 255.
+    """
+    return apply_tiled(lambda tile: cv2.Canny(tile, threshold1, threshold2), image, halo, budget,
+                       WORKING_BYTES["canny"])
+
+
+def tiled_harris(image, block_size, ksize, k, budget=None):
+    """
+    cv2.cornerHarris() within a memory budget.
+
+    :param image: uint8 or float32 image.
+    :param block_size: Neighbourhood size.
+    :param ksize: Aperture of the Sobel operator.
+    :param k: Harris detector free parameter.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :return numpy.ndarray: float32 Harris response.
+    """
+    return apply_tiled(lambda tile: cv2.cornerHarris(tile, block_size, ksize, k), image,
+                       ksize // 2 + block_size // 2 + 1, budget, WORKING_BYTES["harris"])
+
+
+def with_memory_budget(pipeline, budget):
+    """
+    Configure every stage of a pipeline that can tile to a memory budget.
+
+    :param pipeline: The Pipeline.
+    :param budget: Bytes of working memory a tile may use, or None for no limit.
+    :return Pipeline: A new Pipeline.
+    """
+    return pipeline.configured({"%s.budget" % stage.name: budget for stage in pipeline if "budget" in stage.params})
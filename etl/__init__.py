@@ -0,0 +1,6 @@
+"""
+etl/__init__.py
+
+The initialization file for the ETL pipeline
+sub-module.
+"""
\ No newline at end of file
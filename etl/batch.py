@@ -0,0 +1,410 @@
+"""
+etl/batch.py
+
+This python file contains the headless batch runner that
+extracts features from whole directories of switchgrass
+photos in parallel.
+
+Usage:
+
+    python -m etl.batch photos/ "field_day_2/*.CR2" -o features.csv
+"""
+
+'''Imports'''
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from cv.cache import DEFAULT_CACHE_DIR, ArrayCache
+from cv.features import IMAGE_EXTENSIONS, FEATURE_COLUMNS, extract_features
+from cv.profiling import StageProfiler
+from cv.stages import DECODE_MODES, default_pipeline
+from cv.tiling import with_memory_budget
+from .scheduler import (apply_threads, calibrate, limited_threads, thread_plan, warm_pool,
+                        worker_context)
+
+__all__ = ["RESULT_COLUMNS", "find_images", "result_row", "process_file", "start_pool", "run_isolated",
+           "run_batch", "main"]
+
+RESULT_COLUMNS = ("file", "status", "error", "seconds") + FEATURE_COLUMNS
+
+
+def find_images(paths):
+    """
+    Expand directories and glob patterns into a sorted list of image files.
+
+    Directories are walked recursively and only files with a raw or
+    JPEG extension are kept. Plain file paths are passed through as is.
+
+    :param paths: Iterable of files, directories or glob patterns.
+    :return list: Unique image paths in sorted order.
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in os.walk(path):
+                found.update(os.path.join(directory, file_name) for file_name in file_names
+                             if file_name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(path):
+            found.add(path)
+        else:
+            found.update(match for match in glob.glob(path, recursive=True)
+                         if os.path.isfile(match) and match.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(found)
+
+
+def result_row(file_name, features=None, error=None, seconds=""):
+    """
+    Build the output row for one image.
+
+    :param file_name: Path to the image.
+    :param features: The features of the image, if it succeeded.
+    :param error: The exception raised while processing it, if it failed.
+    :param seconds: Time spent on the image.
+    :return dict: A row keyed by RESULT_COLUMNS.
+    """
+    row = dict.fromkeys(RESULT_COLUMNS, "")
+    row["file"] = file_name
+    row["seconds"] = seconds
+    if error is None:
+        row.update(features)
+        row["status"] = "ok"
+    else:
+        row["status"] = "failed"
+        row["error"] = "%s: %s" % (type(error).__name__, error)
+    return row
+
+
+def process_file(file_name, pipeline=None, profile=None):
+    """
+    Extract the features of a single image without ever raising.
+
+    Any failure is recorded in the returned row so that one bad
+    image cannot stop the rest of the batch.
+
+    :param file_name: Path to the image.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param profile: None, "time" to add the stage records of a
+        StageProfiler to the row under "profile", or "memory" to
+        add peak memory to them as well.
+    :return dict: A row keyed by RESULT_COLUMNS.
+    """
+    profiler = None if profile is None else StageProfiler(memory=(profile == "memory"))
+    start = time.perf_counter()
+    try:
+        features = extract_features(file_name, pipeline, profiler)
+    except Exception as error:
+        row = result_row(file_name, error=error, seconds=round(time.perf_counter() - start, 4))
+    else:
+        row = result_row(file_name, features, seconds=round(time.perf_counter() - start, 4))
+    if profiler is not None:
+        row["profile"] = profiler.records
+    return row
+
+
+def start_pool(threads, workers=None, warm=False):
+    """
+    Start worker processes that limit their threads to a plan.
+
+    :param threads: The ThreadPlan the workers follow.
+    :param workers: Number of processes, threads.workers by default.
+    :param warm: Whether to wait until every process has started, see warm_pool().
+    :return ProcessPoolExecutor:
+    """
+    workers = workers or threads.workers
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=apply_threads,
+                                   initargs=(threads.cv_threads, threads.blas_threads))
+    return warm_pool(executor, workers) if warm else executor
+
+
+def run_isolated(files, start_pool, function, *args):
+    """
+    Process images one at a time on a single worker process.
+
+    Used for the images that were in flight when a worker died: as
+    only one runs at a time, a crash can only come from that image.
+    Only its row fails, and a fresh worker takes the next one.
+
+    :param files: Iterable of image paths.
+    :param start_pool: Takes a number of workers and returns a new ProcessPoolExecutor.
+    :param function: Takes an image path and args and returns its row.
+    :param args: Further arguments of function.
+    :return generator: Result rows keyed by RESULT_COLUMNS.
+    """
+    executor = start_pool(1)
+    try:
+        for file_name in files:
+            try:
+                yield executor.submit(function, file_name, *args).result()
+            except BrokenProcessPool as error:
+                yield result_row(file_name, error=error)
+                executor.shutdown()
+                executor = start_pool(1)
+    finally:
+        executor.shutdown()
+
+
+def run_batch(files, workers=None, pipeline=None, profile=None, threads=None, executor=None):
+    """
+    Process images on a pool of worker processes.
+
+    Rows are yielded as soon as each image finishes, so the order
+    does not follow the input order. Every worker limits its
+    OpenCV and BLAS threads as it starts, so the workers and their
+    thread pools do not oversubscribe the cores.
+
+    A worker dying outright, e.g. on a crash inside a native
+    decoder, breaks the whole pool. The images that were in flight
+    are then run again one at a time to find the one that crashed,
+    which is the only one reported as failed, and the rest of the
+    batch carries on on a new pool.
+
+    :param files: List of image paths.
+    :param workers: Number of worker processes, all cores by default.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param profile: See process_file().
+    :param threads: The ThreadPlan to follow, overriding workers, or None to split
+        the cores evenly between the workers.
+    :param executor: A pool from start_pool() to run on, left running afterwards, or None
+        to start one, or with a single worker to run in this process.
+    :return generator: Result rows keyed by RESULT_COLUMNS.
+    """
+    threads = threads or thread_plan(workers)
+    if executor is None and threads.workers == 1:
+        with limited_threads(threads.cv_threads, threads.blas_threads):
+            for file_name in files:
+                yield process_file(file_name, pipeline, profile)
+        return
+
+    def new_pool(count):
+        return start_pool(threads, count)
+
+    file_iterator = iter(files)
+    # whether the pool is this run's to shut down
+    owned = executor is None
+    executor = executor or new_pool(threads.workers)
+    try:
+        # only a couple of images per worker are in flight, the ones to retry if the pool breaks
+        futures = {}
+        while True:
+            while len(futures) < 2 * threads.workers:
+                file_name = next(file_iterator, None)
+                if file_name is None:
+                    break
+                futures[executor.submit(process_file, file_name, pipeline, profile)] = file_name
+            if not futures:
+                return
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                try:
+                    row = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    continue
+                del futures[future]
+                yield row
+            if broken:
+                executor.shutdown()
+                suspects, futures = list(futures.values()), {}
+                yield from run_isolated(suspects, new_pool, process_file, pipeline, profile)
+                executor = new_pool(threads.workers)
+                owned = True
+    finally:
+        if owned:
+            executor.shutdown()
+
+
+def main(argv=None):
+    """
+    Command line entry point for the batch runner.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code, 1 if any image failed.
+    """
+    parser = argparse.ArgumentParser(prog="python -m etl.batch",
+                                     description="Extract switchgrass features from a batch of images.")
+    parser.add_argument("paths", nargs="+", help="Image files, directories or glob patterns.")
+    parser.add_argument("-o", "--output", default="features.csv", help="CSV file to write the rows to.")
+    parser.add_argument("--store", metavar="DIR", default=None,
+                        help="Append the rows to a columnar feature store in DIR instead of writing a CSV. "
+                             "Images the store already holds a successful row for are skipped.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores).")
+    parser.add_argument("--cv-threads", type=int, default=None,
+                        help="OpenCV threads per worker (default: the cores divided by the workers).")
+    parser.add_argument("--calibrate", type=int, default=None, metavar="N",
+                        help="Time runs of the first N images with 1, 2, 4, ... workers, each with the cores "
+                             "split between them, and use the fastest, instead of -j and --cv-threads.")
+    parser.add_argument("--decode", choices=DECODE_MODES, default="full",
+                        help="How raw files are decoded: full resolution, half size or the embedded "
+                             "preview (default: full).")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Run the bilateral filter, Canny and Harris on bands of rows using at most "
+                             "MB megabytes of working memory each, so more workers fit in RAM "
+                             "(default: whole images).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory caching decoded images between runs (default: %(default)s).")
+    parser.add_argument("--cache-size", type=float, default=10,
+                        help="Size in GB the cache is kept under (default: %(default)s).")
+    parser.add_argument("--no-cache", action="store_true", help="Decode every image, without the cache.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Overlap decoding and the CV stages with threads in one process "
+                             "instead of using a process pool.")
+    parser.add_argument("--rig-cache", action="store_true",
+                        help="Reuse the tray edge of earlier photos from the same camera or directory when a "
+                             "narrow band check finds it where it was, skipping the corner search. Images "
+                             "reusing it report no corners or lines.")
+    parser.add_argument("--shared", action="store_true",
+                        help="Decode and run the CV stages in separate processes that hand the decoded "
+                             "images over in shared memory instead of pickling them.")
+    parser.add_argument("--slab-size", type=float, default=64, metavar="MB",
+                        help="Shared memory per decoded image in shared mode, enough for the largest "
+                             "one (default: %(default)s).")
+    parser.add_argument("--decode-workers", type=int, default=2,
+                        help="Decode threads in stream mode, or processes in shared mode (default: %(default)s).")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="Decoded images allowed to wait in stream mode (default: twice --workers).")
+    parser.add_argument("--manifest", metavar="PATH", default=None,
+                        help="SQLite file recording every processed image. Only images that are new, changed, "
+                             "failed before or were processed by another pipeline version or parameters are "
+                             "processed again.")
+    parser.add_argument("--hash", action="store_true",
+                        help="Also store content hashes in the manifest, so images whose modification time "
+                             "changed but whose bytes did not are still skipped.")
+    parser.add_argument("--profile", metavar="PATH", default=None,
+                        help="Write per stage timings to PATH: the summary as a table for a .csv "
+                             "path, the summary and every record as JSON otherwise.")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Also record the peak memory of each stage (slower).")
+    args = parser.parse_args(argv)
+
+    if args.rig_cache and (args.stream or args.shared):
+        parser.error("--rig-cache only works with the process pool")
+    files = find_images(args.paths)
+    if not files:
+        parser.error("no images found")
+    store = None
+    if args.store:
+        from .store import FeatureStore
+        store = FeatureStore(args.store)
+        done = store.done_files()
+        remaining = [file_name for file_name in files if file_name not in done]
+        if len(remaining) < len(files):
+            print("Skipping %d images already in %s" % (len(files) - len(remaining), args.store), file=sys.stderr)
+        files = remaining
+
+    cache = None if args.no_cache else ArrayCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
+    pipeline = default_pipeline(args.decode, cache)
+    if args.memory_budget:
+        pipeline = with_memory_budget(pipeline, int(args.memory_budget * 1024 ** 2))
+    if args.rig_cache:
+        from cv.rig import RigGeometry
+        pipeline = RigGeometry(pipeline)
+    manifest = None
+    if args.manifest:
+        from .manifest import RunManifest
+        manifest = RunManifest(args.manifest, pipeline, hashing=args.hash)
+        remaining = manifest.pending(files)
+        if len(remaining) < len(files):
+            print("Skipping %d images already processed according to %s"
+                  % (len(files) - len(remaining), args.manifest), file=sys.stderr)
+        files = remaining
+    profile = None
+    profiler = None
+    if args.profile:
+        profile = "memory" if args.profile_memory else "time"
+        profiler = StageProfiler(memory=args.profile_memory and args.stream)
+
+    slab_bytes = int(args.slab_size * 1024 ** 2)
+    if args.stream:
+        from .streaming import stream
+
+        # the threads of stream mode start in no time, so there is nothing to start ahead
+        start = None
+
+        def run(run_files, plan, pools):
+            return stream(run_files, pipeline, args.decode_workers, queue_size=args.queue_size, threads=plan)
+    elif args.shared:
+        from .shared import run_shared, start_pools
+
+        def start(plan):
+            return start_pools(pipeline, args.decode_workers, plan, warm=True)
+
+        def run(run_files, plan, pools):
+            return run_shared(run_files, pipeline, args.decode_workers, slab_bytes=slab_bytes, threads=plan,
+                              executors=pools)
+    else:
+        def start(plan):
+            return [start_pool(plan, warm=True)]
+
+        def run(run_files, plan, pools):
+            return run_batch(run_files, pipeline=pipeline, threads=plan, executor=pools[0])
+    threads = thread_plan(args.workers, args.cv_threads)
+    timings = []
+    if args.calibrate:
+        threads, timings = calibrate(files[:args.calibrate], run, start=start)
+        for plan, rate in timings:
+            print("%d workers x %d OpenCV threads: %.2f images/sec" % (plan.workers, plan.cv_threads, rate),
+                  file=sys.stderr)
+    print("Using %d workers x %d OpenCV threads" % (threads.workers, threads.cv_threads), file=sys.stderr)
+
+    start = time.perf_counter()
+    failed = 0
+    with store if store is not None else open(args.output, "w", newline="") as output:
+        if store is None:
+            writer = csv.DictWriter(output, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = store.append
+        if args.stream:
+            rows = stream(files, pipeline, args.decode_workers, queue_size=args.queue_size, profiler=profiler,
+                          threads=threads)
+        elif args.shared:
+            rows = run_shared(files, pipeline, args.decode_workers, slab_bytes=slab_bytes, threads=threads,
+                              profile=profile)
+        else:
+            rows = run_batch(files, pipeline=pipeline, profile=profile, threads=threads)
+        for row in rows:
+            if "profile" in row:
+                profiler.extend(row.pop("profile"))
+            write(row)
+            if manifest is not None:
+                manifest.record(row)
+            if row["status"] != "ok":
+                failed += 1
+                print("%s: %s" % (row["file"], row["error"]), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    rate = len(files) / max(elapsed, 1e-9)
+    print("Processed %d images (%d failed) in %.1fs, %.2f images/sec" % (len(files), failed, elapsed, rate),
+          file=sys.stderr)
+    run_info = {
+        "mode": "stream" if args.stream else "shared" if args.shared else "batch",
+        "threads": threads._asdict(),
+        "calibration": [dict(plan._asdict(), images_per_second=round(rate, 3)) for plan, rate in timings],
+        "images": len(files),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(rate, 3),
+    }
+    if store is not None:
+        run_path = os.path.join(args.store, "run-%020d.json" % time.time_ns())
+    else:
+        run_path = args.output + ".run.json"
+    with open(run_path, "w") as run_file:
+        json.dump(run_info, run_file, indent=2)
+    if profiler is not None:
+        profiler.write(args.profile)
+    if manifest is not None:
+        manifest.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
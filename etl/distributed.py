@@ -0,0 +1,488 @@
+"""
+etl/distributed.py
+
+This python file contains the distributed batch mode, which
+spreads a season's worth of photos over several machines.
+
+The images are split into shards held in a work queue, a SQLite
+file on storage every machine can reach. Workers on any number
+of machines lease one shard at a time, process it with the
+batch runner and hand the rows back to the queue. A lease runs
+out unless the worker renews it while working, which a thread
+of the worker does however long a single image takes, so the
+shards of a worker that died are leased again by the others. The rows of
+every image are kept once in the queue and merged into a single
+CSV or feature store at the end.
+
+Usage:
+
+    python -m etl.distributed submit queue.sqlite photos/ --shard-size 64
+    python -m etl.distributed work queue.sqlite -j 8     # on every machine
+    python -m etl.distributed status queue.sqlite
+    python -m etl.distributed merge queue.sqlite -o features.csv
+"""
+
+'''Imports'''
+import argparse
+import csv
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from cv.cache import DEFAULT_CACHE_DIR, ArrayCache
+from cv.features import FEATURE_ARRAYS
+from cv.stages import DECODE_MODES, default_pipeline
+from cv.tiling import with_memory_budget
+from .batch import RESULT_COLUMNS, find_images, result_row, run_batch, start_pool
+from .scheduler import thread_plan
+
+__all__ = ["SHARD_STATUSES", "worker_name", "WorkQueue", "run_worker", "main"]
+
+# pending: waiting for a worker, leased: being processed, done: rows stored,
+# failed: leased max_attempts times without finishing
+SHARD_STATUSES = ("pending", "leased", "done", "failed")
+
+# Images per shard
+DEFAULT_SHARD_SIZE = 64
+
+# Seconds a lease lasts without being renewed
+DEFAULT_LEASE_SECONDS = 600
+
+# Times a shard is leased before it is given up on, e.g. because it crashes every worker
+DEFAULT_MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    files TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    file TEXT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def worker_name():
+    """
+    Name the current process, unique across machines.
+
+    :return str: host:pid
+    """
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+    """
+    A queue of image shards leased to workers, with their results.
+
+    The SQLite file has to be on a filesystem with working file
+    locks. Paths are stored as given, so they have to be valid on
+    every machine running a worker.
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Open the queue, creating it if needed.
+
+        :param path: Path to the SQLite file.
+        :param lease_seconds: Seconds a lease lasts without being renewed.
+        :param max_attempts: Times a shard is leased before it is marked failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # transactions are started by hand, so leasing can take the write lock up front
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _transaction(self):
+        """
+        Start a transaction holding the write lock.
+
+        :return sqlite3.Connection: Use it as a context manager to commit or roll back.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        return self._connection
+
+    def set_option(self, key, value):
+        """
+        Store a setting every worker should use, like the decode mode.
+
+        :param key: Name of the setting.
+        :param value: A JSON serializable value.
+        :return:
+        """
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def option(self, key, default=None):
+        """
+        Read a setting stored with set_option().
+
+        :param key: Name of the setting.
+        :param default: Returned if the setting was never stored.
+        :return:
+        """
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def add(self, files, shard_size=DEFAULT_SHARD_SIZE):
+        """
+        Split images into shards and queue them.
+
+        Images already queued are left out, so the same image set
+        can be submitted again after adding photos to it.
+
+        :param files: Paths to the images.
+        :param shard_size: Images per shard.
+        :return int: The number of shards added.
+        """
+        with self._transaction() as connection:
+            queued = set()
+            for (files_json,) in connection.execute("SELECT files FROM shards"):
+                queued.update(json.loads(files_json))
+            files = [file_name for file_name in files if file_name not in queued]
+            shards = [(json.dumps(files[start:start + shard_size]), "pending", 0)
+                      for start in range(0, len(files), shard_size)]
+            connection.executemany("INSERT INTO shards (files, status, attempts) VALUES (?, ?, ?)", shards)
+        return len(shards)
+
+    def lease(self, worker):
+        """
+        Lease the next pending shard, or one whose lease ran out.
+
+        Shards whose lease ran out max_attempts times are marked
+        failed instead of being leased again.
+
+        :param worker: Name of the worker taking the shard.
+        :return tuple: The shard id and its list of images, or None if no shard is free.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE shards SET status = 'failed', worker = NULL "
+                               "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                               (now, self.max_attempts))
+            row = connection.execute("SELECT shard, files FROM shards WHERE status = 'pending' "
+                                     "OR (status = 'leased' AND lease_until < ?) ORDER BY shard LIMIT 1",
+                                     (now,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE shards SET status = 'leased', worker = ?, lease_until = ?, "
+                               "attempts = attempts + 1 WHERE shard = ?",
+                               (worker, now + self.lease_seconds, row[0]))
+        return row[0], json.loads(row[1])
+
+    def renew(self, shard, worker):
+        """
+        Extend the lease of a shard that is still being worked on.
+
+        :param shard: The shard id.
+        :param worker: Name of the worker holding the lease.
+        :return bool: False if the lease was lost to another worker.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE shards SET lease_until = ? "
+                                        "WHERE shard = ? AND worker = ? AND status = 'leased'",
+                                        (time.time() + self.lease_seconds, shard, worker))
+        return cursor.rowcount == 1
+
+    def release(self, shard, worker):
+        """
+        Give a leased shard back, so another worker can take it straight away.
+
+        :param shard: The shard id.
+        :param worker: Name of the worker holding the lease.
+        :return:
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE shards SET status = 'pending', worker = NULL, lease_until = NULL "
+                               "WHERE shard = ? AND worker = ? AND status = 'leased'", (shard, worker))
+
+    def complete(self, shard, worker, rows):
+        """
+        Store the rows of a shard and mark it done.
+
+        The rows are only stored if the worker still holds the
+        lease, so a worker that was too slow and lost its shard
+        cannot overwrite the rows of the one that took it over.
+
+        :param shard: The shard id.
+        :param worker: Name of the worker holding the lease.
+        :param rows: Rows keyed by RESULT_COLUMNS, one per image of the shard.
+        :return bool: False if the lease was lost and the rows were dropped.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE shards SET status = 'done', lease_until = NULL "
+                                        "WHERE shard = ? AND worker = ? AND status = 'leased'", (shard, worker))
+            if cursor.rowcount != 1:
+                return False
+            # the polygon vertices go along for a merge into a feature store
+            columns = RESULT_COLUMNS + FEATURE_ARRAYS
+            connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                   [(row["file"], shard, json.dumps({column: row[column] for column in columns
+                                                                     if column in row},
+                                                                    default=lambda value: value.tolist()))
+                                    for row in rows])
+        return True
+
+    def progress(self):
+        """
+        Count the shards by status.
+
+        :return dict: Status to number of shards, for every name in SHARD_STATUSES.
+        """
+        counts = dict.fromkeys(SHARD_STATUSES, 0)
+        counts.update(self._connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"))
+        return counts
+
+    def finished(self):
+        """
+        Check whether every shard is done or failed.
+
+        :return bool:
+        """
+        progress = self.progress()
+        return not progress["pending"] and not progress["leased"]
+
+    def rows(self):
+        """
+        Read the stored rows, plus a failed row for every image of a failed shard.
+
+        :return generator: Rows keyed by RESULT_COLUMNS, sorted by image path.
+        """
+        failed = []
+        for (files_json,) in self._connection.execute("SELECT files FROM shards WHERE status = 'failed'"):
+            failed.extend(json.loads(files_json))
+        stored = self._connection.execute("SELECT file, row FROM results ORDER BY file").fetchall()
+        known = {file_name for file_name, _ in stored}
+        error = RuntimeError("shard abandoned after %d leases ran out" % self.max_attempts)
+        missing = {file_name: result_row(file_name, error=error) for file_name in failed if file_name not in known}
+        rows = [(file_name, json.loads(row)) for file_name, row in stored] + sorted(missing.items())
+        for _, row in sorted(rows, key=lambda item: item[0]):
+            yield row
+
+    def merge(self, output=None, store=None):
+        """
+        Write the rows of every image to one CSV file or feature store.
+
+        :param output: Path to the CSV file, used if store is None.
+        :param store: Directory of a FeatureStore to append the rows to.
+        :return int: The number of rows written.
+        """
+        count = 0
+        if store is not None:
+            from .store import FeatureStore
+            with FeatureStore(store) as feature_store:
+                for row in self.rows():
+                    feature_store.append(row)
+                    count += 1
+            return count
+        with open(output, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            for row in self.rows():
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def close(self):
+        """
+        Close the SQLite file.
+
+        :return:
+        """
+        self._connection.close()
+
+
+def _keep_leased(path, lease_seconds, shard, worker, stop, lost):
+    """
+    Renew the lease of a shard every third of its length until told to stop.
+
+    Runs on its own thread with its own connection to the queue, so
+    the lease is renewed while a single slow image is processed.
+
+    :param path: Path to the SQLite file of the queue.
+    :param lease_seconds: Seconds a lease lasts without being renewed.
+    :param shard: The shard id.
+    :param worker: Name of the worker holding the lease.
+    :param stop: threading.Event set when the shard is finished.
+    :param lost: threading.Event set here if the lease was lost to another worker.
+    :return:
+    """
+    with WorkQueue(path, lease_seconds) as queue:
+        while not stop.wait(lease_seconds / 3):
+            if not queue.renew(shard, worker):
+                lost.set()
+                return
+
+
+def run_worker(queue, workers=None, pipeline=None, worker=None, poll_seconds=10):
+    """
+    Lease and process shards until every shard is done or failed.
+
+    While other workers still hold leases, the worker waits and
+    polls, so it can take over their shards if they die. The
+    worker processes are started once and reused for every shard,
+    unless one of them crashed.
+
+    :param queue: The WorkQueue.
+    :param workers: Number of processes per shard, all cores by default.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param worker: Name of this worker, worker_name() by default.
+    :param poll_seconds: Seconds to wait before polling for a free shard again.
+    :return int: The number of shards this worker completed.
+    """
+    worker = worker or worker_name()
+    threads = thread_plan(workers)
+    executor = None
+    completed = 0
+    try:
+        while True:
+            job = queue.lease(worker)
+            if job is None:
+                if queue.finished():
+                    return completed
+                time.sleep(poll_seconds)
+                continue
+            shard, files = job
+            executor = executor or start_pool(threads)
+            rows = []
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(target=_keep_leased, name="lease-%d" % shard, daemon=True,
+                                         args=(queue.path, queue.lease_seconds, shard, worker, stop, lost))
+            heartbeat.start()
+            try:
+                for row in run_batch(files, pipeline=pipeline, threads=threads, executor=executor):
+                    rows.append(row)
+                    if lost.is_set():
+                        break
+            except BaseException:
+                queue.release(shard, worker)
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+            if any(row["error"].startswith(BrokenProcessPool.__name__) for row in rows):
+                # run_batch went on with pools of its own, this one is broken for the next shard
+                executor.shutdown()
+                executor = None
+            if lost.is_set():
+                print("Lost the lease of shard %d" % shard, file=sys.stderr)
+            elif queue.complete(shard, worker, rows):
+                completed += 1
+                failed = sum(row["status"] != "ok" for row in rows)
+                print("Shard %d: %d images (%d failed)" % (shard, len(rows), failed), file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(argv=None):
+    """
+    Command line entry point for the distributed batch mode.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code, 1 if any image failed or a shard was given up on.
+    """
+    parser = argparse.ArgumentParser(prog="python -m etl.distributed",
+                                     description="Extract switchgrass features on several machines "
+                                                 "through a shared work queue.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Split images into shards and queue them.")
+    submit.add_argument("queue", help="SQLite file of the work queue, on storage every worker can reach.")
+    submit.add_argument("paths", nargs="+", help="Image files, directories or glob patterns.")
+    submit.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="Images per shard (default: %(default)s).")
+    submit.add_argument("--decode", choices=DECODE_MODES, default="full",
+                        help="How every worker decodes raw files (default: full).")
+
+    work = commands.add_parser("work", help="Process shards until the queue is finished.")
+    work.add_argument("queue", help="SQLite file of the work queue.")
+    work.add_argument("-j", "--workers", type=int, default=None,
+                      help="Number of worker processes on this machine (default: all cores).")
+    work.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                      help="Seconds a shard stays leased without a sign of life (default: %(default)s).")
+    work.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                      help="Times a shard is leased before it is given up on (default: %(default)s).")
+    work.add_argument("--poll", type=float, default=10,
+                      help="Seconds between looking for free shards while others hold leases "
+                           "(default: %(default)s).")
+    work.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                      help="Run the bilateral filter, Canny and Harris on bands of rows using at most "
+                           "MB megabytes of working memory each, so more workers fit in RAM "
+                           "(default: whole images).")
+    work.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                      help="Directory caching decoded images between runs (default: %(default)s).")
+    work.add_argument("--cache-size", type=float, default=10,
+                      help="Size in GB the cache is kept under (default: %(default)s).")
+    work.add_argument("--no-cache", action="store_true", help="Decode every image, without the cache.")
+
+    status = commands.add_parser("status", help="Show the progress of the queue.")
+    status.add_argument("queue", help="SQLite file of the work queue.")
+
+    merge = commands.add_parser("merge", help="Write the rows of every image to one output.")
+    merge.add_argument("queue", help="SQLite file of the work queue.")
+    merge.add_argument("-o", "--output", default="features.csv", help="CSV file to write the rows to.")
+    merge.add_argument("--store", metavar="DIR", default=None,
+                       help="Append the rows to a columnar feature store in DIR instead of writing a CSV.")
+    args = parser.parse_args(argv)
+
+    if args.command == "submit":
+        files = find_images(args.paths)
+        if not files:
+            parser.error("no images found")
+        with WorkQueue(args.queue) as queue:
+            queue.set_option("decode", args.decode)
+            added = queue.add(files, args.shard_size)
+        print("Queued %d shards" % added, file=sys.stderr)
+        return 0
+
+    if args.command == "work":
+        with WorkQueue(args.queue, args.lease, args.max_attempts) as queue:
+            cache = None if args.no_cache else ArrayCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
+            pipeline = default_pipeline(queue.option("decode", "full"), cache)
+            if args.memory_budget:
+                pipeline = with_memory_budget(pipeline, int(args.memory_budget * 1024 ** 2))
+            start = time.perf_counter()
+            completed = run_worker(queue, args.workers, pipeline, poll_seconds=args.poll)
+        print("Completed %d shards in %.1fs" % (completed, time.perf_counter() - start), file=sys.stderr)
+        return 0
+
+    with WorkQueue(args.queue) as queue:
+        progress = queue.progress()
+        if args.command == "status":
+            print(", ".join("%d %s" % (progress[name], name) for name in SHARD_STATUSES))
+            return 0
+        if not queue.finished():
+            print("Merging while %d shards are pending and %d leased"
+                  % (progress["pending"], progress["leased"]), file=sys.stderr)
+        count = queue.merge(args.output, args.store)
+        failed = sum(row["status"] != "ok" for row in queue.rows())
+    print("Merged %d rows (%d failed)" % (count, failed), file=sys.stderr)
+    return 1 if failed or progress["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+etl/manifest.py
+
+This python file contains the run manifest, which lets the batch
+runner pick up large photo archives where it left off.
+
+The manifest is a SQLite file with one row per image holding its
+size, modification time and optionally its content hash, the
+pipeline version and parameters it was processed with, and the
+outcome and timing of the last attempt. A rerun only processes
+images that are new, changed, failed last time or were processed
+with another version or other parameters; everything else is
+skipped after a single os.stat().
+"""
+
+'''Imports'''
+import json
+import os
+import sqlite3
+import time
+from cv.cache import file_digest
+from cv.pipeline import Pipeline
+from cv.stages import PIPELINE_VERSION
+
+__all__ = ["pipeline_params", "RunManifest"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT,
+    version TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    attempts INTEGER NOT NULL,
+    finished_at REAL NOT NULL
+)
+"""
+
+
+def pipeline_params(pipeline):
+    """
+    Describe the parameters of every stage of a pipeline.
+
+    A runner wrapping the pipeline, like RigGeometry, changes the
+    results too, so its own params are described along with the stages.
+
+    :param pipeline: The Pipeline, or a runner wrapping one.
+    :return str: JSON, the same for pipelines that give the same results.
+    """
+    params = {stage.name: [type(stage).__name__, stage.params] for stage in pipeline}
+    if not isinstance(pipeline, Pipeline):
+        params[type(pipeline).__name__] = getattr(pipeline, "params", None)
+    return json.dumps(params, sort_keys=True, default=repr)
+
+
+class RunManifest:
+    """
+    Tracks which images were processed, how and with what outcome.
+
+    Paths are stored as given, so the same archive should be
+    passed the same way (e.g. always absolute) on every run.
+    """
+
+    def __init__(self, path, pipeline, version=PIPELINE_VERSION, hashing=False):
+        """
+        Open the manifest, creating it if needed.
+
+        :param path: Path to the SQLite file.
+        :param pipeline: The Pipeline of this run.
+        :param version: The pipeline version of this run.
+        :param hashing: Whether to store the content hash of every
+            image, so that images whose size or modification time
+            changed but whose bytes did not (e.g. after a copy) are
+            still skipped.
+        """
+        self.path = path
+        self.version = str(version)
+        self.params = pipeline_params(pipeline)
+        self.hashing = hashing
+        self._stats = {}
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pending(self, files):
+        """
+        Find the images that need to be processed in this run.
+
+        :param files: Paths to the images.
+        :return list: The paths of new, changed or failed images, or ones
+            processed by another version or with other parameters, in order.
+            Images that cannot be read are kept, so their failure is recorded.
+        """
+        known = {row[0]: row[1:] for row in self._connection.execute(
+            "SELECT path, size, mtime_ns, digest, version, params, status FROM images")}
+        pending = []
+        unchanged = []
+        for file_name in files:
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                # gone or unreadable since it was listed
+                pending.append(file_name)
+                continue
+            self._stats[file_name] = (stat.st_size, stat.st_mtime_ns)
+            row = known.get(file_name)
+            if row is None:
+                pending.append(file_name)
+                continue
+            size, mtime_ns, digest, version, params, status = row
+            if status != "ok" or version != self.version or params != self.params:
+                pending.append(file_name)
+            elif (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            elif self.hashing and digest is not None and size == stat.st_size and digest == file_digest(file_name):
+                unchanged.append((stat.st_mtime_ns, file_name))
+            else:
+                pending.append(file_name)
+        if unchanged:
+            with self._connection:
+                self._connection.executemany("UPDATE images SET mtime_ns = ? WHERE path = ?", unchanged)
+        return pending
+
+    def record(self, row):
+        """
+        Store the outcome of one image.
+
+        :param row: A row keyed by RESULT_COLUMNS, as made by etl.batch.result_row().
+        :return:
+        """
+        file_name = row["file"]
+        stat = self._stats.pop(file_name, None)
+        if stat is None:
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                return
+            stat = (stat.st_size, stat.st_mtime_ns)
+        digest = None
+        if self.hashing and row["status"] == "ok":
+            digest = file_digest(file_name)
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "digest = excluded.digest, version = excluded.version, params = excluded.params, "
+                "status = excluded.status, error = excluded.error, seconds = excluded.seconds, "
+                "attempts = attempts + 1, finished_at = excluded.finished_at",
+                (file_name, stat[0], stat[1], digest, self.version, self.params, row["status"],
+                 row["error"] or None, row["seconds"] if row["seconds"] != "" else None, time.time()))
+
+    def summary(self):
+        """
+        Count the images by status.
+
+        :return dict: Status to number of images.
+        """
+        return dict(self._connection.execute("SELECT status, COUNT(*) FROM images GROUP BY status"))
+
+    def close(self):
+        """
+        Close the SQLite file.
+
+        :return:
+        """
+        self._connection.close()
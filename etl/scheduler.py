@@ -0,0 +1,211 @@
+"""
+etl/scheduler.py
+
+This python file contains the CPU scheduler of the batch runner,
+which shares the cores between worker processes and the thread
+pools inside them.
+
+OpenCV runs operators like bilateralFilter, Canny and cornerHarris
+on its own pool of threads, one per core by default, and NumPy's
+BLAS has another one. With a worker process per core on top, the
+machine runs cores squared threads and spends its time switching
+between them. A ThreadPlan splits the cores instead: every worker
+gets cores // workers OpenCV threads and one BLAS thread, set in
+the worker as it starts. calibrate() times a few plans on a short
+warm-up sample of the run's own images and picks the one with the
+highest throughput on the machine at hand.
+"""
+
+'''Imports'''
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import wait
+from contextlib import contextmanager
+
+__all__ = ["ThreadPlan", "available_cores", "thread_plan", "candidate_plans", "apply_threads", "limited_threads",
+           "worker_context", "warm_pool", "calibrate"]
+
+ThreadPlan = namedtuple("ThreadPlan", "workers cv_threads blas_threads")
+
+# BLAS limits set in this process, kept alive so they stay in force
+_limits = []
+
+_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def available_cores():
+    """
+    Count the cores this process may run on.
+
+    :return int:
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def thread_plan(workers=None, cv_threads=None, cores=None):
+    """
+    Split the cores between worker processes and their OpenCV threads.
+
+    :param workers: Number of worker processes, all cores by default.
+    :param cv_threads: OpenCV threads per worker, the cores left to each worker by default.
+    :param cores: Number of cores, available_cores() by default.
+    :return ThreadPlan:
+    """
+    cores = cores or available_cores()
+    workers = workers or cores
+    return ThreadPlan(workers, cv_threads or max(1, cores // workers), 1)
+
+
+def candidate_plans(cores=None):
+    """
+    List the plans worth timing: powers of two of workers up to the core
+    count, each with the cores split between them.
+
+    :param cores: Number of cores, available_cores() by default.
+    :return list: ThreadPlans, fewest workers first.
+    """
+    cores = cores or available_cores()
+    workers = [1]
+    while workers[-1] * 2 < cores:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != cores:
+        workers.append(cores)
+    return [thread_plan(count, cores=cores) for count in workers]
+
+
+def apply_threads(cv_threads, blas_threads=1):
+    """
+    Limit the OpenCV and BLAS threads of the current process.
+
+    Used as the initializer of worker processes. BLAS is limited with
+    threadpoolctl when it is installed; the environment variables are
+    set either way, for any process started from this one.
+
+    :param cv_threads: OpenCV threads.
+    :param blas_threads: BLAS and OpenMP threads.
+    :return:
+    """
+    import cv2
+    cv2.setNumThreads(cv_threads)
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(blas_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    _limits[:] = [threadpool_limits(limits=blas_threads)]
+
+
+@contextmanager
+def limited_threads(cv_threads, blas_threads=1):
+    """
+    Limit the OpenCV and BLAS threads of the current process for a while.
+
+    Like apply_threads(), for runs inside the caller's own process:
+    the OpenCV threads, the environment variables and the BLAS limits
+    it had before are put back on leaving.
+
+    :param cv_threads: OpenCV threads.
+    :param blas_threads: BLAS and OpenMP threads.
+    :return:
+    """
+    import cv2
+    cv_before = cv2.getNumThreads()
+    environment_before = {variable: os.environ.get(variable) for variable in _THREAD_VARIABLES}
+    limits_before = list(_limits)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        threadpool_limits = None
+    blas_before = threadpool_limits(limits=None) if threadpool_limits is not None else None
+    try:
+        apply_threads(cv_threads, blas_threads)
+        yield
+    finally:
+        cv2.setNumThreads(cv_before)
+        for variable, value in environment_before.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        if blas_before is not None:
+            blas_before.restore_original_limits()
+        _limits[:] = limits_before
+
+
+def worker_context():
+    """
+    Pick how worker processes that call apply_threads() are started.
+
+    A process forked after OpenCV started its thread pool crashes
+    when it resizes the pool, so where it is available the workers
+    are forked from a clean server process instead.
+
+    :return: A multiprocessing context, or None for the default one.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+def _wait_a_moment():
+    """
+    Wait long enough that every new worker process takes one of these jobs.
+
+    :return:
+    """
+    time.sleep(0.1)
+
+
+def warm_pool(executor, workers):
+    """
+    Wait until every process of a new pool has started and run an empty job,
+    so that timing the images afterwards leaves the start out.
+
+    :param executor: The ProcessPoolExecutor.
+    :param workers: Its number of processes.
+    :return: The executor.
+    """
+    wait([executor.submit(_wait_a_moment) for _ in range(workers)])
+    return executor
+
+
+def calibrate(files, run, plans=None, start=None):
+    """
+    Time plans on a warm-up sample and pick the fastest.
+
+    The sample is run once with the first plan before any timing,
+    so the page cache and any decode cache of the pipeline are as
+    warm for the first plan timed as for the others. The pools of
+    each plan are started before its clock starts, so that only the
+    images are timed whatever the plan.
+
+    :param files: The warm-up sample of image paths.
+    :param run: Takes the files, a ThreadPlan and the pools start returned for it,
+        and returns an iterable of result rows.
+    :param plans: The ThreadPlans to time, candidate_plans() by default.
+    :param start: Takes a ThreadPlan and returns a list of started pools, shut down
+        once the plan is timed, or None to start nothing.
+    :return tuple: The fastest ThreadPlan and a list of (ThreadPlan, images per second) for every plan,
+        counting only the images that succeeded.
+    """
+    plans = plans or candidate_plans()
+    start = start or (lambda plan: [])
+    timings = []
+    for index, plan in enumerate([plans[0]] + list(plans)):
+        pools = start(plan)
+        try:
+            begin = time.perf_counter()
+            count = sum(1 for row in run(files, plan, pools) if row["status"] == "ok")
+            seconds = time.perf_counter() - begin
+        finally:
+            for pool in pools:
+                pool.shutdown()
+        # the first run only warms the caches
+        if index:
+            timings.append((plan, count / max(seconds, 1e-9)))
+    return max(timings, key=lambda timing: timing[1])[0], timings
@@ -0,0 +1,399 @@
+"""
+etl/shared.py
+
+This python file contains the shared memory mode of the batch
+runner, which decodes images and runs the computer vision stages
+in separate processes without pickling the frames between them.
+
+A fixed pool of shared memory slabs is created up front. Decode
+processes write the arrays of each decoded frame into a free slab
+once and send back only their layout; CV processes read them as
+NumPy views of the same slab, run the rest of the pipeline and
+send back the result row. The slab then goes back to the pool for
+the next image. So what travels between processes is a few
+hundred bytes whatever the size of the image, no frame is ever
+copied or pickled again, and no memory is allocated per image for
+the hand-off. The number of slabs also bounds how many decoded
+frames are held at once.
+"""
+
+'''Imports'''
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from cv.features import FEATURE_INPUTS, frame_features
+from cv.pipeline import Frame
+from cv.profiling import StageProfiler
+from cv.stages import default_pipeline
+from .batch import result_row
+from .scheduler import apply_threads, thread_plan, warm_pool, worker_context
+
+__all__ = ["DEFAULT_SLAB_BYTES", "SlabPool", "pack_frame", "unpack_frame", "start_pools", "run_shared"]
+
+# Room for a full resolution 20 MP raw frame with its three channels
+DEFAULT_SLAB_BYTES = 64 * 1024 ** 2
+
+# Arrays start on cache line boundaries within a slab
+_ALIGNMENT = 64
+
+# The pipeline half of a worker process, set by _init_worker()
+_pipeline = None
+
+# Slabs a worker process has attached to, by name
+_attached = {}
+
+
+class SlabPool:
+    """
+    A fixed set of shared memory blocks reused for one frame after another.
+
+    The pool belongs to the process that created it, which hands
+    slabs out with acquire() and takes them back with release().
+    Other processes only ever attach to a slab by its name.
+    """
+
+    def __init__(self, count, slab_bytes=DEFAULT_SLAB_BYTES):
+        """
+        Create the slabs.
+
+        :param count: Number of slabs.
+        :param slab_bytes: Size of each slab, enough for the largest decoded frame.
+        """
+        self.slab_bytes = slab_bytes
+        self._slabs = []
+        try:
+            for _ in range(count):
+                self._slabs.append(shared_memory.SharedMemory(create=True, size=slab_bytes))
+        except BaseException:
+            self.close()
+            raise
+        self._free = list(range(count))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._slabs)
+
+    @property
+    def free(self):
+        """
+        The number of slabs not handed out.
+
+        :return int:
+        """
+        return len(self._free)
+
+    def acquire(self):
+        """
+        Hand out a free slab.
+
+        :return str: The name other processes attach to the slab with, or None if every slab is in use.
+        """
+        if not self._free:
+            return None
+        return self._slabs[self._free.pop()].name
+
+    def release(self, name):
+        """
+        Take a slab back once its image is finished.
+
+        :param name: The name returned by acquire().
+        :return:
+        """
+        self._free.append(next(index for index, slab in enumerate(self._slabs) if slab.name == name))
+
+    def close(self):
+        """
+        Free the shared memory of every slab.
+
+        :return:
+        """
+        for slab in self._slabs:
+            slab.close()
+            slab.unlink()
+        self._slabs = []
+        self._free = []
+
+
+def _attach(name):
+    """
+    Open a slab in a worker process, once per process.
+
+    :param name: Name of the slab.
+    :return memoryview: The slab's memory.
+    """
+    slab = _attached.get(name)
+    if slab is None:
+        slab = _attached[name] = shared_memory.SharedMemory(name=name)
+    return slab.buf
+
+
+def pack_frame(frame, buffer):
+    """
+    Write the arrays of a frame into a slab.
+
+    :param frame: The Frame to hand over.
+    :param buffer: The slab's memory.
+    :return tuple: The values that are not arrays, the provenance of every value and
+        the layout of the arrays, all small enough to pickle.
+    """
+    values = {}
+    layout = {}
+    offset = 0
+    for name, value in frame.items():
+        if not isinstance(value, np.ndarray):
+            values[name] = value
+            continue
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        if offset + value.nbytes > len(buffer):
+            raise ValueError("a decoded frame needs at least %d bytes, more than the %d bytes of a slab"
+                             % (offset + value.nbytes, len(buffer)))
+        target = np.ndarray(value.shape, value.dtype, buffer, offset)
+        target[...] = value
+        layout[name] = (offset, value.shape, value.dtype.str)
+        offset += value.nbytes
+    return values, dict(frame.provenance), layout
+
+
+def unpack_frame(packed, buffer):
+    """
+    Rebuild a frame whose arrays are read-only views of a slab.
+
+    :param packed: The tuple returned by pack_frame().
+    :param buffer: The slab's memory.
+    :return Frame:
+    """
+    values, provenance, layout = packed
+    frame = Frame()
+    frame.update(values)
+    for name, (offset, shape, dtype) in layout.items():
+        view = np.ndarray(shape, np.dtype(dtype), buffer, offset)
+        view.flags.writeable = False
+        frame[name] = view
+    frame.provenance = provenance
+    return frame
+
+
+def _init_worker(pipeline, threads):
+    """
+    Set up a worker process: limit its threads and keep the pipeline half it runs, sent once per process.
+
+    :param pipeline: The Pipeline.
+    :param threads: The ThreadPlan of the process.
+    :return:
+    """
+    global _pipeline
+    apply_threads(threads.cv_threads, threads.blas_threads)
+    _pipeline = pipeline
+
+
+def _decode(file_name, slab_name, profile=None):
+    """
+    Decode one image into a slab, in a decode process.
+
+    :param file_name: Path to the image.
+    :param slab_name: Name of the slab to write to.
+    :param profile: See etl.batch.process_file().
+    :return tuple: The packed frame, the seconds spent and the stage records (None
+        without a profile), or None and the failed row.
+    """
+    profiler = None if profile is None else StageProfiler(memory=(profile == "memory"))
+    start = time.perf_counter()
+    try:
+        frame = Frame()
+        frame.add_source("file_name", file_name)
+        _pipeline.resume(frame, profiler=profiler)
+        packed = pack_frame(frame, _attach(slab_name))
+    except Exception as error:
+        row = result_row(file_name, error=error, seconds=round(time.perf_counter() - start, 4))
+        if profiler is not None:
+            row["profile"] = profiler.records
+        return None, row
+    return packed, time.perf_counter() - start, None if profiler is None else profiler.records
+
+
+def _analyse(file_name, packed, slab_name, seconds, profile=None, records=None):
+    """
+    Run the CV stages on a frame in a slab, in a CV process.
+
+    :param file_name: Path to the image.
+    :param packed: The packed frame from _decode().
+    :param slab_name: Name of the slab holding its arrays.
+    :param seconds: Seconds spent decoding it.
+    :param profile: See etl.batch.process_file().
+    :param records: The stage records of the decode, or None.
+    :return dict: A row keyed by RESULT_COLUMNS, with the records of both halves
+        under "profile" with a profile.
+    """
+    profiler = None if profile is None else StageProfiler(memory=(profile == "memory"))
+    start = time.perf_counter()
+    try:
+        frame = unpack_frame(packed, _attach(slab_name))
+        features = frame_features(_pipeline.resume(frame, keep=FEATURE_INPUTS, profiler=profiler))
+    except Exception as error:
+        row = result_row(file_name, error=error, seconds=round(seconds + time.perf_counter() - start, 4))
+    else:
+        row = result_row(file_name, features, seconds=round(seconds + time.perf_counter() - start, 4))
+    if profiler is not None:
+        row["profile"] = (records or []) + profiler.records
+    return row
+
+
+def start_pools(pipeline=None, decode_workers=2, threads=None, split_after="decode", warm=False):
+    """
+    Start the decode and CV processes of run_shared() ahead of a run.
+
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param decode_workers: Number of processes decoding images.
+    :param threads: The ThreadPlan of the CV processes, see run_shared().
+    :param split_after: Name of the last stage run by the decode processes.
+    :param warm: Whether to wait until every process has started, see etl.scheduler.warm_pool().
+    :return list: The pool of decode processes and the pool of CV processes.
+    """
+    pipeline = pipeline or default_pipeline()
+    threads = threads or thread_plan()
+    executors = []
+    for count, half in zip((decode_workers, threads.workers), pipeline.split(split_after)):
+        executor = ProcessPoolExecutor(count, mp_context=worker_context(), initializer=_init_worker,
+                                       initargs=(half, threads))
+        executors.append(warm_pool(executor, count) if warm else executor)
+    return executors
+
+
+def run_shared(files, pipeline=None, decode_workers=2, cv_workers=None, slabs=None,
+               slab_bytes=DEFAULT_SLAB_BYTES, split_after="decode", threads=None, profile=None, executors=None):
+    """
+    Process images in decode and CV processes that share frames through slabs.
+
+    Rows are yielded as soon as each image finishes, so the order
+    does not follow the input order. When a process dies outright,
+    the jobs that were in flight on its pool are run again one at a
+    time to find the image that crashed, which is the only one
+    reported as failed, and the pool is started afresh.
+
+    :param files: Iterable of image paths, read lazily.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param decode_workers: Number of processes decoding images.
+    :param cv_workers: Number of processes running the CV stages, all cores by default.
+    :param slabs: Number of slabs, and so of decoded frames held at once, twice
+        cv_workers plus decode_workers by default.
+    :param slab_bytes: Size of each slab, enough for every array of the largest decoded frame.
+    :param split_after: Name of the last stage run by the decode processes.
+    :param threads: The ThreadPlan of the CV processes, its workers overriding cv_workers,
+        or None to split the cores evenly between them. Decode processes follow
+        its OpenCV and BLAS threads too.
+    :param profile: See etl.batch.process_file(); the records of both halves of the
+        pipeline end up in the row.
+    :param executors: The pools from start_pools() for the same pipeline, workers and
+        split, left running afterwards, or None to start them.
+    :return generator: Result rows keyed by RESULT_COLUMNS.
+    """
+    pipeline = pipeline or default_pipeline()
+    decode, analyse = pipeline.split(split_after)
+    threads = threads or thread_plan(cv_workers)
+    cv_workers = threads.workers
+    if decode_workers < 1 or cv_workers < 1:
+        raise ValueError("Need at least one decode and one CV worker")
+    workers = {True: decode_workers, False: cv_workers}
+
+    def start_pool(decoding, count):
+        return ProcessPoolExecutor(count, mp_context=worker_context(), initializer=_init_worker,
+                                   initargs=(decode if decoding else analyse, threads))
+
+    file_iterator = iter(files)
+    with SlabPool(slabs or 2 * cv_workers + decode_workers, slab_bytes) as pool:
+        # whether it decodes -> the pool of decode or CV processes
+        given, executors = executors, {}
+        # the kinds of pools this run started, and so shuts down
+        owned = set()
+        # future -> (file name, slab name, whether it is a decode, arguments of the job)
+        futures = {}
+
+        def submit(decoding, file_name, slab_name, args):
+            try:
+                future = executors[decoding].submit(_decode if decoding else _analyse, *args)
+            except BrokenProcessPool as error:
+                # the pool broke since the last wait, so this job is retried along with the rest of its jobs
+                future = Future()
+                future.set_exception(error)
+            futures[future] = (file_name, slab_name, decoding, args)
+
+        def finish(file_name, slab_name, decoding, result):
+            # hand a decoded frame on to the CV processes, or give the finished row
+            if decoding and result[0] is not None:
+                packed, seconds, records = result
+                submit(False, file_name, slab_name, (file_name, packed, slab_name, seconds, profile, records))
+                return None
+            pool.release(slab_name)
+            return result[1] if decoding else result
+
+        def isolate(decoding, jobs):
+            # run the jobs of a broken pool one at a time, so a crash can only come from its own image
+            single = start_pool(decoding, 1)
+            try:
+                for file_name, slab_name, _, args in jobs:
+                    try:
+                        result = single.submit(_decode if decoding else _analyse, *args).result()
+                    except Exception as error:
+                        pool.release(slab_name)
+                        yield result_row(file_name, error=error)
+                        if isinstance(error, BrokenProcessPool):
+                            single.shutdown()
+                            single = start_pool(decoding, 1)
+                        continue
+                    row = finish(file_name, slab_name, decoding, result)
+                    if row is not None:
+                        yield row
+            finally:
+                single.shutdown()
+
+        try:
+            for decoding, count in workers.items():
+                if given is None:
+                    executors[decoding] = start_pool(decoding, count)
+                    owned.add(decoding)
+                else:
+                    executors[decoding] = given[0 if decoding else 1]
+            while True:
+                while pool.free:
+                    file_name = next(file_iterator, None)
+                    if file_name is None:
+                        break
+                    slab_name = pool.acquire()
+                    submit(True, file_name, slab_name, (file_name, slab_name, profile))
+                if not futures:
+                    return
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                broken = set()
+                for future in done:
+                    file_name, slab_name, decoding, _ = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A worker died outright (e.g. a crash inside a native decoder)
+                        broken.add(decoding)
+                        continue
+                    except Exception as error:
+                        del futures[future]
+                        pool.release(slab_name)
+                        yield result_row(file_name, error=error)
+                        continue
+                    del futures[future]
+                    row = finish(file_name, slab_name, decoding, result)
+                    if row is not None:
+                        yield row
+                for decoding in broken:
+                    executors[decoding].shutdown()
+                    jobs = [futures.pop(future) for future in list(futures) if futures[future][2] == decoding]
+                    yield from isolate(decoding, jobs)
+                    executors[decoding] = start_pool(decoding, workers[decoding])
+                    owned.add(decoding)
+        finally:
+            for decoding in owned:
+                executors[decoding].shutdown()
@@ -0,0 +1,215 @@
+"""
+etl/store.py
+
+This python file contains the columnar feature store the batch
+runner can append its rows to.
+
+The store is a directory of part files. Each part is an
+uncompressed .npz archive holding one NumPy array per column,
+so reading a column only reads that column from each part, and
+the values take no more room than their dtype. The vertices of
+the approximated polygon, a different number per row, are kept
+as one flat array of points per part with the count of each row. Rows are buffered
+and written a batch at a time as a new part, which is never
+changed afterwards. Parts are written to a temporary name and
+renamed into place, so several processes can append to the same
+store at once and a crash never leaves half a part behind.
+"""
+
+'''Imports'''
+import glob
+import os
+import tempfile
+import time
+import numpy as np
+from cv.features import FEATURE_ARRAYS, FEATURE_COLUMNS
+
+__all__ = ["STORE_COLUMNS", "COLUMN_DTYPES", "ARRAY_DTYPE", "FeatureStore"]
+
+# Compact dtypes of the numeric columns
+COLUMN_DTYPES = {
+    "edge_row": np.int32,
+    "crop_top": np.int32,
+    "crop_bottom": np.int32,
+    "crop_left": np.int32,
+    "crop_right": np.int32,
+    "corner_count": np.int32,
+    "line_count": np.int32,
+    "contour_count": np.int32,
+    "contour_area": np.float64,
+    "contour_perimeter": np.float32,
+    "polygon_vertices": np.int16,
+    "line_edge_row": np.int32,
+    "seconds": np.float32,
+    "processed_at": np.float64,
+}
+
+# dtype of the points of the FEATURE_ARRAYS columns, in full resolution pixels
+ARRAY_DTYPE = np.int32
+
+# file_name and error are stored as fixed width unicode, ok as bool
+STORE_COLUMNS = ("file_name", "ok", "error", "seconds", "processed_at") + FEATURE_COLUMNS + FEATURE_ARRAYS
+
+# Rows buffered before a part is written
+DEFAULT_BATCH_SIZE = 256
+
+
+def _missing(dtype):
+    """
+    The value stored in a numeric column for an image that failed.
+
+    :param dtype: The column dtype.
+    :return: NaN for floats, -1 for integers.
+    """
+    return np.nan if np.issubdtype(dtype, np.floating) else -1
+
+
+class FeatureStore:
+    """
+    An append-only, columnar store of result rows.
+
+    Use it as a context manager, or call close(), so the last
+    buffered rows are written.
+    """
+
+    def __init__(self, directory, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Initialize the store, creating the directory if needed.
+
+        :param directory: Directory holding the part files.
+        :param batch_size: Rows buffered before a part is written.
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        self._rows = []
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.column("ok"))
+
+    def append(self, row):
+        """
+        Add a result row, writing a part once a batch is full.
+
+        :param row: A row keyed by RESULT_COLUMNS, as made by etl.batch.result_row().
+        :return:
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a new part.
+
+        :return str: Path to the part, or None if nothing was buffered.
+        """
+        if not self._rows:
+            return None
+        rows, self._rows = self._rows, []
+        columns = {
+            "file_name": np.array([row["file"] for row in rows], np.str_),
+            "ok": np.array([row["status"] == "ok" for row in rows], bool),
+            "error": np.array([row["error"] for row in rows], np.str_),
+        }
+        for name, dtype in COLUMN_DTYPES.items():
+            values = [row.get(name, "") for row in rows]
+            columns[name] = np.array([_missing(dtype) if value in ("", None) else value for value in values], dtype)
+        columns["processed_at"][:] = time.time()
+        for name in FEATURE_ARRAYS:
+            points = [np.asarray(row.get(name, ()), ARRAY_DTYPE).reshape(-1, 2) for row in rows]
+            columns[name] = np.concatenate(points)
+            columns[name + "_lengths"] = np.array([len(row_points) for row_points in points], np.int32)
+
+        self._sequence += 1
+        name = "part-%020d-%d-%06d.npz" % (time.time_ns(), os.getpid(), self._sequence)
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as output:
+                np.savez(output, **columns)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return os.path.join(self.directory, name)
+
+    def close(self):
+        """
+        Write the rows still buffered.
+
+        :return:
+        """
+        self.flush()
+
+    def parts(self):
+        """
+        List the part files in the order they were written.
+
+        :return list:
+        """
+        return sorted(glob.glob(os.path.join(self.directory, "part-*.npz")))
+
+    def column(self, name):
+        """
+        Read one column of every stored row.
+
+        :param name: One of STORE_COLUMNS.
+        :return numpy.ndarray: For FEATURE_ARRAYS, an object array holding an N x 2 array
+            of points per row, None for rows written before the column existed.
+        """
+        if name not in STORE_COLUMNS:
+            raise KeyError(name)
+        if name in FEATURE_ARRAYS:
+            return self._array_column(name)
+        arrays = []
+        for part in self.parts():
+            with np.load(part) as archive:
+                arrays.append(archive[name])
+        if not arrays:
+            return np.empty(0, COLUMN_DTYPES.get(name, bool if name == "ok" else np.str_))
+        return np.concatenate(arrays)
+
+    def _array_column(self, name):
+        """
+        Read a column of FEATURE_ARRAYS, splitting the points of each part by row.
+
+        :param name: One of FEATURE_ARRAYS.
+        :return numpy.ndarray: Object array of N x 2 arrays.
+        """
+        rows = []
+        for part in self.parts():
+            with np.load(part) as archive:
+                if name not in archive:
+                    rows.extend([None] * len(archive["ok"]))
+                    continue
+                lengths = archive[name + "_lengths"]
+                rows.extend(np.split(archive[name], np.cumsum(lengths)[:-1]))
+        column = np.empty(len(rows), object)
+        for index, points in enumerate(rows):
+            column[index] = points
+        return column
+
+    def read(self, columns=STORE_COLUMNS):
+        """
+        Read several columns of every stored row.
+
+        :param columns: Names from STORE_COLUMNS.
+        :return dict: Column name to array.
+        """
+        return {name: self.column(name) for name in columns}
+
+    def done_files(self):
+        """
+        Find the images that already have a successful row.
+
+        :return set: The file names.
+        """
+        files, ok = self.column("file_name"), self.column("ok")
+        return set(files[ok].tolist())
@@ -0,0 +1,147 @@
+"""
+etl/streaming.py
+
+This python file contains the streaming mode of the batch
+runner, which overlaps file reads and raw decoding with the
+computer vision stages.
+
+Decode threads read and decode images into a bounded queue and
+CV threads take frames off it. rawpy, PIL and OpenCV release the
+GIL while they work, so both kinds of thread run in parallel
+without copying frames between processes. When the CV threads
+fall behind, the full queue blocks the decode threads, so at most
+queue_size decoded frames are held in memory at once.
+"""
+
+'''Imports'''
+import queue
+import threading
+import time
+from cv.features import FEATURE_INPUTS, frame_features
+from cv.pipeline import Frame
+from cv.stages import default_pipeline
+from .batch import result_row
+from .scheduler import limited_threads, thread_plan
+
+__all__ = ["stream"]
+
+# Marks the end of the work on a queue
+_DONE = object()
+
+
+def _put(target, item, stop):
+    """
+    Put an item on a bounded queue, giving up once the stream stops.
+
+    :param target: The queue.
+    :param item: The item.
+    :param stop: Event set when the stream is stopped.
+    :return bool: Whether the item was queued.
+    """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def stream(files, pipeline=None, decode_workers=2, cv_workers=None, queue_size=None, split_after="decode",
+           profiler=None, threads=None):
+    """
+    Process images with overlapping decode and CV stages.
+
+    Rows are yielded as soon as each image finishes, so features
+    can be written out while later images are still decoding.
+    Closing the generator early stops the workers.
+
+    :param files: Iterable of image paths, read lazily.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param decode_workers: Number of threads reading and decoding images.
+    :param cv_workers: Number of threads running the CV stages, all cores by default.
+    :param queue_size: Decoded frames allowed to wait for a CV thread, twice cv_workers by default.
+    :param split_after: Name of the last stage run by the decode threads.
+    :param profiler: A StageProfiler shared by every thread, or None.
+    :param threads: The ThreadPlan to follow, its workers being the CV threads and
+        overriding cv_workers, or None to split the cores evenly between the CV threads.
+    :return generator: Result rows keyed by RESULT_COLUMNS.
+    """
+    pipeline = pipeline or default_pipeline()
+    decode, analyse = pipeline.split(split_after)
+    threads = threads or thread_plan(cv_workers)
+    cv_workers = threads.workers
+    if decode_workers < 1 or cv_workers < 1:
+        raise ValueError("Need at least one decode and one CV worker")
+    decoded = queue.Queue(maxsize=queue_size or 2 * cv_workers)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    file_iterator = iter(files)
+    file_lock = threading.Lock()
+    decoders_left = [decode_workers]
+
+    def _decode_worker():
+        while not stop.is_set():
+            with file_lock:
+                file_name = next(file_iterator, _DONE)
+            if file_name is _DONE:
+                break
+            start = time.perf_counter()
+            frame = Frame()
+            try:
+                frame.add_source("file_name", file_name)
+                decode.resume(frame, profiler=profiler)
+            except Exception as error:
+                results.put(result_row(file_name, error=error, seconds=round(time.perf_counter() - start, 4)))
+                continue
+            if not _put(decoded, (file_name, frame, time.perf_counter() - start), stop):
+                break
+        with file_lock:
+            decoders_left[0] -= 1
+            last = decoders_left[0] == 0
+        if last:
+            for _ in range(cv_workers):
+                _put(decoded, _DONE, stop)
+
+    def _cv_worker():
+        while not stop.is_set():
+            try:
+                item = decoded.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                break
+            file_name, frame, seconds = item
+            start = time.perf_counter()
+            features = failure = None
+            try:
+                features = frame_features(analyse.resume(frame, keep=FEATURE_INPUTS, profiler=profiler))
+            except Exception as error:
+                failure = error
+            del frame, item
+            seconds = round(seconds + time.perf_counter() - start, 4)
+            results.put(result_row(file_name, features, failure, seconds))
+        results.put(_DONE)
+
+    workers_started = ([threading.Thread(target=_decode_worker, name="decode-%d" % index, daemon=True)
+                        for index in range(decode_workers)]
+                       + [threading.Thread(target=_cv_worker, name="cv-%d" % index, daemon=True)
+                          for index in range(cv_workers)])
+    # every CV thread shares the OpenCV pool of this process, limited until the run ends
+    with limited_threads(threads.cv_threads * cv_workers, threads.blas_threads):
+        for thread in workers_started:
+            thread.start()
+
+        try:
+            running = cv_workers
+            while running:
+                row = results.get()
+                if row is _DONE:
+                    running -= 1
+                else:
+                    yield row
+        finally:
+            stop.set()
+            for thread in workers_started:
+                thread.join()
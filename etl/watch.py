@@ -0,0 +1,334 @@
+"""
+etl/watch.py
+
+This python file contains the watch folder mode, which extracts
+features from photos as a tethered camera writes them.
+
+A FolderWatcher notices new raw and JPEG files in a directory and
+hands each one on as soon as it is completely written: once its
+size and modification time have stayed the same for stable_seconds,
+or straight away when the file was renamed into place or closed by
+the program writing it. The directory is scanned every poll_seconds,
+which works on any filesystem; when the optional watchdog package
+is installed, file system events wake the watcher up early and
+report renames and closes. ingest() processes the files on a pool
+of worker processes the moment they are ready.
+
+Usage:
+
+    python -m etl.watch tether/ --store features/
+"""
+
+'''Imports'''
+import argparse
+import csv
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from cv.features import IMAGE_EXTENSIONS
+from cv.stages import DECODE_MODES, default_pipeline
+from .batch import RESULT_COLUMNS, process_file, run_isolated
+
+__all__ = ["FolderWatcher", "ingest", "main"]
+
+# Seconds a file's size has to stay the same before it counts as written
+DEFAULT_STABLE_SECONDS = 0.5
+
+# Seconds between scans of the directory
+DEFAULT_POLL_SECONDS = 0.2
+
+
+class FolderWatcher:
+    """
+    Finds the image files written to a directory since it started watching.
+    """
+
+    def __init__(self, directory, recursive=False, stable_seconds=DEFAULT_STABLE_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, include_existing=False, events=True):
+        """
+        Start watching a directory.
+
+        :param directory: The directory the camera writes to.
+        :param recursive: Whether to watch its subdirectories too.
+        :param stable_seconds: Seconds the size and modification time of a file have to
+            stay the same before it counts as written.
+        :param poll_seconds: Seconds between scans of the directory.
+        :param include_existing: Whether the files already there count as new.
+        :param events: Whether to use file system events when watchdog is installed.
+        """
+        self.directory = directory
+        self.recursive = recursive
+        self.stable_seconds = stable_seconds
+        self.poll_seconds = poll_seconds
+        # path -> (size, mtime_ns, time first seen with them)
+        self._growing = {}
+        self._seen = set()
+        self._completed = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_scan = 0
+        self._observer = self._start_observer() if events else None
+        if not include_existing:
+            self._seen.update(self._scan())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_observer(self):
+        """
+        Subscribe to file system events, if watchdog is installed.
+
+        :return: The running watchdog Observer, or None.
+        """
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                if event.event_type in ("moved", "closed"):
+                    with watcher._lock:
+                        watcher._completed.add(getattr(event, "dest_path", None) or event.src_path)
+                watcher._wake.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.directory, recursive=self.recursive)
+        observer.start()
+        return observer
+
+    def _scan(self):
+        """
+        List the image files in the directory.
+
+        :return dict: Path to its os.stat() result.
+        """
+        found = {}
+        directories = [self.directory]
+        while directories:
+            try:
+                entries = list(os.scandir(directories.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        directories.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    try:
+                        found[entry.path] = entry.stat()
+                    except OSError:
+                        continue
+        return found
+
+    def poll(self):
+        """
+        Find the files that finished being written since the last poll, without blocking.
+
+        The directory is scanned at most every poll_seconds, unless
+        a file system event came in since.
+
+        :return list: Paths of the written files, oldest first.
+        """
+        now = time.monotonic()
+        if now - self._last_scan < self.poll_seconds and not self._wake.is_set():
+            return []
+        self._wake.clear()
+        self._last_scan = now
+        with self._lock:
+            completed, self._completed = self._completed, set()
+
+        ready = []
+        for path, stat in self._scan().items():
+            if path in self._seen:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            growing = self._growing.get(path)
+            if growing is None or growing[:2] != signature:
+                self._growing[path] = signature + (now,)
+                growing = self._growing[path]
+            if stat.st_size and (path in completed or now - growing[2] >= self.stable_seconds):
+                ready.append((stat.st_mtime_ns, path))
+                self._seen.add(path)
+                del self._growing[path]
+        return [path for _, path in sorted(ready)]
+
+    def wait(self, timeout=None):
+        """
+        Block until files finished being written, or the timeout runs out.
+
+        :param timeout: Seconds to wait at most, or None to wait for ever.
+        :return list: Paths of the written files, oldest first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ready = self.poll()
+            if ready:
+                return ready
+            pause = self.poll_seconds if deadline is None else min(self.poll_seconds, deadline - time.monotonic())
+            if pause <= 0:
+                return []
+            self._wake.wait(pause)
+
+    def close(self):
+        """
+        Stop listening to file system events.
+
+        :return:
+        """
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+
+def ingest(watcher, pipeline=None, workers=None, stop=None):
+    """
+    Process every file a watcher finds, as soon as it is written.
+
+    A worker dying outright on a file only fails that file: the
+    files in flight are run again one at a time to find it, and
+    watching goes on with a new pool.
+
+    :param watcher: The FolderWatcher.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param workers: Number of worker processes, all cores by default.
+    :param stop: threading.Event ending the ingestion, or None to run until closed.
+    :return generator: Result rows keyed by RESULT_COLUMNS, each with the seconds from
+        the file being written to its row under "latency", and None after every
+        poll_seconds without a row, so the caller can flush its output.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    def start_pool(count):
+        executor = ProcessPoolExecutor(max_workers=count)
+        # the pool starts its processes on the first job, so start them before the first photo
+        executor.submit(time.sleep, 0)
+        return executor
+
+    def finished(row, written):
+        row["latency"] = round(time.time() - written, 3)
+        return row
+
+    executor = start_pool(workers)
+    try:
+        # future -> (file name, when it was written)
+        futures = {}
+        while stop is None or not stop.is_set():
+            for file_name in watcher.poll() if futures else watcher.wait(watcher.poll_seconds):
+                try:
+                    written = os.stat(file_name).st_mtime
+                except OSError:
+                    continue
+                try:
+                    future = executor.submit(process_file, file_name, pipeline)
+                except BrokenProcessPool as error:
+                    # the pool broke since the last wait, so this file is retried with the others in flight
+                    future = Future()
+                    future.set_exception(error)
+                futures[future] = (file_name, written)
+            if not futures:
+                yield None
+                continue
+            done, _ = wait(futures, timeout=watcher.poll_seconds, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None
+            broken = False
+            for future in done:
+                try:
+                    row = future.result()
+                except BrokenProcessPool:
+                    # A worker died outright (e.g. a crash inside a native decoder)
+                    broken = True
+                    continue
+                yield finished(row, futures.pop(future)[1])
+            if broken:
+                executor.shutdown()
+                in_flight, futures = dict(futures.values()), {}
+                for row in run_isolated(in_flight, start_pool, process_file, pipeline):
+                    yield finished(row, in_flight[row["file"]])
+                executor = start_pool(workers)
+    finally:
+        executor.shutdown()
+
+
+def main(argv=None):
+    """
+    Command line entry point for the watch folder mode.
+
+    :param argv: Command line arguments, sys.argv by default.
+    :return int: The exit code.
+    """
+    parser = argparse.ArgumentParser(prog="python -m etl.watch",
+                                     description="Extract switchgrass features from photos as they are written "
+                                                 "to a directory. Stop with Ctrl+C.")
+    parser.add_argument("directory", help="The directory the camera writes to.")
+    parser.add_argument("-o", "--output", default="features.csv", help="CSV file to append the rows to.")
+    parser.add_argument("--store", metavar="DIR", default=None,
+                        help="Append the rows to a columnar feature store in DIR instead of a CSV.")
+    parser.add_argument("--flush-seconds", type=float, default=5,
+                        help="Longest a row waits in memory before it is written to the store "
+                             "(default: %(default)s).")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores).")
+    parser.add_argument("--decode", choices=DECODE_MODES, default="full",
+                        help="How raw files are decoded (default: full).")
+    parser.add_argument("--recursive", action="store_true", help="Also watch the subdirectories.")
+    parser.add_argument("--existing", action="store_true", help="Also process the images already there.")
+    parser.add_argument("--stable", type=float, default=DEFAULT_STABLE_SECONDS,
+                        help="Seconds a file has to stop growing before it is processed (default: %(default)s).")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS,
+                        help="Seconds between scans of the directory (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    pipeline = default_pipeline(args.decode)
+    watcher = FolderWatcher(args.directory, args.recursive, args.stable, args.poll, args.existing)
+    print("Watching %s" % args.directory, file=sys.stderr)
+    if args.store:
+        from .store import FeatureStore
+        output = FeatureStore(args.store)
+    else:
+        new = not os.path.exists(args.output) or not os.path.getsize(args.output)
+        output = open(args.output, "a", newline="")
+        writer = csv.DictWriter(output, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+        if new:
+            writer.writeheader()
+    # when the oldest row not written to the store yet came in
+    buffered = None
+    try:
+        with watcher, output:
+            for row in ingest(watcher, pipeline, args.workers):
+                if args.store and buffered is not None and time.monotonic() - buffered >= args.flush_seconds:
+                    output.flush()
+                    buffered = None
+                if row is None:
+                    continue
+                if args.store:
+                    output.append(row)
+                    if buffered is None:
+                        buffered = time.monotonic()
+                else:
+                    writer.writerow(row)
+                    output.flush()
+                if row["status"] == "ok":
+                    print("%s: edge row %s, %.2fs after it was written"
+                          % (row["file"], row["edge_row"], row["latency"]), file=sys.stderr)
+                else:
+                    print("%s: %s" % (row["file"], row["error"]), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,20 +6,60 @@ overall application.
 """
 
 '''Imports'''
+import threading
+import time
+from collections import deque, namedtuple
+
+__all__ = ["ANY_STATE", "Event", "StateMachine"]
+
+# Transition table key matching every state
+ANY_STATE = "*"
+
+# Number of timing records kept by an event-driven state machine
+TIMINGS_KEPT = 1000
+
+Event = namedtuple("Event", "name data time")
 
 
 class StateMachine:
     """
     The base state machine for the application.
 
-    Detailed flow chart to be added later.
+    The state machine can be driven in two ways. run() loops
+    through the states, each of which blocks until it returns the
+    next one. start() instead enters the initial state and returns,
+    and post() then feeds it events: the handler the state
+    registered for an event runs, and the state changes if the
+    handler returns a new state or the transition table has an
+    entry for the state and event. Posted events are dispatched
+    through schedule, e.g. root.after_idle for the Tk mainloop or
+    loop.call_soon_threadsafe for an asyncio loop, or right away
+    without one, which is how states are tested without Tk.
     """
 
-    def __init__(self, initial_state):
+    def __init__(self, initial_state, transitions=None, schedule=None):
         """
         Initialize the state machine.
+
+        :param initial_state: The first state.
+        :param transitions: Dict mapping (state class name or ANY_STATE, event
+            name) to a state class, called without arguments for the next state,
+            or to None to stop the state machine.
+        :param schedule: Callable scheduling a callback on the event loop, or
+            None to dispatch events inside post().
         """
         self.state = initial_state
+        self.transitions = dict(transitions or {})
+        self.schedule = schedule
+        self.gui = None
+        self.running = False
+        self.hooks = {"enter": [], "exit": [], "event": []}
+        # one record per entered or exited state and per dispatched event
+        self.timings = deque(maxlen=TIMINGS_KEPT)
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._dispatching = False
 
     def run(self, gui):
         """
@@ -30,4 +70,139 @@ class StateMachine:
         """
 
         while self.state is not None:
-            self.state = self.state.run(gui)
\ No newline at end of file
+            self.state = self.state.run(gui)
+
+    def add_hook(self, phase, callback):
+        """
+        Call a function every time a state is entered or exited or an event is handled.
+
+        :param phase: "enter", "exit" or "event".
+        :param callback: Called with the timing record, a dict holding the
+            state name, the phase, the seconds it took and, for events, the
+            event name and the seconds it waited to be dispatched.
+        :return:
+        """
+        self.hooks[phase].append(callback)
+
+    def start(self, gui):
+        """
+        Enter the initial state in event-driven mode.
+
+        :param gui: Passed on to every state.
+        :return StateMachine: The same state machine.
+        """
+        self.gui = gui
+        self.running = self.state is not None
+        if self.running:
+            self._enter(self.state)
+        return self
+
+    def post(self, name, data=None):
+        """
+        Send an event to the current state.
+
+        Can be called from any thread when schedule is thread-safe,
+        and from inside handlers, in which case the event is handled
+        after the current one.
+
+        :param name: The event name.
+        :param data: Anything the handler needs, e.g. a list of files.
+        :return:
+        """
+        with self._lock:
+            self._events.append(Event(name, data, time.perf_counter()))
+            schedule = self.schedule is not None and not self._scheduled
+            self._scheduled = self._scheduled or schedule
+        if self.schedule is None:
+            self.dispatch()
+        elif schedule:
+            self.schedule(self.dispatch)
+
+    def dispatch(self):
+        """
+        Handle every posted event.
+
+        :return int: The number of events handled.
+        """
+        with self._lock:
+            self._scheduled = False
+            if self._dispatching:
+                return 0
+            self._dispatching = True
+        handled = 0
+        try:
+            while self.running:
+                with self._lock:
+                    if not self._events:
+                        break
+                    event = self._events.popleft()
+                self._handle(event)
+                handled += 1
+        finally:
+            with self._lock:
+                self._dispatching = False
+        return handled
+
+    def _handle(self, event):
+        """
+        Run the handler of the current state for an event and change state if needed.
+
+        :param event: The Event.
+        :return:
+        """
+        state = self.state
+        start = time.perf_counter()
+        next_state = state.handle(event, self.gui)
+        self._record(state, "event", start, event=event.name, latency=start - event.time)
+        if next_state is None:
+            name = type(state).__name__
+            for key in ((name, event.name), (ANY_STATE, event.name)):
+                if key in self.transitions:
+                    target = self.transitions[key]
+                    self._change(None if target is None else target())
+                    return
+        else:
+            self._change(next_state)
+
+    def _change(self, next_state):
+        """
+        Leave the current state for another one.
+
+        :param next_state: The new state, or None to stop.
+        :return:
+        """
+        start = time.perf_counter()
+        self.state._on_exit(self.gui)
+        self._record(self.state, "exit", start)
+        self.state = next_state
+        if next_state is None:
+            self.running = False
+            self._events.clear()
+        else:
+            self._enter(next_state)
+
+    def _enter(self, state):
+        """
+        Enter a state.
+
+        :param state: The new state.
+        :return:
+        """
+        start = time.perf_counter()
+        state._on_enter(self.gui)
+        self._record(state, "enter", start)
+
+    def _record(self, state, phase, start, **extra):
+        """
+        Store a timing record and pass it to the hooks.
+
+        :param state: The state it is about.
+        :param phase: "enter", "exit" or "event".
+        :param start: perf_counter() when the phase started.
+        :param extra: More entries for the record.
+        :return:
+        """
+        record = dict(state=type(state).__name__, phase=phase, seconds=time.perf_counter() - start, **extra)
+        self.timings.append(record)
+        for callback in self.hooks[phase]:
+            callback(record)
@@ -9,7 +9,16 @@ by all State objects in the project.
 class BaseState:
     """
     The base state class for all of the states.
+
+    In event-driven mode, handlers maps event names to the names
+    of the methods handling them, e.g. {"drop": "_drop"}. Handlers
+    are called with the gui and the Event and return the next state,
+    or None to stay or leave it to the transition table. _on_enter
+    and _on_exit still run when the state is entered and left, but
+    the state returned by _on_exit is ignored.
     """
+    handlers = {}
+
     def __init__(self):
         """
         Initialize the state.
@@ -25,6 +34,19 @@ class BaseState:
         self._state_main(gui)
         return self._on_exit(gui)
 
+    def handle(self, event, gui):
+        """
+        Handle an event in event-driven mode.
+
+        :param event: The Event posted to the state machine.
+        :param gui:
+        :return state: The next state, or None.
+        """
+        handler = self.handlers.get(event.name)
+        if handler is None:
+            return None
+        return getattr(self, handler)(gui, event)
+
     def _on_enter(self, gui):
         """
         Run at the beginning of the state.
@@ -0,0 +1,8 @@
+"""
+gui/__init__.py
+
+The initialization file for the GUI sub-module.
+"""
+
+from .views import *
+from .processing import *
@@ -0,0 +1,296 @@
+"""
+gui/processing.py
+
+This python file contains the background processing used by the
+GUI, so that the Tk thread never runs the pipeline itself.
+
+Dropped files are handed to a pool of worker processes. Each
+worker runs the pipeline and draws the result views at display
+size, so only small arrays travel back. Finished images are put
+on a thread-safe queue as JobEvents, which the Tk thread drains
+with poll() from a root.after() callback.
+
+Every image is first run through a preview pipeline, which works
+on the embedded thumbnail shrunk to PREVIEW_SIZE, so the edge row
+and contours show up within a fraction of a second. The full
+resolution result replaces the preview once it is ready. Previews
+wait in a queue of their own, served before the full resolution
+runs, so those of a new drop never wait behind an earlier batch.
+"""
+
+'''Imports'''
+import collections
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cv.features import FEATURE_INPUTS, frame_features
+from cv.stages import default_pipeline
+from .views import VIEW_INPUTS, render_views
+
+__all__ = ["JOB_STATUSES", "PREVIEW_SIZE", "JobEvent", "preview_pipeline", "process_for_display",
+           "BackgroundProcessor"]
+
+# queued: submitted, preview: the preview result is ready, done: finished with
+# the full result, failed: raised, cancelled: dropped
+JOB_STATUSES = ("queued", "preview", "done", "failed", "cancelled")
+
+# Longest side of the images the preview pipeline works on
+PREVIEW_SIZE = 1024
+
+JobEvent = namedtuple("JobEvent", "file_name status result error")
+
+
+def preview_pipeline(pipeline, preview_size=PREVIEW_SIZE):
+    """
+    Configure a pipeline to work on the embedded thumbnail at a small size.
+
+    :param pipeline: The full resolution Pipeline, with a decode stage.
+    :param preview_size: Longest side of the decoded thumbnail.
+    :return Pipeline:
+    """
+    return pipeline.configured({"decode.mode": "thumb", "decode.max_size": preview_size})
+
+
+def _warm_up():
+    """
+    Do nothing, so a worker process only imports this module and the pipeline.
+
+    :return:
+    """
+
+
+def process_for_display(file_name, pipeline=None, view_size=800):
+    """
+    Run the pipeline on one image and draw its result views.
+
+    :param file_name: Path to the image.
+    :param pipeline: The Pipeline to run, the default pipeline if None.
+    :param view_size: Longest side of the views in pixels.
+    :return dict: The "features" of the image and its "views" by name.
+    """
+    pipeline = pipeline or default_pipeline()
+    frame = pipeline.run(file_name, keep=FEATURE_INPUTS + VIEW_INPUTS)
+    return {"features": frame_features(frame), "views": render_views(frame, view_size)}
+
+
+class BackgroundProcessor:
+    """
+    Runs the pipeline on a pool of worker processes for the GUI.
+
+    Every method is meant to be called from the Tk thread. The
+    pool is started on the first submit() and reused afterwards,
+    so only the first batch pays for starting the workers. Images
+    wait in the processor and are handed to the pool a couple per
+    worker at a time, topped up by submit() and poll().
+
+    When a worker dies outright, e.g. on a crash inside a native
+    decoder, the pool breaks. The done callback only flags it; the
+    next poll() replaces the pool on the Tk thread and runs the
+    images that were in flight again one at a time, so only the one
+    that crashed fails.
+    """
+
+    def __init__(self, pipeline=None, workers=None, view_size=800, preview_size=PREVIEW_SIZE):
+        """
+        Initialize the processor.
+
+        :param pipeline: The Pipeline to run, the default pipeline if None.
+        :param workers: Number of worker processes, all cores but one by default.
+        :param view_size: Longest side of the result views in pixels.
+        :param preview_size: Longest side of the images previews work on, or
+            None for no previews.
+        """
+        self.pipeline = pipeline or default_pipeline()
+        self.preview = None if preview_size is None else preview_pipeline(self.pipeline, preview_size)
+        self.workers = workers or max(1, (os.cpu_count() or 1) - 1)
+        self.view_size = view_size
+        self.events = queue.Queue()
+        self._executor = None
+        # whether a worker of the current pool died, set from the done callbacks
+        self._broken = False
+        # (file name, preview) of the previews and full runs not handed to the pool yet
+        self._previews = collections.deque()
+        self._waiting = collections.deque()
+        # images in flight when the pool broke, to run again one at a time
+        self._retry = collections.deque()
+        # future -> (file name, preview, its pool, whether it ran alone)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """
+        The number of submitted images that have not finished yet.
+
+        :return int:
+        """
+        with self._lock:
+            jobs = (list(self._previews) + list(self._waiting) + list(self._retry)
+                    + [job[:2] for job in self._futures.values()])
+        return sum(not preview for _, preview in jobs)
+
+    def start(self):
+        """
+        Start the worker processes ahead of the first submit().
+
+        Every worker is handed an empty job, so the processes are
+        started and have imported the pipeline by the time the
+        first images arrive.
+
+        :return:
+        """
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        for _ in range(self.workers):
+            self._executor.submit(_warm_up)
+
+    def submit(self, files):
+        """
+        Queue images for processing.
+
+        The previews of every image are queued ahead of every full
+        resolution run, including those of earlier submits, so they
+        all show up first.
+
+        :param files: Paths to the images.
+        :return:
+        """
+        files = list(files)
+        for file_name in files:
+            self.events.put(JobEvent(file_name, "queued", None, None))
+        with self._lock:
+            if self.preview is not None:
+                self._previews.extend((file_name, True) for file_name in files)
+            self._waiting.extend((file_name, False) for file_name in files)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Replace a broken pool and hand waiting images to the pool, on the Tk thread.
+
+        Images to run again go one at a time, alone on the pool;
+        the rest go a couple per worker at a time, previews first.
+
+        :return:
+        """
+        with self._lock:
+            broken, self._broken = self._broken, False
+        if broken:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.start()
+        while True:
+            with self._lock:
+                if self._retry:
+                    if self._futures:
+                        return
+                    (file_name, preview), alone = self._retry.popleft(), True
+                elif (self._previews or self._waiting) and len(self._futures) < 2 * self.workers:
+                    (file_name, preview), alone = (self._previews or self._waiting).popleft(), False
+                else:
+                    return
+                try:
+                    future = self._executor.submit(process_for_display, file_name,
+                                                   self.preview if preview else self.pipeline, self.view_size)
+                except BrokenProcessPool:
+                    # the pool broke since the last poll, put the image back for the next pool
+                    waiting = self._previews if preview else self._waiting
+                    (self._retry if alone else waiting).appendleft((file_name, preview))
+                    self._broken = True
+                    return
+                self._futures[future] = (file_name, preview, self._executor, alone)
+            future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        """
+        Turn a finished future into an event, on whichever thread finished it.
+
+        :param future: The future of one image.
+        :return:
+        """
+        with self._lock:
+            job = self._futures.pop(future, None)
+            if job is None:
+                # cancelled already reported it
+                return
+            file_name, preview, executor, alone = job
+            error = None if future.cancelled() else future.exception()
+            if isinstance(error, BrokenProcessPool):
+                # the pool cannot take any more work, poll() starts a new one
+                if executor is self._executor:
+                    self._broken = True
+                if not alone:
+                    self._retry.append((file_name, preview))
+                    return
+        if future.cancelled():
+            if not preview:
+                self.events.put(JobEvent(file_name, "cancelled", None, None))
+            return
+        if preview:
+            # a failed preview is left to the full resolution run to report
+            if error is None:
+                self.events.put(JobEvent(file_name, "preview", future.result(), None))
+        elif error is None:
+            self.events.put(JobEvent(file_name, "done", future.result(), None))
+        else:
+            self.events.put(JobEvent(file_name, "failed", None, error))
+
+    def poll(self, limit=None):
+        """
+        Take the events that arrived since the last poll, without blocking.
+
+        Also replaces a broken pool and hands waiting images to the pool.
+
+        :param limit: Most events to return, all of them if None.
+        :return list: JobEvents in the order they arrived.
+        """
+        self._dispatch()
+        events = []
+        while limit is None or len(events) < limit:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def cancel(self):
+        """
+        Drop every image that has not finished.
+
+        Images a worker already started still run to the end, but
+        they are reported as cancelled straight away and their
+        results are thrown away.
+
+        :return int: The number of images dropped.
+        """
+        with self._lock:
+            futures = self._futures
+            jobs = list(self._retry) + list(self._previews) + list(self._waiting)
+            self._futures = {}
+            self._retry.clear()
+            self._previews.clear()
+            self._waiting.clear()
+        for future in futures:
+            future.cancel()
+        jobs += [job[:2] for job in futures.values()]
+        dropped = 0
+        for file_name, preview in jobs:
+            if not preview:
+                self.events.put(JobEvent(file_name, "cancelled", None, None))
+                dropped += 1
+        return dropped
+
+    def shutdown(self):
+        """
+        Cancel everything and stop the worker processes.
+
+        :return:
+        """
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
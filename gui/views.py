@@ -0,0 +1,110 @@
+"""
+gui/views.py
+
+This python file draws the results of the pipeline for display.
+
+Each view is cut out of a pipeline image and shrunk to display
+size before anything is drawn on it, so the lines, contours and
+corners are drawn on a small image instead of on full frame copies.
+The shrinking halves the image with cv2.pyrDown down to the last
+pyramid level above the display size and only resizes that level.
+"""
+
+'''Imports'''
+import numpy as np
+import cv2
+
+__all__ = ["VIEW_NAMES", "VIEW_INPUTS", "pyramid_level", "fit_view", "render_views"]
+
+VIEW_NAMES = ("edges", "lines", "contours", "vertices")
+
+# Frame keys read by render_views() besides the ones in FEATURE_INPUTS
+VIEW_INPUTS = ("scale", "gray", "enhanced", "edges", "contours", "horizontal_lines")
+
+# Bottom row of the edge view in full resolution pixels
+EDGE_VIEW_BOTTOM = 3000
+
+WHITE = (255, 255, 255)
+
+
+def pyramid_level(image, size):
+    """
+    Halve an image until another halving would take it below a size.
+
+    :param image: The image.
+    :param size: Smallest longest side wanted.
+    :return tuple: The pyramid level and the factor from image pixels to its pixels.
+    """
+    factor = 1.0
+    while max(image.shape[:2]) >= 2 * size:
+        image = cv2.pyrDown(image)
+        factor /= 2
+    return image, factor
+
+
+def fit_view(image, box, view_size):
+    """
+    Cut a box out of an image and shrink it to fit a square.
+
+    :param image: The decoded image.
+    :param box: CropBox in decoded pixels.
+    :param view_size: Longest side of the view in pixels.
+    :return tuple: The view, a new array, and the factor from decoded pixels to view pixels.
+    """
+    region = box.apply(image)
+    if region.size == 0:
+        return np.zeros((1, 1), image.dtype), 1.0
+    if max(region.shape[:2]) <= view_size:
+        return region.copy(), 1.0
+    level, factor = pyramid_level(region, view_size)
+    shrink = view_size / max(level.shape[:2])
+    return cv2.resize(level, None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA), factor * shrink
+
+
+def _to_view(points, box, factor):
+    """
+    Map decoded pixel positions into a view.
+
+    :param points: Array of x, y positions in decoded pixels, any leading shape.
+    :param box: The CropBox the view was cut from.
+    :param factor: The factor returned by fit_view().
+    :return numpy.ndarray: int32 positions in view pixels.
+    """
+    offset = np.array([box.left, box.top], np.float64)
+    return np.round((np.asarray(points, np.float64) - offset) * factor).astype(np.int32)
+
+
+def render_views(frame, view_size=800):
+    """
+    Draw the results of a processed frame, like the OpenCV windows of the first GUI.
+
+    edges: the edge image with the corners found near the tray edge.
+    lines: the grayscale image with the near horizontal Hough lines.
+    contours: the contrast enhanced image with the largest contours.
+    vertices: the contours view with the vertices of the approximated polygon.
+
+    :param frame: The Frame returned by Pipeline.run().
+    :param view_size: Longest side of each view in pixels.
+    :return dict: View name to a uint8 grayscale image.
+    """
+    scale = frame["scale"]
+    crop = frame["crop"].scaled(scale)
+
+    edge_box = crop._replace(bottom=int(EDGE_VIEW_BOTTOM * scale))
+    edges, factor = fit_view(frame["edges"], edge_box, view_size)
+    for x, y in _to_view(np.asarray(frame["corners"]).reshape(-1, 2) * scale, edge_box, factor):
+        cv2.circle(edges, (int(x), int(y)), max(2, int(10 * scale * factor)), WHITE)
+
+    lines, factor = fit_view(frame["gray"], crop, view_size)
+    horizontal = frame["horizontal_lines"]
+    if len(horizontal):
+        cv2.polylines(lines, list(_to_view(horizontal.reshape(-1, 2, 2), crop, factor)), False, WHITE, 1)
+
+    contours, factor = fit_view(frame["enhanced"], crop, view_size)
+    cv2.drawContours(contours, [_to_view(contour, crop, factor) for contour in frame["contours"]], -1, WHITE,
+                     max(1, int(round(3 * scale * factor))))
+
+    vertices = contours.copy()
+    for x, y in _to_view(frame["polygon"][:, 0] * scale, crop, factor):
+        cv2.circle(vertices, (int(x), int(y)), max(3, int(10 * scale * factor)), WHITE, thickness=-1)
+    return {"edges": edges, "lines": lines, "contours": contours, "vertices": vertices}
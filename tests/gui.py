@@ -2,24 +2,31 @@
 tests/gui.py
 
 This Python file contains the tests for the gui.
+
+Only tkinter and the state machine are imported up front, so the
+window shows up as soon as Tk can draw it. tkinterdnd2 is imported
+when the drag and drop window is built; OpenCV, NumPy and the
+pipeline are imported once the window is on screen, and PIL when
+the first result is shown. Run it with --startup-report to print
+how long the first window and the processing took to be ready,
+and python -m benchmarks.startup for the import times.
 """
 
 '''Imports'''
+import time
+STARTED = time.perf_counter()
+import argparse
+import multiprocessing
+import os
 import tkinter as tk
-import tkinterdnd2
-from tkinterdnd2 import DND_FILES
+from tkinter import ttk
 from tkinter.font import Font
 from fsm.states import BaseState
-from fsm import StateMachine
+from fsm import ANY_STATE, StateMachine
 import sys
-from PIL import ImageTk, Image, ImageEnhance
-from ast import literal_eval
-import numpy as np
-import matplotlib.pyplot as plot_functions
-import rawpy
-import cv2
-import itertools
-from sklearn.linear_model import LinearRegression
+
+# Time between checks for finished images
+POLL_MILLISECONDS = 50
 
 
 def first_window_attempt():
@@ -218,12 +225,16 @@ def first_window_attempt():
     state_machine = StateMachine(initial_state=InitialState())
     state_machine.run(gui)
 
-def drag_and_drop_attempt():
+def drag_and_drop_attempt(report_startup=False):
     """
         The first attempt at creating a gui.
 
+        :param report_startup: Print how long the window and the processing
+            took to be ready, then close.
         :return None:
         """
+    import tkinterdnd2
+    from tkinterdnd2 import DND_FILES
 
     class InitialState(BaseState):
         """
@@ -239,7 +250,6 @@ def drag_and_drop_attempt():
             print("In initial state.")
 
             '''Create drag and drop window'''
-            gui.entry_sv = tk.StringVar()
             gui.drop_box_list = []
             gui.drop_box_items = tk.Listbox(master=gui.root, listvariable=gui.drop_box_list)
             gui.drop_box_text = tk.StringVar()
@@ -250,28 +260,34 @@ def drag_and_drop_attempt():
             #gui.entry.pack()
             gui.entry.drop_target_register(DND_FILES)
             gui.entry.dnd_bind('<<Drop>>', self.drop(gui))
-            gui.update()
 
-        def _on_exit(self, gui):
-            """
-            Return the next state.
-
-            :param gui:
-            :return:
-            """
-            gui.update()
-            return WaitForDrop()
+            '''Create progress display'''
+            gui.progress = ttk.Progressbar(gui.root, mode="determinate")
+            gui.progress.place(x=1050, y=200, width=600, height=30)
+            gui.progress_text = tk.StringVar()
+            gui.progress_text.set("Idle")
+            tk.Label(gui.root, textvariable=gui.progress_text).place(x=1050, y=240, width=600)
+            gui.cancel_button = tk.Button(gui.root, text="Cancel", command=lambda: gui.machine.post("cancel"))
+            gui.cancel_button.place(x=1050, y=270, width=120)
+            gui.watch_button = tk.Button(gui.root, text="Watch folder...", command=gui.choose_watch_folder)
+            gui.watch_button.place(x=1180, y=270, width=160)
+            gui.status_list = tk.Listbox(gui.root)
+            gui.status_list.place(x=1050, y=310, width=600, height=170)
+            gui.status_list.bind("<<ListboxSelect>>", gui.select_file)
+
+            gui.poll_results()
+            gui.machine.post("ready")
 
         def drop(self, gui):
             def _drop(event):
-                files = root.tk.splitlist(event.data)
-                gui.entry_sv.set(files)
+                gui.machine.post("drop", root.tk.splitlist(event.data))
             return _drop
 
     class WaitForDrop(BaseState):
         """
-        State for having buttons on.
+        State for waiting on dropped images.
         """
+        handlers = {"drop": "_drop"}
 
         def _on_enter(self, gui):
             """
@@ -281,201 +297,58 @@ def drag_and_drop_attempt():
             """
             print("In wait for drop state.")
 
-        def _state_main(self, gui):
+        def _drop(self, gui, event):
             """
-            The main code for the ButtonsOn state.
+            Hand the dropped images to the background processor.
+
+            The results come back through gui.poll_results().
 
             :param gui:
+            :param event: The drop Event holding the file names.
             :return:
             """
-            gui.entry.wait_variable(gui.entry_sv)
-
-            '''Clean string'''
-            files = literal_eval(gui.entry_sv.get())
-
-            '''Remove previous images'''
-            if hasattr(gui, "panel"):
-                gui.panel.destroy()
-
-            '''Load each image'''
-            for file_name in files:
-                file_name = file_name.replace("{", "").replace("}", "")
-                # image = tk.PhotoImage(file=file_name)
-                if ".CR2" in file_name:
-                    '''Rawpy implementation'''
-                    file_image = rawpy.imread(file_name)
-                    file_image = file_image.postprocess()
-                    '''Rawkit implementation'''
-                    '''file_image = Raw(file_name)
-                    file_image = np.array(file_image.to_buffer())'''
-                    '''OpenCV implementation'''
-                    '''file_image = cv2.imread(file_name)'''
-                else:
-                    file_image = Image.open(file_name)
-                '''image = file_image.resize((500, 500), Image.ANTIALIAS)
-                image = ImageTk.PhotoImage(image)
-                gui.panel = tk.Label(gui.root, image=image)
-                gui.panel.image = image
-                gui.panel.pack()'''
-                # panel.grid(row=2)
-
-            image_data = np.array(file_image)
-            image_data = cv2.cvtColor(image_data, cv2.COLOR_RGB2GRAY)
-            '''print(image_data.shape)
-            print(image_data)
-            print(len(image_data))
-            print(len(image_data[0]))'''
-            returned_image = Image.fromarray(image_data)
-            '''cv2.imshow("Gray", image_data)
-            cv2.waitKey()
-            cv2.destroyWindow("Gray")'''
-
-            '''enhanced_contrast = ImageEnhance.Contrast(Image.fromarray(file_image))
-            enhanced_image = enhanced_contrast.enhance(255)
-            enhanced_data = np.array(enhanced_image)
-            plot_functions.imshow(enhanced_image)
-            plot_functions.show()'''
-
-            # color_space = cv2.cvtColor(image_data, cv2.COLOR_RGB2HSV)
-            # print(color_space)
-            
-            '''Create mask for white-ish pixels'''
-            '''lower_background = np.array([150, 150, 150])
-            upper_background = np.array([255, 255, 255])
-            print(image_data)
-            white_mask = cv2.inRange(image_data, lower_background, upper_background)
-            white_mask = cv2.morphologyEx(white_mask, cv2.MORPH_OPEN, np.ones((3,3),np.uint8))
-            white_mask = cv2.morphologyEx(white_mask, cv2.MORPH_DILATE, np.ones((3, 3), np.uint8))
-            white_mask = white_mask / 255'''
-
-            '''Create mask for black-ish pixels'''
-            '''lower_background = np.array([0, 0, 0])
-            upper_background = np.array([25, 25, 25])
-            black_mask = cv2.inRange(image_data, lower_background, upper_background)
-            black_mask = cv2.morphologyEx(black_mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
-            black_mask = cv2.morphologyEx(black_mask, cv2.MORPH_DILATE, np.ones((3, 3), np.uint8))
-            black_mask = black_mask / 255'''
-
-            '''Add masks together'''
-            '''background_mask = white_mask
-            # Ensure no value is above 1
-            background_mask = np.clip(background_mask, 0, 1)'''
-            
-            copied_image_data = np.asarray(returned_image).copy()
-            # background_mask = np.logical_not(background_mask)
-            '''for row_index, [mask_row, image_row] in enumerate(zip(background_mask, copied_image_data)):
-                # place black pixel on corresponding masked pixels
-                # copied_image_data[row_index] = np.array([image_row[pixel] * int(mask_row[pixel]) for pixel in range(len(mask_row))])
-                # make pixel fully white on corresponding masked pixels
-                copied_image_data[row_index] = np.array([np.array([255, 255, 255]) if int(mask_row[pixel]) else image_row[pixel] for pixel in range(len(mask_row))])'''
-
-            '''Turn removed pixels red'''
-            '''mask_image = Image.fromarray(copied_image_data)
-            plot_functions.imshow(mask_image)
-            plot_functions.show()'''
-            trapezoid_data = copied_image_data.copy()
-
-            enhanced_contrast = ImageEnhance.Contrast(Image.fromarray(trapezoid_data))
-            enhanced_image = enhanced_contrast.enhance(255)
-            trapezoid_data = np.array(enhanced_image)
-
-            '''Detect lines'''
-            edges = cv2.Canny(trapezoid_data, 75, 150)
-            lines = cv2.HoughLinesP(edges, 1, np.pi / 180, 100, maxLineGap=1000)
-            # print(lines)
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                if y1 == y2:
-                    cv2.line(copied_image_data, (x1, y1), (x2, y2), (255, 255, 255), 1)
-
-            '''Trapezoid attempt'''
-
-            # filters image bilaterally and displays it
-            bilatImg = cv2.bilateralFilter(trapezoid_data, 5, 175, 175)
-
-            # finds edges of bilaterally filtered image and displays it
-            edgeImg = cv2.Canny(bilatImg, 75, 200)
-
-            # gets contours (outlines) for shapes and sorts from largest area to smallest area
-            contours, hierarchy = cv2.findContours(edgeImg, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            contours = sorted(contours, key=cv2.contourArea, reverse=True)
-
-            # drawing red contours on the image
-            for con in contours:
-                cv2.drawContours(trapezoid_data, con, -1, (255, 255, 255), 3)
-
-            '''Detect corners'''
-            dst = cv2.cornerHarris(edges, 30, 31, 0.001)
-            dst = cv2.dilate(dst, None)
-            ret, dst = cv2.threshold(dst, 0.01 * dst.max(), 255, 0)
-            dst = np.uint8(dst)
-
-            # find centroids
-            ret, labels, stats, centroids = cv2.connectedComponentsWithStats(dst)
-            # define the criteria to stop and refine the corners
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100,
-                        0.001)
-            corners = cv2.cornerSubPix(edges, np.float32(centroids), (5, 5),
-                                       (-1, -1), criteria)
-
-            good_corners = []
-            for corner in corners:
-                if (corner[1] < 1000) & (corner[1] > 650) & (corner[0] > 250) & (corner[0] < 2250):
-                    good_corners.append(corner)
-                    cv2.circle(edges, (corner[0], corner[1]), 10, (255, 255, 255))
-
-            print(good_corners)
-            if len(good_corners) >= 3:
-                corner_combos = itertools.combinations(good_corners, 3)
-            elif len(good_corners) > 1:
-                corner_combos = itertools.combinations(good_corners, 2)
-
-            best_corner_combo = None
-            best_coef = np.inf
-            for corner_combo in corner_combos:
-                regression = LinearRegression().fit(np.array([corner[0] for corner in corner_combo]).reshape(-1, 1),
-                                                    np.array([corner[1] for corner in corner_combo]))
-                if np.abs(regression.coef_) < best_coef:
-                    best_coef = np.abs(regression.coef_)
-                    best_corner_combo = np.array([corner[1] for corner in corner_combo])
-
-            y_edge = int(round(np.mean(best_corner_combo)))
-            edges = edges[y_edge:3000, 200:2200]
-            copied_image_data = copied_image_data[y_edge:2500, 200:2200]
-            trapezoid_data = trapezoid_data[y_edge:2500, 200:2200]
-
-            # and double-checking the outcome
-            cv2.imshow("linesEdges", edges)
-            cv2.imshow("linesDetected", copied_image_data)
-            cv2.imshow("Contours check", trapezoid_data)
-            cv2.waitKey()
-            cv2.destroyWindow("Contours check")
-
-            # find the perimeter of the first closed contour
-            perim = cv2.arcLength(contours[0], True)
-            # setting the precision
-            epsilon = 0.02 * perim
-            # approximating the contour with a polygon
-            approxCorners = cv2.approxPolyDP(contours[0], epsilon, True)
-            # check how many vertices has the approximate polygon
-            approxCornersNumber = len(approxCorners)
-
-            for corners in approxCorners:
-                cv2.circle(trapezoid_data, (corners[0], corners[1]), radius=10, color=(255, 255, 255), thickness=-1)
-            cv2.imshow("Vertex position", trapezoid_data)
-            cv2.waitKey()
-            cv2.destroyWindow("Vertex position")
-            cv2.imshow("linesEdges", edges)
-            cv2.imshow("linesDetected", copied_image_data)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+            gui.submit(event.data)
 
-        def _on_exit(self, gui):
-            if gui.program_running:
-                gui.update()
-                return WaitForDrop()
-            else:
-                return None
+    class Processing(BaseState):
+        """
+        State for images being processed in the background.
+        """
+        handlers = {"drop": "_drop", "cancel": "_cancel"}
+
+        def _on_enter(self, gui):
+            """
+
+            :param gui:
+            :return:
+            """
+            print("In processing state.")
+
+        def _drop(self, gui, event):
+            """
+            Add more dropped images to the ones being processed.
+
+            :param gui:
+            :param event: The drop Event holding the file names.
+            :return:
+            """
+            gui.submit(event.data)
+
+        def _cancel(self, gui, event):
+            """
+            Drop every image that has not finished yet.
+
+            :param gui:
+            :param event: The cancel Event.
+            :return:
+            """
+            gui.processor.cancel()
+
+    TRANSITIONS = {
+        ("InitialState", "ready"): WaitForDrop,
+        ("WaitForDrop", "drop"): Processing,
+        ("Processing", "idle"): WaitForDrop,
+        (ANY_STATE, "close"): None,
+    }
 
     class DragAndDropGUI:
         """
@@ -491,16 +364,197 @@ def drag_and_drop_attempt():
             self.root.geometry("%dx%d+0+0" % (w, h))
             self.root.protocol("WM_DELETE_WINDOW", self.end_program)
             self.program_running = True
+            self.report_startup = False
+            self.shown = False
+            self.pipeline = None
+            self.processor = None
+            self.watcher = None
+            self.view_panels = {}
+            self.status_rows = {}
+            self.previews = {}
+            self.results = {}
+            self.submitted = 0
+            self.finished = 0
+
+        def first_window(self, event=None):
+            """
+            Start loading the pipeline once the window is on screen.
+
+            :param event: The <Map> event of the window.
+            :return:
+            """
+            if self.shown or event is not None and event.widget is not self.root:
+                return
+            self.shown = True
+            if self.report_startup:
+                print("First window after %.2f s" % (time.perf_counter() - STARTED), file=sys.stderr)
+            self.root.after_idle(self.warm_up)
 
-        def update(self):
+        def warm_up(self):
             """
-            Update the GUI.
+            Import the pipeline and the result views and start the
+            worker processes, so the first drop does not wait for them.
 
             :return:
             """
-            self.root.update_idletasks()
-            self.root.update()
-            return self.root
+            if self.processor is not None:
+                return
+            from cv import default_pipeline
+            from gui import VIEW_NAMES, BackgroundProcessor
+
+            '''Create result views'''
+            for index, view_name in enumerate(VIEW_NAMES):
+                panel = tk.Label(self.root)
+                panel.place(x=1050 + 260 * (index % 2), y=490 + 260 * (index // 2), width=250, height=250)
+                self.view_panels[view_name] = panel
+
+            self.pipeline = default_pipeline()
+            self.processor = BackgroundProcessor(self.pipeline, view_size=250)
+            self.processor.start()
+            if self.report_startup:
+                print("Ready to process after %.2f s" % (time.perf_counter() - STARTED), file=sys.stderr)
+                self.end_program()
+
+        def submit(self, files):
+            """
+            Send images to the background processor.
+
+            :param files: Paths to the images.
+            :return:
+            """
+            self.warm_up()
+            if not self.processor.pending:
+                self.submitted = self.finished = 0
+            self.submitted += len(files)
+            self.processor.submit(files)
+            self._update_progress()
+
+        def choose_watch_folder(self):
+            """
+            Ask for a folder and process every image written to it from now on,
+            e.g. by a tethered camera, as if it was dropped.
+
+            :return:
+            """
+            from tkinter import filedialog
+            from etl.watch import FolderWatcher
+            directory = filedialog.askdirectory(parent=self.root, title="Folder the camera writes to")
+            if not directory:
+                return
+            if self.watcher is not None:
+                self.watcher.close()
+            self.watcher = FolderWatcher(directory)
+            self.watch_button.configure(text="Watching %s" % os.path.basename(directory))
+
+        def poll_results(self):
+            """
+            Show the events from the background processor, then poll again.
+
+            Runs on the Tk thread from root.after(), so the window
+            stays responsive while the images are processed.
+
+            :return:
+            """
+            if self.watcher is not None:
+                written = self.watcher.poll()
+                if written:
+                    self.machine.post("drop", written)
+            events = [] if self.processor is None else self.processor.poll(limit=50)
+            for event in events:
+                if event.status == "preview" and event.file_name in self.results:
+                    # the full resolution result beat the preview
+                    continue
+                if event.status in ("preview", "done"):
+                    photos = self._store_result(event.file_name, event.result, event.status == "preview")
+                    self._show_result(photos)
+                    text = "%s: edge row %d%s" % (event.file_name, event.result["features"]["edge_row"],
+                                                  " (preview)" if event.status == "preview" else "")
+                elif event.status == "failed":
+                    text = "%s: failed (%s)" % (event.file_name, event.error)
+                else:
+                    text = "%s: %s" % (event.file_name, event.status)
+                if event.status not in ("queued", "preview"):
+                    self.finished += 1
+                self._set_status(event.file_name, text)
+            self._update_progress()
+            if events and not self.processor.pending:
+                self.machine.post("idle")
+            if self.program_running:
+                self.root.after(POLL_MILLISECONDS, self.poll_results)
+
+        def select_file(self, event):
+            """
+            Show the results of the image selected in the status list.
+
+            :param event: The <<ListboxSelect>> event.
+            :return:
+            """
+            selection = self.status_list.curselection()
+            if not selection:
+                return
+            for file_name, row in self.status_rows.items():
+                if row == selection[0]:
+                    photos = self.results.get(file_name, self.previews.get(file_name))
+                    if photos is not None:
+                        self._show_result(photos)
+
+        def _set_status(self, file_name, text):
+            """
+            Write the status line of an image.
+
+            :param file_name: Path to the image.
+            :param text: The new status line.
+            :return:
+            """
+            row = self.status_rows.get(file_name)
+            if row is None:
+                row = self.status_rows[file_name] = self.status_list.size()
+            else:
+                self.status_list.delete(row)
+            self.status_list.insert(row, text)
+
+        def _update_progress(self):
+            """
+            Update the progress bar and its label.
+
+            :return:
+            """
+            self.progress["maximum"] = max(1, self.submitted)
+            self.progress["value"] = self.finished
+            if self.processor is not None and self.processor.pending:
+                self.progress_text.set("Processed %d of %d images" % (self.finished, self.submitted))
+            else:
+                self.progress_text.set("Idle")
+
+        def _store_result(self, file_name, result, preview=False):
+            """
+            Turn the result views of an image into Tk images once, so
+            showing them again never converts or resizes anything.
+
+            :param file_name: Path to the image.
+            :param result: The result of gui.processing.process_for_display().
+            :param preview: Whether it is the preview result.
+            :return dict: View name to ImageTk.PhotoImage.
+            """
+            from PIL import ImageTk, Image
+            photos = {view_name: ImageTk.PhotoImage(Image.fromarray(view))
+                      for view_name, view in result["views"].items()}
+            if preview:
+                self.previews[file_name] = photos
+            else:
+                self.previews.pop(file_name, None)
+                self.results[file_name] = photos
+            return photos
+
+        def _show_result(self, photos):
+            """
+            Show the result views of an image in the window.
+
+            :param photos: View name to ImageTk.PhotoImage.
+            :return:
+            """
+            for view_name, image in photos.items():
+                self.view_panels[view_name].configure(image=image)
 
         def end_program(self):
             """
@@ -508,22 +562,33 @@ def drag_and_drop_attempt():
 
             :return:
             """
-            if self.entry_sv.get() != " ":
-                self.entry_sv.set(" ")
-            else:
-                self.entry_sv.set("!")
-            self.root.destroy()
             self.program_running = False
+            if self.processor is not None:
+                self.processor.shutdown()
+            if self.watcher is not None:
+                self.watcher.close()
+            self.machine.post("close")
+            # runs after the close event is dispatched
+            self.root.after_idle(self.root.destroy)
 
     '''Initialize and run GUI object'''
     root = tkinterdnd2.Tk()
     # Maximize window while maintaining title bar
     gui = DragAndDropGUI(root)
-    state_machine = StateMachine(initial_state=InitialState())
-    state_machine.run(gui)
-
-
-drag_and_drop_attempt()
+    gui.report_startup = report_startup
+    gui.machine = StateMachine(initial_state=InitialState(), transitions=TRANSITIONS, schedule=root.after_idle)
+    gui.machine.start(gui)
+    root.bind("<Map>", gui.first_window)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    # the worker processes of a frozen build start this script again
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Drag and drop switchgrass photos to find the tray edge.")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print how long the window and the processing took to be ready, then close.")
+    drag_and_drop_attempt(parser.parse_args().startup_report)
 
 '''root = tkinterdnd2.Tk()
 
@@ -0,0 +1,60 @@
+"""
+tests/test_batch.py
+
+This python file tests that the batch runner survives a worker
+process dying outright on one image.
+"""
+
+'''Imports'''
+import os
+import cv2
+from benchmarks.synthetic import draw_tray, frame_size
+from cv.pipeline import Pipeline
+from cv.stages import RawDecode, default_stages
+from etl.batch import run_batch
+
+
+class CrashingDecode(RawDecode):
+    """
+    Decode that kills its process on files named crash, like a segfault in a native decoder would.
+    """
+
+    def process(self, file_name):
+        if os.path.basename(file_name).startswith("crash"):
+            os._exit(1)
+        return super().process(file_name)
+
+
+def crashing_pipeline():
+    """
+    Build the default pipeline with the crashing decode stage.
+
+    :return Pipeline:
+    """
+    return Pipeline([CrashingDecode()] + default_stages()[1:])
+
+
+def write_photos(directory, names):
+    """
+    Write a synthetic tray photo under every name.
+
+    :param directory: The directory to write to.
+    :param names: File names of the photos.
+    :return list: Paths of the photos.
+    """
+    paths = []
+    for seed, name in enumerate(names):
+        image, _ = draw_tray(*frame_size(2), seed=seed)
+        paths.append(os.path.join(str(directory), name))
+        cv2.imwrite(paths[-1], cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return paths
+
+
+def test_worker_crash_fails_only_its_image(tmp_path):
+    names = ["a.jpg", "b.jpg", "crash.jpg", "c.jpg", "d.jpg"]
+    files = write_photos(tmp_path, names)
+    rows = {os.path.basename(row["file"]): row for row in run_batch(files, workers=2, pipeline=crashing_pipeline())}
+    assert sorted(rows) == sorted(names)
+    assert rows["crash.jpg"]["status"] == "failed"
+    assert "BrokenProcessPool" in rows["crash.jpg"]["error"]
+    assert all(rows[name]["status"] == "ok" for name in names if name != "crash.jpg")
@@ -0,0 +1,85 @@
+"""
+tests/test_cache.py
+
+This python file tests the hits, keys and least recently used
+eviction of the on-disk array cache.
+"""
+
+'''Imports'''
+import os
+import numpy as np
+import pytest
+from cv.cache import ArrayCache
+
+
+def write_source(path, content):
+    """
+    Write a source file for the cache to key on.
+
+    :param path: Path to the file.
+    :param content: Its bytes.
+    :return str: The path.
+    """
+    with open(str(path), "wb") as source:
+        source.write(content)
+    return str(path)
+
+
+def test_hit_is_a_read_only_map(tmp_path):
+    cache = ArrayCache(str(tmp_path / "cache"))
+    key = cache.key(write_source(tmp_path / "a.cr2", b"raw"), half_size=False)
+    array = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    assert cache.get(key, "rgb") is None
+    cache.put(key, "rgb", array)
+    hit = cache.get(key, "rgb")
+    assert isinstance(hit, np.memmap) and not hit.flags.writeable
+    assert np.array_equal(hit, array)
+    # each array of a source is a separate entry
+    assert cache.get(key, "gray") is None
+
+
+def test_key_follows_content_and_options(tmp_path):
+    cache = ArrayCache(str(tmp_path / "cache"))
+    source = write_source(tmp_path / "a.cr2", b"raw")
+    key = cache.key(source, half_size=False)
+    assert cache.key(source, half_size=False) == key
+    assert cache.key(source, half_size=True) != key
+    # a copy elsewhere hits, changed bytes miss
+    assert cache.key(write_source(tmp_path / "copy.cr2", b"raw"), half_size=False) == key
+    assert cache.key(write_source(tmp_path / "a.cr2", b"new"), half_size=False) != key
+
+
+def test_truncated_entry_is_a_miss(tmp_path):
+    cache = ArrayCache(str(tmp_path / "cache"))
+    cache.put("key", "rgb", np.zeros((64, 64), np.uint8))
+    path = os.path.join(cache.directory, "key-rgb.npy")
+    with open(path, "r+b") as entry:
+        entry.truncate(100)
+    assert cache.get("key", "rgb") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry_bytes = 128 + 1024
+    cache = ArrayCache(str(tmp_path / "cache"), max_bytes=3 * entry_bytes)
+    for index, name in enumerate("abc"):
+        cache.put(name, "rgb", np.zeros(1024, np.uint8))
+        os.utime(os.path.join(cache.directory, "%s-rgb.npy" % name), (index, index))
+    # a hit makes a the most recently used, so b is the oldest
+    assert cache.get("a", "rgb") is not None
+    cache.put("d", "rgb", np.zeros(1024, np.uint8))
+    assert [cache.get(name, "rgb") is not None for name in "abcd"] == [True, False, True, True]
+    assert cache.evict() <= cache.max_bytes
+
+
+@pytest.mark.parametrize("max_bytes", [0, 100])
+def test_too_small_cache_keeps_nothing(tmp_path, max_bytes):
+    cache = ArrayCache(str(tmp_path / "cache"), max_bytes=max_bytes)
+    cache.put("key", "rgb", np.zeros(1024, np.uint8))
+    assert cache.get("key", "rgb") is None
+
+
+def test_clear(tmp_path):
+    cache = ArrayCache(str(tmp_path / "cache"))
+    cache.put("key", "rgb", np.zeros(16, np.uint8))
+    cache.clear()
+    assert cache.get("key", "rgb") is None and not os.listdir(cache.directory)
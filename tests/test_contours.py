@@ -0,0 +1,66 @@
+"""
+tests/test_contours.py
+
+This python file tests that picking the largest contours keeps
+the same contours as sorting every RETR_TREE contour by area.
+"""
+
+'''Imports'''
+import cv2
+import numpy as np
+import pytest
+from cv.stages import ContourApproximation, largest_contours
+
+
+def noisy_edges(seed, shape=(400, 600)):
+    """
+    Draw an edge image of many small blobs around one large rectangle.
+
+    :param seed: Seed of the noise.
+    :param shape: Rows and columns.
+    :return numpy.ndarray: uint8 edge image, 0 or 255.
+    """
+    generator = np.random.default_rng(seed)
+    edges = ((generator.random(shape) > 0.8) * 255).astype(np.uint8)
+    cv2.rectangle(edges, (50, 40), (550, 360), 255, 2)
+    return edges
+
+
+def sorted_tree_contours(edges, top_k):
+    """
+    The contours the pipeline used to keep: all RETR_TREE contours sorted by area.
+
+    :param edges: The edge image.
+    :param top_k: Number of contours to keep.
+    :return tuple: The kept contours and the number found.
+    """
+    contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return sorted(contours, key=cv2.contourArea, reverse=True)[:top_k], len(contours)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("top_k", [1, 10, 50])
+def test_largest_contours_match_sorted_tree(seed, top_k):
+    edges = noisy_edges(seed)
+    expected, _ = sorted_tree_contours(edges, top_k)
+    contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    kept = largest_contours(contours, top_k)
+    assert len(kept) == len(expected)
+    assert all(np.array_equal(contour, other) for contour, other in zip(kept, expected))
+
+
+def test_ties_keep_their_order():
+    squares = [np.array([[[x, 0]], [[x + 2, 0]], [[x + 2, 2]], [[x, 2]]], np.int32) for x in range(0, 40, 4)]
+    kept = largest_contours(squares, 3)
+    assert [contour[0, 0, 0] for contour in kept] == [0, 4, 8]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_list_retrieval_matches_tree(seed):
+    edges = noisy_edges(seed)
+    expected, count = sorted_tree_contours(edges, 10)
+    contours, found, area, perimeter, _, _ = ContourApproximation().process(edges, 1)
+    assert found == count
+    assert [cv2.contourArea(contour) for contour in contours] == [cv2.contourArea(contour) for contour in expected]
+    assert area == cv2.contourArea(expected[0])
+    assert perimeter == cv2.arcLength(expected[0], True)
@@ -0,0 +1,42 @@
+"""
+tests/test_contrast.py
+
+This python file tests that the contrast lookup table gives
+exactly the result of PIL's ImageEnhance.Contrast.
+"""
+
+'''Imports'''
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+from cv.stages import ContrastEnhance, contrast_lut
+
+
+def gray_image(seed, low=0, high=256, shape=(120, 160)):
+    """
+    Draw a random grayscale image.
+
+    :param seed: Seed of the pixels.
+    :param low: Lowest gray level.
+    :param high: One past the highest gray level.
+    :param shape: Rows and columns.
+    :return numpy.ndarray: uint8 image.
+    """
+    return np.random.default_rng(seed).integers(low, high, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("seed, low, high", [(0, 0, 256), (1, 100, 140), (2, 0, 30), (3, 220, 256)])
+@pytest.mark.parametrize("factor", [255, 2.5, 1, 0.5])
+def test_contrast_matches_pil(seed, low, high, factor):
+    gray = gray_image(seed, low, high)
+    expected = np.array(ImageEnhance.Contrast(Image.fromarray(gray)).enhance(factor))
+    assert np.array_equal(ContrastEnhance(factor=factor).process(gray), expected)
+
+
+@pytest.mark.parametrize("mean", [0, 1, 127, 128, 254, 255])
+def test_lut_matches_pil_at_every_level(mean):
+    # every gray level once, plus enough pixels at the mean to pin PIL's rounded mean to it
+    gray = np.concatenate([np.arange(256, dtype=np.uint8), np.full(256 * 255, mean, np.uint8)])
+    gray = gray.reshape(256, 256)
+    expected = np.array(ImageEnhance.Contrast(Image.fromarray(gray)).enhance(255))
+    assert np.array_equal(contrast_lut(mean, 255)[gray], expected)
@@ -0,0 +1,28 @@
+"""
+tests/test_decode_modes.py
+
+This python file tests that the reduced decode modes find the same
+tray edge as a full decode.
+"""
+
+'''Imports'''
+import pytest
+from benchmarks.suite import TOLERANCES
+from benchmarks.synthetic import generate
+from cv.stages import default_pipeline
+
+
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    # seeds 1 and 2 used to pick up corners along the slanted tray sides at half size
+    return generate(str(tmp_path_factory.mktemp("photos")), ("20mp",), count=2, seed=1)["20mp"]
+
+
+@pytest.mark.parametrize("mode", ["half", "thumb"])
+def test_reduced_decode_matches_full(photos, mode):
+    full = default_pipeline("full")
+    reduced = default_pipeline(mode)
+    for truth in photos:
+        edge_row = reduced.run(truth.file_name)["edge_row"]
+        assert abs(edge_row - full.run(truth.file_name)["edge_row"]) <= TOLERANCES["edge_row"]
+        assert abs(edge_row - truth.edge_row) <= TOLERANCES["edge_row"]
@@ -0,0 +1,88 @@
+"""
+tests/test_distributed.py
+
+This python file tests that the shard of a worker that stops
+renewing its lease is taken over by another worker and merged,
+and that a lease outlives an image slower than the lease.
+"""
+
+'''Imports'''
+import csv
+import os
+import sqlite3
+import threading
+import time
+from cv.pipeline import Pipeline
+from cv.stages import RawDecode, default_stages
+from etl.distributed import WorkQueue, run_worker
+from tests.test_batch import write_photos
+
+
+class SlowDecode(RawDecode):
+    """
+    Decode that takes a second on files named slow.
+    """
+
+    def process(self, file_name):
+        if os.path.basename(file_name).startswith("slow"):
+            time.sleep(1)
+        return super().process(file_name)
+
+
+def attempts(path):
+    """
+    Read how often each shard was leased.
+
+    :param path: Path to the SQLite file of the queue.
+    :return list:
+    """
+    connection = sqlite3.connect(path)
+    try:
+        return [count for (count,) in connection.execute("SELECT attempts FROM shards ORDER BY shard")]
+    finally:
+        connection.close()
+
+
+def test_abandoned_lease_is_taken_over_and_merged(tmp_path):
+    names = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    files = write_photos(tmp_path, names)
+    path = str(tmp_path / "queue.sqlite")
+    with WorkQueue(path, lease_seconds=0.5) as queue:
+        assert queue.add(files, shard_size=2) == 2
+        # the first worker dies holding its shard
+        shard, _ = queue.lease("dead")
+        assert run_worker(queue, workers=1, worker="alive", poll_seconds=0.1) == 2
+        assert queue.progress() == {"pending": 0, "leased": 0, "done": 2, "failed": 0}
+        # the late rows of the dead worker are dropped
+        assert not queue.complete(shard, "dead", [])
+        assert queue.merge(str(tmp_path / "features.csv")) == len(names)
+    assert attempts(path) == [2, 1]
+    with open(str(tmp_path / "features.csv"), newline="") as merged:
+        rows = list(csv.DictReader(merged))
+    assert [os.path.basename(row["file"]) for row in rows] == names
+    assert all(row["status"] == "ok" for row in rows)
+
+
+def test_lease_outlives_a_slow_image(tmp_path):
+    files = write_photos(tmp_path, ["a.jpg", "slow.jpg"])
+    path = str(tmp_path / "queue.sqlite")
+    completed = []
+
+    def work():
+        with WorkQueue(path, lease_seconds=0.3) as queue:
+            pipeline = Pipeline([SlowDecode()] + default_stages()[1:])
+            completed.append(run_worker(queue, workers=1, pipeline=pipeline, worker="slow", poll_seconds=0.1))
+
+    with WorkQueue(path, lease_seconds=0.3) as queue:
+        queue.add(files, shard_size=2)
+        worker = threading.Thread(target=work)
+        worker.start()
+        while not queue.progress()["leased"]:
+            time.sleep(0.01)
+        # another worker looking for free shards all along never finds the slow one's
+        while worker.is_alive():
+            assert queue.lease("other") is None
+            time.sleep(0.05)
+        worker.join()
+    assert completed == [1]
+    assert attempts(path) == [1]
@@ -0,0 +1,98 @@
+"""
+tests/test_edge_row.py
+
+This python file tests the tray edge row estimator against the
+regression loop it replaced.
+"""
+
+'''Imports'''
+import itertools
+import numpy as np
+import pytest
+from cv.edge_row import _flattest_triple, estimate_edge_row
+
+
+def regression_slopes(corners):
+    """
+    The original estimator: one LinearRegression per combination of corners.
+
+    :param corners: float array of shape (N, 2) holding x, y.
+    :return tuple: Every combination in itertools.combinations order, the absolute
+        slope of each, and the rounded mean row of the first flattest one.
+    """
+    from sklearn.linear_model import LinearRegression
+    combos = list(itertools.combinations(range(len(corners)), 3 if len(corners) >= 3 else 2))
+    slopes = []
+    best_corner_combo = None
+    best_coef = np.inf
+    for combo in combos:
+        corner_combo = corners[list(combo)]
+        regression = LinearRegression().fit(np.array([corner[0] for corner in corner_combo]).reshape(-1, 1),
+                                            np.array([corner[1] for corner in corner_combo]))
+        slopes.append(float(np.abs(regression.coef_[0])))
+        if np.abs(regression.coef_) < best_coef:
+            best_coef = np.abs(regression.coef_)
+            best_corner_combo = np.array([corner[1] for corner in corner_combo])
+    return combos, slopes, int(round(np.mean(best_corner_combo)))
+
+
+def random_corners(seed, rows=None, cols=None):
+    """
+    Draw corners in the tray edge band, with their rows or columns on a few values when given.
+
+    :param seed: Seed of the draw.
+    :param rows: Number of distinct rows, or None for sub-pixel rows.
+    :param cols: Number of distinct columns, or None for sub-pixel columns.
+    :return array: float32 array of shape (N, 2) holding x, y.
+    """
+    generator = np.random.default_rng(seed)
+    count = generator.integers(2, 16)
+    x = generator.uniform(250, 2250, count)
+    y = generator.uniform(650, 1000, count)
+    if cols is not None:
+        x = generator.choice(np.round(np.linspace(250, 2250, cols)), count)
+    if rows is not None:
+        y = generator.choice(np.round(np.linspace(650, 1000, rows)), count)
+    return np.stack([x, y], axis=1).astype(np.float32)
+
+
+@pytest.mark.parametrize("rows, cols", [(None, None), (3, None), (6, None), (None, 4)])
+def test_matches_regression_loop(rows, cols):
+    pytest.importorskip("sklearn")
+    for seed in range(50):
+        corners = random_corners(seed, rows, cols)
+        assert estimate_edge_row(corners) == regression_slopes(corners)[2], corners.tolist()
+
+
+def test_grid_ties_pick_a_flattest_triple():
+    # on a grid, triples like (0, 0), (1, 1), (2, 0) have a slope of exactly 0 that the float32
+    # regression gets as rounding noise, so only check the triple is flattest up to that noise
+    pytest.importorskip("sklearn")
+    for seed in range(50):
+        corners = random_corners(seed, 4, 5)
+        if len(corners) < 3:
+            continue
+        combos, slopes, _ = regression_slopes(corners)
+        triple = _flattest_triple(corners[:, 0].astype(np.float64), corners[:, 1].astype(np.float64))
+        assert slopes[combos.index(triple)] <= min(slopes) + 1e-6
+
+
+def test_first_flat_triple_wins():
+    # two exactly flat triples, (0, 2, 4) and (1, 3, 5), and some nearly flat ones
+    x = np.array([1013.25, 250.5, 1750.75, 2001.0, 600.0, 1200.0, 1500.0])
+    y = np.array([812.0, 950.0, 812.0, 950.0, 812.0, 950.0, 812.001])
+    assert _flattest_triple(x, y) == (0, 2, 4)
+
+
+@pytest.mark.parametrize("block_size", [64, 4096, 1 << 20])
+def test_block_size_does_not_matter(monkeypatch, block_size):
+    generator = np.random.default_rng(0)
+    corners = np.stack([generator.uniform(250, 2250, 60), generator.integers(650, 1000, 60)], axis=1)
+    combos = list(itertools.combinations(range(len(corners)), 3))
+    x, y = corners[combos, 0], corners[combos, 1]
+    # the slope of every triple straight from the least squares formula
+    slopes = np.abs((3 * (x * y).sum(axis=1) - x.sum(axis=1) * y.sum(axis=1))
+                    / (3 * (x * x).sum(axis=1) - x.sum(axis=1) ** 2))
+    monkeypatch.setattr("cv.edge_row._BLOCK_SIZE", block_size)
+    triple = _flattest_triple(corners[:, 0], corners[:, 1])
+    assert slopes[combos.index(triple)] <= slopes.min() + 1e-9
@@ -0,0 +1,152 @@
+"""
+tests/test_machine.py
+
+This python file tests the event-driven mode of the state
+machine without Tk, on states and a transition table shaped
+like the ones of the drag and drop GUI.
+"""
+
+'''Imports'''
+from fsm import ANY_STATE, StateMachine
+from fsm.states import BaseState
+
+
+class FakeGUI:
+    """
+    Records what the states did to it.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+
+class Recording(BaseState):
+    """
+    A state that records entering and leaving it.
+    """
+
+    def _on_enter(self, gui):
+        gui.calls.append(("enter", type(self).__name__))
+
+    def _on_exit(self, gui):
+        gui.calls.append(("exit", type(self).__name__))
+
+
+class InitialState(Recording):
+    """
+    First state, left through the transition table on ready.
+    """
+
+
+class WaitForDrop(Recording):
+    """
+    Waits for dropped files; the transition table moves on to Processing.
+    """
+    handlers = {"drop": "_drop"}
+
+    def _drop(self, gui, event):
+        gui.calls.append(("drop", event.data))
+
+
+class Processing(Recording):
+    """
+    Takes more drops, finishes when told, and can cancel itself straight back to waiting.
+    """
+    handlers = {"drop": "_drop", "cancel": "_cancel", "finish": "_finish"}
+
+    def _drop(self, gui, event):
+        gui.calls.append(("drop", event.data))
+
+    def _cancel(self, gui, event):
+        gui.calls.append(("cancel", None))
+        return WaitForDrop()
+
+    def _finish(self, gui, event):
+        # posted from inside a handler, so handled after this event
+        gui.machine.post("idle")
+
+
+TRANSITIONS = {
+    ("InitialState", "ready"): WaitForDrop,
+    ("WaitForDrop", "drop"): Processing,
+    ("Processing", "idle"): WaitForDrop,
+    (ANY_STATE, "close"): None,
+}
+
+
+def start_machine(schedule=None):
+    """
+    Start a state machine on a FakeGUI.
+
+    :param schedule: See StateMachine.
+    :return tuple: The StateMachine and the FakeGUI.
+    """
+    gui = FakeGUI()
+    gui.machine = StateMachine(InitialState(), TRANSITIONS, schedule)
+    return gui.machine.start(gui), gui
+
+
+def test_transitions_and_handlers():
+    machine, gui = start_machine()
+    machine.post("ready")
+    assert isinstance(machine.state, WaitForDrop)
+    machine.post("drop", ["a.jpg"])
+    assert isinstance(machine.state, Processing)
+    machine.post("drop", ["b.jpg"])
+    machine.post("finish")
+    assert isinstance(machine.state, WaitForDrop)
+    assert gui.calls == [("enter", "InitialState"), ("exit", "InitialState"), ("enter", "WaitForDrop"),
+                         ("drop", ["a.jpg"]), ("exit", "WaitForDrop"), ("enter", "Processing"),
+                         ("drop", ["b.jpg"]), ("exit", "Processing"), ("enter", "WaitForDrop")]
+
+
+def test_handler_state_wins_and_unknown_events_stay():
+    machine, gui = start_machine()
+    machine.post("ready")
+    machine.post("drop", ["a.jpg"])
+    machine.post("cancel")
+    assert isinstance(machine.state, WaitForDrop)
+    # neither a handler nor a transition: nothing happens
+    machine.post("cancel")
+    assert isinstance(machine.state, WaitForDrop)
+    assert gui.calls.count(("cancel", None)) == 1
+
+
+def test_close_from_any_state_stops():
+    for events in ([], ["ready"], ["ready", "drop"]):
+        machine, gui = start_machine()
+        for name in events:
+            machine.post(name)
+        state = type(machine.state).__name__
+        machine.post("close")
+        assert machine.state is None and not machine.running
+        assert gui.calls[-1] == ("exit", state)
+        # events after stopping are not handled
+        machine.post("ready")
+        assert machine.state is None and gui.calls[-1] == ("exit", state)
+
+
+def test_hooks_and_timings():
+    machine, _ = start_machine()
+    records = []
+    for phase in ("enter", "exit", "event"):
+        machine.add_hook(phase, records.append)
+    machine.post("ready")
+    assert [(record["state"], record["phase"]) for record in records] == [
+        ("InitialState", "event"), ("InitialState", "exit"), ("WaitForDrop", "enter")]
+    assert records[0]["event"] == "ready" and records[0]["latency"] >= 0
+    assert all(record["seconds"] >= 0 for record in records)
+    # the timings also hold the initial enter, from before the hooks were added
+    assert list(machine.timings) == [{"state": "InitialState", "phase": "enter",
+                                      "seconds": machine.timings[0]["seconds"]}] + records
+
+
+def test_schedule_defers_dispatch():
+    scheduled = []
+    machine, _ = start_machine(scheduled.append)
+    machine.post("ready")
+    machine.post("drop", ["a.jpg"])
+    # one callback for both events, nothing handled until it runs
+    assert len(scheduled) == 1 and isinstance(machine.state, InitialState)
+    assert scheduled.pop()() == 2
+    assert isinstance(machine.state, Processing)
@@ -0,0 +1,121 @@
+"""
+tests/test_manifest.py
+
+This python file tests which images the run manifest sends to be
+processed again.
+"""
+
+'''Imports'''
+import os
+from cv.rig import RigGeometry
+from cv.stages import PIPELINE_VERSION, default_pipeline
+from etl.batch import result_row
+from etl.manifest import RunManifest, pipeline_params
+
+
+def write_files(directory, names):
+    """
+    Write small files standing in for photos.
+
+    :param directory: The directory to write to.
+    :param names: File names.
+    :return list: Paths of the files.
+    """
+    paths = [os.path.join(str(directory), name) for name in names]
+    for path in paths:
+        with open(path, "wb") as output:
+            output.write(path.encode())
+    return paths
+
+
+def record_run(manifest, files, failed=()):
+    """
+    Record a run in which every image succeeded but the failed ones.
+
+    :param manifest: The RunManifest.
+    :param files: The images processed.
+    :param failed: The images that failed.
+    :return:
+    """
+    for file_name in manifest.pending(files):
+        error = RuntimeError("broken") if file_name in failed else None
+        manifest.record(result_row(file_name, None if error else {}, error, 0.1))
+
+
+def test_skips_done_and_retries_failed(tmp_path):
+    files = write_files(tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, default_pipeline()) as manifest:
+        assert manifest.pending(files) == files
+        record_run(manifest, files, failed=files[1:2])
+        assert manifest.summary() == {"ok": 2, "failed": 1}
+    with RunManifest(path, default_pipeline()) as manifest:
+        assert manifest.pending(files) == files[1:2]
+        record_run(manifest, files)
+        assert manifest.pending(files) == []
+        assert manifest.summary() == {"ok": 3}
+
+
+def test_new_and_changed_files_are_pending(tmp_path):
+    files = write_files(tmp_path, ["a.jpg", "b.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, default_pipeline()) as manifest:
+        record_run(manifest, files)
+    files += write_files(tmp_path, ["c.jpg"])
+    with open(files[0], "ab") as changed:
+        changed.write(b"more")
+    with RunManifest(path, default_pipeline()) as manifest:
+        assert manifest.pending(files) == [files[0], files[2]]
+
+
+def test_touched_file_is_skipped_with_hashing(tmp_path):
+    files = write_files(tmp_path, ["a.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, default_pipeline(), hashing=True) as manifest:
+        record_run(manifest, files)
+    os.utime(files[0], ns=(1, 1))
+    with RunManifest(path, default_pipeline(), hashing=True) as manifest:
+        assert manifest.pending(files) == []
+    with RunManifest(path, default_pipeline()) as manifest:
+        # the new modification time was stored, so no hash is needed any more
+        assert manifest.pending(files) == []
+
+
+def test_other_parameters_or_version_are_pending(tmp_path):
+    files = write_files(tmp_path, ["a.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, default_pipeline()) as manifest:
+        record_run(manifest, files)
+    with RunManifest(path, default_pipeline().configured({"contours.epsilon": 0.05})) as manifest:
+        assert manifest.pending(files) == files
+    with RunManifest(path, default_pipeline("half")) as manifest:
+        assert manifest.pending(files) == files
+    with RunManifest(path, default_pipeline(), version="%s-next" % PIPELINE_VERSION) as manifest:
+        assert manifest.pending(files) == files
+    with RunManifest(path, default_pipeline()) as manifest:
+        assert manifest.pending(files) == []
+
+
+def test_rig_cache_changes_the_parameters(tmp_path):
+    pipeline = default_pipeline()
+    assert pipeline_params(RigGeometry(pipeline)) != pipeline_params(pipeline)
+    assert pipeline_params(RigGeometry(pipeline, max_shift=4)) != pipeline_params(RigGeometry(pipeline))
+    assert pipeline_params(RigGeometry(pipeline)) == pipeline_params(RigGeometry(default_pipeline()))
+    files = write_files(tmp_path, ["a.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, pipeline) as manifest:
+        record_run(manifest, files)
+    with RunManifest(path, RigGeometry(pipeline)) as manifest:
+        assert manifest.pending(files) == files
+
+
+def test_vanished_file_is_pending(tmp_path):
+    files = write_files(tmp_path, ["a.jpg", "b.jpg"])
+    path = str(tmp_path / "run.sqlite")
+    with RunManifest(path, default_pipeline()) as manifest:
+        record_run(manifest, files)
+        os.remove(files[0])
+        assert manifest.pending(files + [str(tmp_path / "never.jpg")]) == [files[0], str(tmp_path / "never.jpg")]
+        # its failure cannot be stored without a size, and is reported again next time
+        manifest.record(result_row(files[0], error=FileNotFoundError(files[0])))
+        assert manifest.summary() == {"ok": 2}
@@ -0,0 +1,65 @@
+"""
+tests/test_processing.py
+
+This python file tests that the background processing of the GUI
+survives a worker process dying outright on one image, and that
+the previews of a new drop do not wait behind earlier images.
+"""
+
+'''Imports'''
+import os
+import time
+from gui.processing import BackgroundProcessor
+from .test_batch import crashing_pipeline, write_photos
+
+
+def finish(processor, statuses, names, timeout=120):
+    """
+    Poll a processor until every image has its final status.
+
+    :param processor: The BackgroundProcessor.
+    :param statuses: Dict filled with the final status of every image by file name.
+    :param names: File names to wait for.
+    :param timeout: Seconds to wait at most.
+    :return:
+    """
+    deadline = time.monotonic() + timeout
+    while not set(names) <= set(statuses) and time.monotonic() < deadline:
+        for event in processor.poll():
+            if event.status not in ("queued", "preview"):
+                statuses[os.path.basename(event.file_name)] = event.status
+        time.sleep(0.05)
+
+
+def test_worker_crash_fails_only_its_image(tmp_path):
+    names = ["a.jpg", "crash.jpg", "b.jpg", "c.jpg"]
+    processor = BackgroundProcessor(crashing_pipeline(), workers=2, view_size=100)
+    statuses = {}
+    try:
+        processor.submit(write_photos(tmp_path, names))
+        finish(processor, statuses, names)
+        # a drop after the crash goes to the new pool
+        processor.submit(write_photos(tmp_path, ["d.jpg"]))
+        finish(processor, statuses, ["d.jpg"])
+        assert not processor.pending
+    finally:
+        processor.shutdown()
+    assert statuses == {"a.jpg": "done", "crash.jpg": "failed", "b.jpg": "done", "c.jpg": "done", "d.jpg": "done"}
+
+
+def test_previews_of_a_new_drop_go_first(tmp_path):
+    names = ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"]
+    processor = BackgroundProcessor(workers=1, view_size=100)
+    events = []
+    try:
+        processor.submit(write_photos(tmp_path, names[:4]))
+        processor.submit(write_photos(tmp_path, names[4:]))
+        deadline = time.monotonic() + 120
+        while sum(status == "done" for _, status in events) < len(names) and time.monotonic() < deadline:
+            events.extend((os.path.basename(event.file_name), event.status) for event in processor.poll())
+            time.sleep(0.05)
+    finally:
+        processor.shutdown()
+    # the second drop's preview does not wait for the full runs of the first
+    assert events.index(("e.jpg", "preview")) < events.index(("a.jpg", "done"))
+    assert {name for name, status in events if status == "done"} == set(names)
@@ -0,0 +1,71 @@
+"""
+tests/test_scheduler.py
+
+This python file tests that thread limits set for a run in the
+caller's own process are put back afterwards, and that calibrate()
+starts the pools of a plan before timing it.
+"""
+
+'''Imports'''
+import os
+import cv2
+from etl.scheduler import ThreadPlan, calibrate, limited_threads
+from etl.streaming import stream
+from tests.test_batch import write_photos
+
+
+def test_limited_threads_restores_the_caller(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    monkeypatch.delenv("MKL_NUM_THREADS", raising=False)
+    before = cv2.getNumThreads()
+    cv2.setNumThreads(3)
+    try:
+        with limited_threads(1, 1):
+            assert cv2.getNumThreads() == 1
+            assert os.environ["OMP_NUM_THREADS"] == os.environ["MKL_NUM_THREADS"] == "1"
+        assert cv2.getNumThreads() == 3
+        assert os.environ["OMP_NUM_THREADS"] == "7"
+        assert "MKL_NUM_THREADS" not in os.environ
+    finally:
+        cv2.setNumThreads(before)
+
+
+def test_stream_restores_the_caller(tmp_path, monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    files = write_photos(tmp_path, ["a.jpg", "b.jpg"])
+    rows = list(stream(files, threads=ThreadPlan(1, 1, 1)))
+    assert [row["status"] for row in rows] == ["ok", "ok"]
+    assert os.environ["OMP_NUM_THREADS"] == "7"
+
+
+class FakePool:
+    """
+    Stands in for a process pool, remembering whether it was shut down.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.running = True
+
+    def shutdown(self):
+        self.running = False
+
+
+def test_calibrate_runs_every_plan_on_started_pools():
+    plans = [ThreadPlan(1, 2, 1), ThreadPlan(2, 1, 1)]
+    started = []
+
+    def start(plan):
+        started.append(FakePool(plan))
+        return started[-1:]
+
+    def run(files, plan, pools):
+        assert [pool.plan for pool in pools] == [plan] and pools[0].running
+        return [{"status": "ok"} for _ in files]
+
+    best, timings = calibrate(["a.jpg", "b.jpg"], run, plans, start)
+    # a warm run with the first plan, then one timed run per plan
+    assert [pool.plan for pool in started] == [plans[0]] + plans
+    assert not any(pool.running for pool in started)
+    assert [plan for plan, _ in timings] == plans
+    assert best in plans
@@ -0,0 +1,49 @@
+"""
+tests/test_shared.py
+
+This python file tests that the shared memory mode survives a
+decode or CV process dying outright on one image.
+"""
+
+'''Imports'''
+import os
+import pytest
+from cv.pipeline import Pipeline, Stage
+from cv.stages import default_stages
+from etl.shared import run_shared
+from .test_batch import crashing_pipeline, write_photos
+
+
+class CrashCheck(Stage):
+    """
+    Stage after the decode that kills its process on files named crash.
+    """
+    name = "crash_check"
+    inputs = ("file_name",)
+    outputs = ("crash_checked",)
+
+    def process(self, file_name):
+        if os.path.basename(file_name).startswith("crash"):
+            os._exit(1)
+        return True
+
+
+def crashing_cv_pipeline():
+    """
+    Build the default pipeline with a stage crashing in the CV processes.
+
+    :return Pipeline:
+    """
+    stages = default_stages()
+    return Pipeline(stages[:1] + [CrashCheck()] + stages[1:])
+
+
+@pytest.mark.parametrize("build_pipeline", [crashing_pipeline, crashing_cv_pipeline])
+def test_process_crash_fails_only_its_image(tmp_path, build_pipeline):
+    names = ["a.jpg", "b.jpg", "crash.jpg", "c.jpg", "d.jpg"]
+    files = write_photos(tmp_path, names)
+    rows = {os.path.basename(row["file"]): row
+            for row in run_shared(files, build_pipeline(), decode_workers=2, cv_workers=2)}
+    assert sorted(rows) == sorted(names)
+    assert rows["crash.jpg"]["status"] == "failed"
+    assert all(rows[name]["status"] == "ok" for name in names if name != "crash.jpg")
@@ -0,0 +1,98 @@
+"""
+tests/test_store.py
+
+This python file tests appending rows to the columnar feature
+store and reading them back column by column.
+"""
+
+'''Imports'''
+import numpy as np
+from benchmarks.synthetic import draw_tray, frame_size
+from etl.batch import process_file, result_row
+from etl.store import FeatureStore
+from tests.test_batch import write_photos
+
+
+def feature_row(file_name, vertices, edge_row=100):
+    """
+    Build a successful row with a polygon of the given number of vertices.
+
+    :param file_name: Path to the image.
+    :param vertices: Number of polygon vertices.
+    :param edge_row: The edge row feature.
+    :return dict:
+    """
+    polygon = np.arange(2 * vertices, dtype=np.int32).reshape(-1, 2) + edge_row
+    features = {"edge_row": edge_row, "crop_top": edge_row, "crop_bottom": 2500, "crop_left": 200,
+                "crop_right": 2200, "corner_count": 4, "line_count": 2, "contour_count": 10,
+                "contour_area": 1.5e6, "contour_perimeter": 5000.0, "polygon_vertices": vertices,
+                "polygon": polygon, "line_edge_row": ""}
+    return result_row(file_name, features, seconds=0.5)
+
+
+def test_append_and_read_columns(tmp_path):
+    rows = [feature_row("a.jpg", 4, 100), result_row("b.jpg", error=ValueError("no contours")),
+            feature_row("c.jpg", 6, 300)]
+    with FeatureStore(str(tmp_path), batch_size=2) as store:
+        for row in rows:
+            store.append(row)
+        # one full batch is written, the last row is still buffered
+        assert len(store.parts()) == 1
+    store = FeatureStore(str(tmp_path))
+    assert len(store.parts()) == 2 and len(store) == 3
+    assert store.column("file_name").tolist() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert store.column("ok").tolist() == [True, False, True]
+    assert store.column("error").tolist() == ["", "ValueError: no contours", ""]
+    assert store.column("edge_row").tolist() == [100, -1, 300]
+    assert store.column("edge_row").dtype == np.int32
+    assert np.isnan(store.column("contour_area")[1])
+    assert store.column("line_edge_row").tolist() == [-1, -1, -1]
+
+
+def test_polygon_vertices_are_kept(tmp_path):
+    rows = [feature_row("a.jpg", 4), result_row("b.jpg", error=ValueError("no contours")), feature_row("c.jpg", 6)]
+    with FeatureStore(str(tmp_path)) as store:
+        for row in rows:
+            store.append(row)
+    polygons = FeatureStore(str(tmp_path)).column("polygon")
+    assert [len(polygon) for polygon in polygons] == [4, 0, 6]
+    assert np.array_equal(polygons[0], rows[0]["polygon"]) and np.array_equal(polygons[2], rows[2]["polygon"])
+    assert polygons[2].dtype == np.int32
+
+
+def test_parts_without_polygons(tmp_path):
+    with FeatureStore(str(tmp_path)) as store:
+        store.append(feature_row("a.jpg", 4))
+    # a part written before the polygon column existed
+    part = store.parts()[0]
+    with np.load(part) as archive:
+        columns = {name: archive[name] for name in archive if name not in ("polygon", "polygon_lengths")}
+    np.savez(part.replace("part-", "part-0"), **columns)
+    with FeatureStore(str(tmp_path)) as store:
+        store.append(feature_row("b.jpg", 6))
+    polygons = store.column("polygon")
+    assert polygons[0] is None and [len(polygon) for polygon in polygons[1:]] == [4, 6]
+    assert store.column("polygon_vertices").tolist() == [4, 4, 6]
+
+
+def test_polygon_of_a_processed_photo(tmp_path):
+    file_name = write_photos(tmp_path, ["a.jpg"])[0]
+    row = process_file(file_name)
+    with FeatureStore(str(tmp_path / "store")) as store:
+        store.append(row)
+    polygon = FeatureStore(str(tmp_path / "store")).column("polygon")[0]
+    _, truth = draw_tray(*frame_size(2), seed=0)
+    assert len(polygon) == row["polygon_vertices"] == len(truth.polygon)
+    assert np.abs(np.sort(polygon, axis=0) - np.sort(truth.polygon, axis=0)).max() <= 3
+
+
+def test_done_files(tmp_path):
+    with FeatureStore(str(tmp_path)) as store:
+        assert store.done_files() == set() and len(store) == 0
+        assert len(store.column("polygon")) == 0
+        store.append(feature_row("a.jpg", 4))
+        store.append(result_row("b.jpg", error=ValueError("no contours")))
+    with FeatureStore(str(tmp_path)) as store:
+        assert store.done_files() == {"a.jpg"}
+        store.append(feature_row("b.jpg", 4))
+    assert FeatureStore(str(tmp_path)).done_files() == {"a.jpg", "b.jpg"}
@@ -0,0 +1,58 @@
+"""
+tests/test_tiling.py
+
+This python file tests that the tiled operators give the same
+results as the untiled ones however small the memory budget.
+"""
+
+'''Imports'''
+import cv2
+import numpy as np
+import pytest
+from benchmarks.synthetic import draw_tray, frame_size
+from cv.tiling import WORKING_BYTES, tiled_bilateral, tiled_canny, tiled_harris
+
+
+@pytest.fixture(scope="module")
+def gray():
+    image, _ = draw_tray(*frame_size(2), seed=0)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def budgets(image, operator):
+    """
+    List budgets from the smallest tiles, of MIN_TILE_ROWS core rows, to a few tiles per image.
+
+    :param image: The image to tile.
+    :param operator: Key of WORKING_BYTES.
+    :return list: Bytes of working memory per tile.
+    """
+    row_bytes = image.shape[1] * WORKING_BYTES[operator]
+    return [0, 100 * row_bytes, image.shape[0] // 3 * row_bytes]
+
+
+@pytest.mark.parametrize("index", range(3))
+@pytest.mark.parametrize("parameters", [(9, 75, 75), (0, 50, 4)])
+def test_tiled_bilateral_matches_untiled(gray, parameters, index):
+    budget = budgets(gray, "bilateral")[index]
+    assert np.array_equal(tiled_bilateral(gray, *parameters, budget=budget), cv2.bilateralFilter(gray, *parameters))
+
+
+@pytest.mark.parametrize("index", range(3))
+@pytest.mark.parametrize("parameters", [(2, 3, 0.04), (5, 5, 0.06)])
+def test_tiled_harris_matches_untiled(gray, parameters, index):
+    edges = cv2.Canny(gray, 50, 150)
+    budget = budgets(edges, "harris")[index]
+    expected = cv2.cornerHarris(edges, *parameters)
+    result = tiled_harris(edges, *parameters, budget=budget)
+    assert result.dtype == expected.dtype
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6 * np.abs(expected).max())
+
+
+def test_tiled_canny_stays_close(gray):
+    expected = cv2.Canny(gray, 50, 150)
+    result = tiled_canny(gray, 50, 150, budget=0)
+    # only weak edges joined to a strong one outside the halo can go
+    assert np.count_nonzero(result != expected) <= 0.001 * np.count_nonzero(expected)
+    assert not np.any(result & ~expected)
+
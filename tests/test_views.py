@@ -0,0 +1,51 @@
+"""
+tests/test_views.py
+
+This python file tests that the result views draw the same
+markers whatever the decoded size of the image.
+"""
+
+'''Imports'''
+import numpy as np
+import pytest
+from cv.stages import CropBox
+from gui.views import render_views
+
+# Rows and columns of the full resolution frame
+FULL_SHAPE = (2600, 2400)
+
+
+def blank_frame(scale):
+    """
+    Build the frame of a black image decoded at a scale, with a square tray polygon.
+
+    :param scale: Decoded pixels per full resolution pixel.
+    :return dict: The frame keys read by render_views().
+    """
+    shape = tuple(int(size * scale) for size in FULL_SHAPE)
+    polygon = np.array([[[600, 800]], [[1800, 800]], [[1800, 2000]], [[600, 2000]]], np.int32)
+    return {
+        "scale": scale,
+        "crop": CropBox(400, 2400, 200, 2200),
+        "edges": np.zeros(shape, np.uint8),
+        "corners": np.zeros((0, 1, 2), np.float32),
+        "gray": np.zeros(shape, np.uint8),
+        "horizontal_lines": np.zeros((0, 4), np.int32),
+        "enhanced": np.zeros(shape, np.uint8),
+        "contours": [np.round(polygon * scale).astype(np.int32)],
+        "polygon": polygon,
+    }
+
+
+@pytest.mark.parametrize("scale, view_size", [(0.5, 800), (0.25, 400)])
+def test_markers_keep_their_size_on_smaller_decodes(scale, view_size):
+    full = render_views(blank_frame(1.0), view_size)
+    small = render_views(blank_frame(scale), view_size)
+    assert full["contours"].shape == small["contours"].shape
+    # the contour is drawn as thick, and the vertex discs as large, as on the full decode
+    contour_pixels = np.count_nonzero(full["contours"])
+    assert abs(np.count_nonzero(small["contours"]) - contour_pixels) <= 0.1 * contour_pixels
+    vertex_pixels = np.count_nonzero(full["vertices"]) - contour_pixels
+    assert vertex_pixels > 0
+    assert (abs(np.count_nonzero(small["vertices"]) - np.count_nonzero(small["contours"]) - vertex_pixels)
+            <= 0.2 * vertex_pixels)
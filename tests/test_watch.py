@@ -0,0 +1,32 @@
+"""
+tests/test_watch.py
+
+This python file tests that the watch folder mode keeps taking
+new photos after a worker process dies outright on one.
+"""
+
+'''Imports'''
+import os
+import time
+from etl.watch import FolderWatcher, ingest
+from .test_batch import crashing_pipeline, write_photos
+
+
+def test_worker_crash_keeps_watching(tmp_path):
+    names = ["a.jpg", "crash.jpg", "b.jpg"]
+    write_photos(tmp_path, names)
+    rows = {}
+    deadline = time.monotonic() + 120
+    with FolderWatcher(str(tmp_path), stable_seconds=0.1, poll_seconds=0.05, include_existing=True) as watcher:
+        for row in ingest(watcher, crashing_pipeline(), workers=2):
+            if row is not None:
+                rows[os.path.basename(row["file"])] = row
+            if len(rows) == len(names) == 3:
+                # a photo taken after the crash is still processed
+                write_photos(tmp_path, ["c.jpg"])
+                names.append("c.jpg")
+            if len(rows) == len(names) == 4 or time.monotonic() > deadline:
+                break
+    assert sorted(rows) == sorted(names)
+    assert rows["crash.jpg"]["status"] == "failed"
+    assert all(rows[name]["status"] == "ok" for name in names if name != "crash.jpg")